@@ -0,0 +1,187 @@
+import json
+import threading
+import time
+from pymongo import DESCENDING
+from pymongo.errors import OperationFailure, PyMongoError
+from instrumentation import EventLog
+from storage import InsertFeed, as_utc
+
+# รหัส error เมื่อ MongoDB ไม่ใช่ replica set จึงใช้ change stream ไม่ได้
+CHANGE_STREAM_UNSUPPORTED = 40573
+POLL_INTERVAL = 5
+
+log = EventLog("alerts")
+
+
+class AlertRule:
+    # กฎหนึ่งข้อ: metric เกิน (">") หรือต่ำกว่า ("<") threshold ต่อเนื่องนาน debounce_s วินาทีจึงแจ้งเตือน
+    # และต้องกลับมาพ้น threshold อีก hysteresis หน่วยจึงถือว่าหายแล้ว (กันแจ้งเตือนรัวตอนค่าแกว่ง)
+    def __init__(self, name, metric, op, threshold, message, hysteresis=0.0, debounce_s=0.0,
+                 camera_id=None, location=None):
+        if op not in (">", "<"):
+            raise ValueError(f"unknown operator {op!r} in alert rule {name!r}")
+        self.name = name
+        self.metric = metric
+        self.op = op
+        self.threshold = float(threshold)
+        self.message = message
+        self.hysteresis = float(hysteresis)
+        self.debounce_s = float(debounce_s)
+        self.camera_id = camera_id
+        self.location = location
+
+    def applies_to(self, reading):
+        if self.camera_id is not None and reading.get("camera_id") != self.camera_id:
+            return False
+        if self.location is not None and reading.get("location") != self.location:
+            return False
+        return True
+
+    def breached(self, value):
+        return value > self.threshold if self.op == ">" else value < self.threshold
+
+    def cleared(self, value):
+        if self.op == ">":
+            return value <= self.threshold - self.hysteresis
+        return value >= self.threshold + self.hysteresis
+
+    def format(self, value):
+        return self.message.format(threshold=self.threshold, value=value)
+
+
+DEFAULT_RULES = [
+    AlertRule("temp_high", "temperature_c", ">", 35.0,
+              "🔥 อุณหภูมิสูงเกิน {threshold}°C\n🌡️ ตอนนี้: {value:.1f}°C", hysteresis=1.0, debounce_s=6),
+    AlertRule("temp_low", "temperature_c", "<", 15.0,
+              "❄️ อุณหภูมิต่ำเกิน {threshold}°C\n🌡️ ตอนนี้: {value:.1f}°C", hysteresis=1.0, debounce_s=6),
+    AlertRule("humidity_high", "humidity_percent", ">", 80.0,
+              "💧 ความชื้นสูงเกิน {threshold}%\n💦 ตอนนี้: {value:.1f}%", hysteresis=3.0, debounce_s=6),
+    AlertRule("humidity_low", "humidity_percent", "<", 50.0,
+              "⚠️ ความชื้นต่ำเกิน {threshold}%\n💦 ตอนนี้: {value:.1f}%", hysteresis=3.0, debounce_s=6),
+]
+
+
+def load_rules(path=None):
+    # ไฟล์ JSON เป็น list ของ object ที่มี key ตรงกับพารามิเตอร์ของ AlertRule
+    if not path:
+        return list(DEFAULT_RULES)
+    with open(path, encoding="utf-8") as f:
+        return [AlertRule(**rule) for rule in json.load(f)]
+
+
+class AlertState:
+    __slots__ = ("active", "breach_since")
+
+    def __init__(self):
+        self.active = False
+        self.breach_since = None
+
+
+class AlertEngine:
+    # เก็บสถานะแจ้งเตือนแยกตาม (กล้อง, ชั้นวาง, กฎ) จึงรองรับหลายชั้นวางพร้อมกัน
+    def __init__(self, rules, notify):
+        self.rules = rules
+        self.notify = notify
+        self._states = {}
+        self._lock = threading.Lock()
+
+    def evaluate(self, reading):
+        # ค่าที่ค้างจากเซ็นเซอร์ที่อ่านไม่ได้นาน ๆ ไม่ใช้ตัดสินการแจ้งเตือน
+        if reading.get("env_stale"):
+            return []
+        ts = as_utc(reading["timestamp"])
+        alerts = []
+        with self._lock:
+            for rule in self.rules:
+                value = reading.get(rule.metric)
+                if value is None or not rule.applies_to(reading):
+                    continue
+                value = float(value)
+                key = (reading.get("camera_id"), reading.get("location"), rule.name)
+                state = self._states.setdefault(key, AlertState())
+
+                if rule.breached(value):
+                    if state.breach_since is None:
+                        state.breach_since = ts
+                    if not state.active and (ts - state.breach_since).total_seconds() >= rule.debounce_s:
+                        state.active = True
+                        alerts.append(rule.format(value))
+                elif rule.cleared(value):
+                    state.active = False
+                    state.breach_since = None
+                elif not state.active:
+                    # อยู่ในช่วง hysteresis แต่ยังไม่เคยแจ้ง: เริ่มนับ debounce ใหม่
+                    state.breach_since = None
+
+        if alerts:
+            msg = (
+                "⚠️ แจ้งเตือนสภาพแวดล้อมไม่เหมาะสม\n"
+                f"📍 {reading.get('location')} ({reading.get('camera_id')})\n\n"
+                + "\n\n".join(alerts)
+                + f"\n\n⏰ เวลา: {ts.strftime('%Y-%m-%d %H:%M:%S')}"
+            )
+            self.notify(msg)
+        return alerts
+
+
+def watch_inserts(collection, handler, stop_event=None, poll_interval=POLL_INTERVAL):
+    # ส่งเอกสารที่เพิ่งถูก insert ให้ handler ทันทีผ่าน change stream
+    # ถ้า server ไม่รองรับ (ไม่ใช่ replica set) จะเปลี่ยนไปใช้การ poll ตาม written_at (ดู InsertFeed)
+    stop_event = stop_event or threading.Event()
+    # เอกสารที่มีอยู่แล้วตอนเริ่มส่งแค่ตัวล่าสุดตัวเดียว ที่เหลือถือว่าเห็นแล้ว
+    feed = InsertFeed(collection)
+    for _ in feed.poll():
+        pass
+    latest = collection.find_one(sort=[("timestamp", DESCENDING)])
+    if latest:
+        _safe_handle(handler, latest)
+
+    resume_token = None
+    streaming = supports_change_streams(collection)
+    if not streaming:
+        log.info("polling", "MongoDB ไม่รองรับ change stream - ใช้การ poll แทน")
+    while streaming and not stop_event.is_set():
+        try:
+            with collection.watch([{"$match": {"operationType": "insert"}}], resume_after=resume_token) as stream:
+                log.info("change_stream", "ติดตามข้อมูลใหม่ผ่าน change stream")
+                while not stop_event.is_set():
+                    change = stream.try_next()
+                    if change is None:
+                        time.sleep(0.2)
+                        continue
+                    resume_token = stream.resume_token
+                    _safe_handle(handler, change["fullDocument"])
+        except OperationFailure as e:
+            if e.code != CHANGE_STREAM_UNSUPPORTED:
+                log.error("change_stream_error", "Change stream error: {error}", error=e)
+                time.sleep(poll_interval)
+                continue
+            log.info("polling", "MongoDB ไม่รองรับ change stream - ใช้การ poll แทน")
+            break
+        except NotImplementedError:
+            log.info("polling", "MongoDB ไม่รองรับ change stream - ใช้การ poll แทน")
+            break
+        except PyMongoError as e:
+            log.error("change_stream_error", "Change stream error: {error}", error=e)
+            time.sleep(poll_interval)
+
+    while not stop_event.is_set():
+        try:
+            for doc in feed.poll():
+                _safe_handle(handler, doc)
+        except PyMongoError as e:
+            log.error("poll_error", "อ่านข้อมูลใหม่ไม่สำเร็จ: {error}", error=e)
+        stop_event.wait(poll_interval)
+
+
+def supports_change_streams(collection):
+    # mongomock (ใช้ใน loadtest.py และ replay.py) ไม่มี change stream เลยต้อง poll เสมอ
+    # ตรวจจากชนิดของ collection โดยตรง error อื่นจาก pymongo จึงไม่ถูกกลบเป็นการ poll เงียบ ๆ
+    return not type(collection).__module__.startswith("mongomock")
+
+
+def _safe_handle(handler, doc):
+    try:
+        handler(doc)
+    except Exception as e:
+        log.error("handler_error", "ประมวลผลข้อมูลใหม่ผิดพลาด: {error}", error=e)
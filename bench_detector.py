@@ -0,0 +1,90 @@
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import time
+import cv2
+import numpy as np
+from export_model import list_images
+
+# วัด latency / FPS / RAM สูงสุด ของแต่ละ backend บนโฟลเดอร์ภาพที่บันทึกไว้
+#   python bench_detector.py --frames recordings/frames \
+#       --backend ultralytics=best.pt --backend onnx=best_int8.onnx --backend ncnn=best_ncnn_model
+# แต่ละ backend รันใน process แยก เพื่อให้ค่า peak RSS ไม่ปนกัน
+
+
+def bench_one(backend, model_path, frames_dir, limit, warmup):
+    from detector import create_detector
+
+    frames = [cv2.resize(cv2.imread(p), (640, 384)) for p in list_images(frames_dir, limit)]
+    if not frames:
+        raise SystemExit(f"ไม่พบรูปภาพใน {frames_dir}")
+
+    start = time.perf_counter()
+    detector = create_detector(backend, model_path)
+    load_s = time.perf_counter() - start
+
+    for frame in frames[:warmup]:
+        detector.detect(frame)
+
+    latencies = []
+    detections = 0
+    start = time.perf_counter()
+    for frame in frames:
+        t0 = time.perf_counter()
+        detections += len(detector.detect(frame))
+        latencies.append(time.perf_counter() - t0)
+    total_s = time.perf_counter() - start
+
+    latencies = np.array(latencies) * 1000
+    return {
+        "backend": backend,
+        "model": model_path,
+        "frames": len(frames),
+        "load_s": load_s,
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "fps": len(frames) / total_s,
+        "detections_per_frame": detections / len(frames),
+        # ru_maxrss บน Linux มีหน่วยเป็น KB
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark detector backends on recorded frames")
+    parser.add_argument("--frames", required=True, help="folder of recorded frames")
+    parser.add_argument("--backend", action="append", default=[], metavar="NAME=MODEL_PATH")
+    parser.add_argument("--limit", type=int, default=300)
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--single", nargs=2, metavar=("NAME", "MODEL_PATH"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        print(json.dumps(bench_one(args.single[0], args.single[1], args.frames, args.limit, args.warmup)))
+        return
+    if not args.backend:
+        parser.error("at least one --backend NAME=MODEL_PATH is required")
+
+    results = []
+    for spec in args.backend:
+        name, path = spec.split("=", 1)
+        proc = subprocess.run(
+            [sys.executable, __file__, "--frames", args.frames, "--limit", str(args.limit),
+             "--warmup", str(args.warmup), "--single", name, path],
+            capture_output=True, text=True,
+        )
+        if proc.returncode != 0:
+            print(f"[❌] {name} ล้มเหลว:\n{proc.stderr[-2000:]}")
+            continue
+        results.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+
+    print(f"{'backend':<12} {'load s':>7} {'p50 ms':>8} {'p95 ms':>8} {'fps':>7} {'det/frm':>8} {'RSS MB':>8}  model")
+    for r in results:
+        print(f"{r['backend']:<12} {r['load_s']:>7.2f} {r['p50_ms']:>8.1f} {r['p95_ms']:>8.1f} "
+              f"{r['fps']:>7.1f} {r['detections_per_frame']:>8.1f} {r['peak_rss_mb']:>8.0f}  {r['model']}")
+
+
+if __name__ == "__main__":
+    main()
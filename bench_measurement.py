@@ -0,0 +1,82 @@
+import argparse
+import time
+from datetime import datetime, timedelta, timezone
+import numpy as np
+from measurement import CameraModel, MaturityBands, SizeEstimator
+
+# เปรียบเทียบการวัดขนาดแบบเดิม (ลูป Python ต่อ track + dict) กับแบบ vectorized
+#   python bench_measurement.py --repeat 2000
+
+SENSOR_WIDTH_MM = 8.46666582
+IMAGE_WIDTH_PX = 640
+FOCAL_LENGTH_MM = 3.2
+THAI_TZ = timezone(timedelta(hours=7))
+
+
+def legacy(ids, boxes, distance_mm):
+    out = {}
+    for locked_id, (x1, y1, x2, y2) in zip(ids, boxes):
+        width_box_px = int(x2) - int(x1)
+        pixel_size_mm = SENSOR_WIDTH_MM / IMAGE_WIDTH_PX
+        bbox_width_mm = width_box_px * pixel_size_mm
+        object_real_width_cm = (bbox_width_mm * distance_mm) / FOCAL_LENGTH_MM / 10
+        maturity_label = "mature" if 1.5 <= object_real_width_cm <= 2 else "immature"
+        out[int(locked_id)] = {
+            "mushroom_id": int(locked_id),
+            "maturity_status": maturity_label,
+            "real_size_cm": object_real_width_cm,
+            "timestamp": datetime.now(tz=THAI_TZ).isoformat(),
+            "camera_id": "cam01",
+            "location": "shelf_3",
+        }
+    return out
+
+
+def random_boxes(n, rng):
+    xy = rng.uniform(0, 560, size=(n, 2))
+    wh = rng.uniform(10, 80, size=(n, 2))
+    boxes = np.concatenate([xy, xy + wh], axis=1).astype(np.float32)
+    boxes[:, [1, 3]] *= 384 / 640
+    return np.round(boxes)
+
+
+def timeit(func, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmark for per-frame size estimation")
+    parser.add_argument("--repeat", type=int, default=1000)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    pinhole = SizeEstimator(CameraModel.from_sensor(SENSOR_WIDTH_MM, FOCAL_LENGTH_MM), MaturityBands())
+    distorted_camera = CameraModel(pinhole.camera.camera_matrix, [-0.3, 0.1, 0, 0, 0])
+    distorted = SizeEstimator(distorted_camera, MaturityBands())
+    depth_map = np.full((12, 20), 120.0)
+
+    # ตรวจว่าได้ความกว้างเท่าสูตรเดิม
+    ids = np.arange(1, 51, dtype=np.int32)
+    boxes = random_boxes(50, rng)
+    old = legacy(ids, boxes, 120)
+    new = pinhole.measure(ids, boxes, 120, time.time())
+    assert np.allclose([old[i]["real_size_cm"] for i in ids], new["width_cm"], rtol=1e-4)
+    assert [old[i]["maturity_status"] for i in ids] == [pinhole.label(r) for r in new]
+
+    print(f"{'tracks':>6} {'legacy us':>10} {'vector us':>10} {'speedup':>8} {'+distort us':>12} {'+depthmap us':>13}")
+    for n in (1, 5, 10, 25, 50, 100, 200):
+        ids = np.arange(1, n + 1, dtype=np.int32)
+        boxes = random_boxes(n, rng)
+        now = time.time()
+        t_legacy = timeit(lambda: legacy(ids, boxes, 120), args.repeat)
+        t_vector = timeit(lambda: pinhole.measure(ids, boxes, 120, now), args.repeat)
+        t_distort = timeit(lambda: distorted.measure(ids, boxes, 120, now), args.repeat)
+        t_depth = timeit(lambda: pinhole.measure(ids, boxes, depth_map, now), args.repeat)
+        print(f"{n:>6} {t_legacy:>10.1f} {t_vector:>10.1f} {t_legacy / t_vector:>7.1f}x {t_distort:>12.1f} {t_depth:>13.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+import argparse
+import time
+import numpy as np
+from reid_index import EMBEDDING_DIM, ReIdIndex
+
+# วัดเวลาจับคู่ track ใหม่กับ re-ID index เมื่อมีเห็ดเก็บไว้หลายพันดอกต่อชั้นวาง
+# เทียบ grid + cosine similarity กับการเทียบทุกดอก (brute force) และตรวจว่าได้ผลเดียวกัน
+#   python bench_reid.py --queries 50
+
+
+def random_embeddings(n, rng):
+    hist = rng.dirichlet(np.full(EMBEDDING_DIM, 0.3), size=n)
+    return np.sqrt(hist).astype(np.float32)
+
+
+def perturb(embeddings, rng, amount=0.15):
+    noisy = (1 - amount) * embeddings + amount * random_embeddings(len(embeddings), rng)
+    return noisy / np.linalg.norm(noisy, axis=1, keepdims=True)
+
+
+def brute_force(index, centers, embeddings, now):
+    n = len(index)
+    ids, stored_centers = index.ids[:n], index.centers[:n]
+    stored_embeddings, last_seen = index.embeddings[:n], index.last_seen[:n]
+    results = []
+    taken = set()
+    for center, embedding in zip(centers, embeddings):
+        d = stored_centers - center
+        sims = stored_embeddings @ embedding
+        ok = (d[:, 0] ** 2 + d[:, 1] ** 2 <= index.radius_px ** 2) & (last_seen >= now - index.max_gap_s)
+        ok &= sims >= index.min_similarity
+        if taken:
+            ok &= ~np.isin(ids, list(taken))
+        if ok.any():
+            best = np.flatnonzero(ok)[np.argmax(sims[ok])]
+            results.append(int(ids[best]))
+            taken.add(int(ids[best]))
+        else:
+            results.append(None)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark re-ID lookups against a large per-shelf index")
+    parser.add_argument("--queries", type=int, default=50, help="new tracks per frame")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    now = time.time()
+    print(f"{'stored':>7} {'grid us/q':>10} {'brute us/q':>11} {'speedup':>8} {'re-id ok':>9} {'new ok':>7}")
+    for n in (500, 1000, 2000, 5000, 10000, 20000):
+        index = ReIdIndex("bench", "shelf", radius_px=20, cell_px=32, min_similarity=0.8)
+        centers = rng.uniform([0, 0], [640, 384], size=(n, 2)).astype(np.float32)
+        embeddings = random_embeddings(n, rng)
+        # ดอกส่วนใหญ่เห็นล่าสุดไม่นาน บางส่วนเก่ากว่า max_gap_s (ไม่ควรถูกจับคู่)
+        seen = now - rng.uniform(0, 2 * index.max_gap_s, size=n)
+        for i in range(n):
+            index.observe([i + 1], centers[i:i + 1], embeddings[i:i + 1], seen[i])
+
+        # track ใหม่: ดอกเดิมที่ตำแหน่งเลื่อนเล็กน้อย/ภาพต่างเล็กน้อย ปนกับดอกที่ไม่เคยเห็น
+        known = rng.choice(np.flatnonzero(seen >= now - index.max_gap_s), size=args.queries * 4 // 5, replace=False)
+        q_centers = np.concatenate([centers[known] + rng.normal(0, 3, size=(len(known), 2)),
+                                    rng.uniform([0, 0], [640, 384], size=(args.queries - len(known), 2))])
+        q_embeddings = np.concatenate([perturb(embeddings[known], rng),
+                                       random_embeddings(args.queries - len(known), rng)]).astype(np.float32)
+        q_centers = q_centers.astype(np.float32)
+
+        grid = index.match_many(q_centers, q_embeddings, now)
+        brute = brute_force(index, q_centers, q_embeddings, now)
+        assert grid == brute, "grid lookup disagrees with brute force"
+        reid_ok = np.mean([m == k + 1 for m, k in zip(grid, known)])
+        new_ok = np.mean([m is None for m in grid[len(known):]])
+
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            index.match_many(q_centers, q_embeddings, now)
+        t_grid = (time.perf_counter() - start) / (args.repeat * args.queries) * 1e6
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            brute_force(index, q_centers, q_embeddings, now)
+        t_brute = (time.perf_counter() - start) / (args.repeat * args.queries) * 1e6
+        print(f"{n:>7} {t_grid:>10.1f} {t_brute:>11.1f} {t_brute / t_grid:>7.1f}x {reid_ok:>9.2f} {new_ok:>7.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+import os
+import cv2
+import numpy as np
+
+# ตัวตรวจจับเห็ดแบบเลือก backend ได้ ทุกตัวคืนค่าเป็น array (N, 5) = x1, y1, x2, y2, score
+# ที่กรองคลาส/คะแนน ทำ NMS และตัดขอบภาพมาแล้ว
+BACKENDS = ("ultralytics", "onnx", "openvino", "ncnn")
+
+
+class Detector:
+    def __init__(self, class_id=0, score_threshold=0.3, iou_threshold=0.45, imgsz=640):
+        self.class_id = class_id
+        self.score_threshold = score_threshold
+        self.iou_threshold = iou_threshold
+        self.imgsz = imgsz
+
+    def detect(self, frame):
+        raise NotImplementedError
+
+    def detect_batch(self, frames):
+        # รวมหลายภาพ (เช่นจากหลายกล้อง) ในการเรียกครั้งเดียว backend ที่รองรับ batch จะ override
+        return [self.detect(frame) for frame in frames]
+
+    def _clip(self, dets, width, height):
+        dets[:, [0, 2]] = np.clip(dets[:, [0, 2]], 0, width - 1)
+        dets[:, [1, 3]] = np.clip(dets[:, [1, 3]], 0, height - 1)
+        return dets
+
+
+def letterbox(frame, imgsz):
+    # ย่อภาพโดยรักษาสัดส่วนแล้วเติมขอบสีเทา (114) ให้เป็น imgsz x imgsz เหมือน ultralytics
+    # ใช้ทั้งตอน inference และตอน calibrate INT8 (export_model.py) ให้ได้ภาพแบบเดียวกัน
+    height, width = frame.shape[:2]
+    scale = min(imgsz / width, imgsz / height)
+    new_w, new_h = int(round(width * scale)), int(round(height * scale))
+    pad_x = (imgsz - new_w) // 2
+    pad_y = (imgsz - new_h) // 2
+    canvas = np.full((imgsz, imgsz, 3), 114, dtype=np.uint8)
+    canvas[pad_y:pad_y + new_h, pad_x:pad_x + new_w] = cv2.resize(frame, (new_w, new_h))
+    blob = cv2.dnn.blobFromImage(canvas, 1 / 255.0, swapRB=True)
+    return blob, scale, pad_x, pad_y
+
+
+class UltralyticsDetector(Detector):
+    # ใช้ PyTorch ผ่าน ultralytics เหมือนเดิม แต่ให้ ultralytics กรองคลาส/คะแนนให้
+    def __init__(self, weights, **kwargs):
+        super().__init__(**kwargs)
+        from ultralytics import YOLO
+        self.model = YOLO(weights)
+
+    def detect(self, frame):
+        return self.detect_batch([frame])[0]
+
+    def detect_batch(self, frames):
+        results = self.model(list(frames), conf=self.score_threshold, iou=self.iou_threshold,
+                             classes=[self.class_id], imgsz=self.imgsz, verbose=False)
+        dets = []
+        for frame, result in zip(frames, results):
+            data = result.boxes.data.cpu().numpy()
+            height, width = frame.shape[:2]
+            dets.append(self._clip(data[:, :5].astype(np.float32), width, height))
+        return dets
+
+
+class RawYoloDetector(Detector):
+    # backend ที่ได้ output ดิบของ YOLOv8 (batch, 4 + จำนวนคลาส, N) ต้อง letterbox / NMS เอง
+    # batch_inputs = True เมื่อโมเดลรับ batch ได้ (export แบบ dynamic)
+    batch_inputs = False
+
+    def detect(self, frame):
+        return self.detect_batch([frame])[0]
+
+    def detect_batch(self, frames):
+        prepared = [self._letterbox(frame) for frame in frames]
+        if self.batch_inputs and len(prepared) > 1:
+            outputs = np.asarray(self._infer(np.concatenate([p[0] for p in prepared])))
+        else:
+            outputs = np.concatenate([np.asarray(self._infer(p[0])) for p in prepared])
+        return [self._postprocess(output, frame, *p[1:]) for output, frame, p in zip(outputs, frames, prepared)]
+
+    def _postprocess(self, output, frame, scale, pad_x, pad_y):
+        height, width = frame.shape[:2]
+        preds = output.T
+
+        scores = preds[:, 4 + self.class_id]
+        preds = preds[scores > self.score_threshold]
+        scores = scores[scores > self.score_threshold]
+        if not len(preds):
+            return np.zeros((0, 5), dtype=np.float32)
+
+        # cx, cy, w, h ในภาพ letterbox -> x, y, w, h ในภาพจริง
+        boxes = np.empty((len(preds), 4), dtype=np.float32)
+        boxes[:, 0] = (preds[:, 0] - preds[:, 2] / 2 - pad_x) / scale
+        boxes[:, 1] = (preds[:, 1] - preds[:, 3] / 2 - pad_y) / scale
+        boxes[:, 2] = preds[:, 2] / scale
+        boxes[:, 3] = preds[:, 3] / scale
+        keep = cv2.dnn.NMSBoxes(boxes.tolist(), scores.tolist(), self.score_threshold, self.iou_threshold)
+        keep = np.asarray(keep, dtype=np.int64).reshape(-1)
+
+        dets = np.empty((len(keep), 5), dtype=np.float32)
+        dets[:, 0] = boxes[keep, 0]
+        dets[:, 1] = boxes[keep, 1]
+        dets[:, 2] = boxes[keep, 0] + boxes[keep, 2]
+        dets[:, 3] = boxes[keep, 1] + boxes[keep, 3]
+        dets[:, 4] = scores[keep]
+        return self._clip(dets, width, height)
+
+    def _letterbox(self, frame):
+        return letterbox(frame, self.imgsz)
+
+    def _infer(self, blob):
+        raise NotImplementedError
+
+
+class OnnxDetector(RawYoloDetector):
+    def __init__(self, model_path, threads=None, **kwargs):
+        super().__init__(**kwargs)
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = threads or os.cpu_count()
+        self.session = ort.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        self.batch_inputs = not isinstance(model_input.shape[0], int)
+
+    def _infer(self, blob):
+        return self.session.run(None, {self.input_name: blob})[0]
+
+
+class OpenVINODetector(RawYoloDetector):
+    # model_path เป็นไฟล์ .xml หรือโฟลเดอร์ที่ ultralytics export ออกมา
+    def __init__(self, model_path, **kwargs):
+        super().__init__(**kwargs)
+        import openvino as ov
+        if os.path.isdir(model_path):
+            model_path = next(os.path.join(model_path, f) for f in os.listdir(model_path) if f.endswith(".xml"))
+        core = ov.Core()
+        self.compiled = core.compile_model(core.read_model(model_path), "CPU")
+        self.output = self.compiled.output(0)
+
+    def _infer(self, blob):
+        return self.compiled([blob])[self.output]
+
+
+class NcnnDetector(RawYoloDetector):
+    # model_path เป็นโฟลเดอร์ *_ncnn_model ที่มี model.ncnn.param / model.ncnn.bin
+    def __init__(self, model_path, threads=None, **kwargs):
+        super().__init__(**kwargs)
+        import ncnn
+        self.ncnn = ncnn
+        self.net = ncnn.Net()
+        self.net.opt.num_threads = threads or os.cpu_count()
+        self.net.load_param(os.path.join(model_path, "model.ncnn.param"))
+        self.net.load_model(os.path.join(model_path, "model.ncnn.bin"))
+
+    def _infer(self, blob):
+        extractor = self.net.create_extractor()
+        extractor.input("in0", self.ncnn.Mat(blob[0]).clone())
+        _, out = extractor.extract("out0")
+        return np.array(out)[None]
+
+
+def create_detector(backend, model_path, **kwargs):
+    if backend == "ultralytics":
+        return UltralyticsDetector(model_path, **kwargs)
+    if backend == "onnx":
+        return OnnxDetector(model_path, **kwargs)
+    if backend == "openvino":
+        return OpenVINODetector(model_path, **kwargs)
+    if backend == "ncnn":
+        return NcnnDetector(model_path, **kwargs)
+    raise ValueError(f"unknown detector backend {backend!r}, expected one of {BACKENDS}")
+
+
+def to_deepsort_detections(dets, class_id=0):
+    # แปลงเป็นรูปแบบที่ DeepSort ต้องการ ([x, y, w, h], score, class) และตัดกล่องที่กว้าง/สูงเป็น 0 ทิ้ง
+    boxes = dets[:, :4].astype(np.int32)
+    wh = boxes[:, 2:4] - boxes[:, 0:2]
+    keep = (wh[:, 0] > 0) & (wh[:, 1] > 0)
+    return [
+        ([int(x), int(y), int(w), int(h)], float(score), class_id)
+        for (x, y), (w, h), score in zip(boxes[keep, :2], wh[keep], dets[keep, 4])
+    ]
@@ -0,0 +1,102 @@
+import argparse
+import os
+import tempfile
+import cv2
+import numpy as np
+from detector import letterbox
+
+# แปลงน้ำหนัก YOLOv8 (.pt) ไปเป็น ONNX / OpenVINO / NCNN สำหรับรันบน Pi
+# --int8 จะ quantize โดยใช้รูปภาพชั้นวางจริงใน --calib-dir เป็นชุด calibrate
+#   python export_model.py best.pt --format onnx --int8 --calib-dir recordings/frames
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+
+
+def list_images(folder, limit=None):
+    files = sorted(f for f in os.listdir(folder) if f.lower().endswith(IMAGE_EXTENSIONS))
+    return [os.path.join(folder, f) for f in files[:limit]]
+
+
+class ImageFolderCalibrationReader:
+    # ป้อนรูปทีละรูปให้ onnxruntime.quantization ใช้คำนวณช่วงค่าของแต่ละ layer
+    def __init__(self, folder, input_name, imgsz, limit=200):
+        self.input_name = input_name
+        self.imgsz = imgsz
+        self._paths = iter(list_images(folder, limit))
+
+    def get_next(self):
+        path = next(self._paths, None)
+        if path is None:
+            return None
+        # preprocess แบบเดียวกับ RawYoloDetector (letterbox) ไม่งั้นช่วงค่าที่ calibrate จะไม่ตรงกับตอนใช้งานจริง
+        blob = letterbox(cv2.imread(path), self.imgsz)[0].astype(np.float32)
+        return {self.input_name: blob}
+
+
+def export(weights, fmt, imgsz, int8=False, calib_dir=None, dynamic=False):
+    from ultralytics import YOLO
+    model = YOLO(weights)
+
+    if fmt == "onnx":
+        # dynamic=True ให้รับหลายภาพต่อครั้ง (ใช้กับ orchestrator หลายกล้อง)
+        path = model.export(format="onnx", imgsz=imgsz, simplify=True, dynamic=dynamic)
+        if int8:
+            path = quantize_onnx(path, calib_dir, imgsz)
+        return path
+
+    if fmt == "openvino":
+        if not int8:
+            return model.export(format="openvino", imgsz=imgsz)
+        # ultralytics ใช้ NNCF ทำ INT8 โดยอ่านรูปจาก dataset yaml
+        with tempfile.NamedTemporaryFile("w", suffix=".yaml", delete=False) as f:
+            calib = os.path.abspath(calib_dir)
+            f.write(f"path: {calib}\ntrain: {calib}\nval: {calib}\nnames:\n  0: mushroom\n")
+        try:
+            return model.export(format="openvino", imgsz=imgsz, int8=True, data=f.name)
+        finally:
+            os.remove(f.name)
+
+    if fmt == "ncnn":
+        if int8:
+            raise SystemExit("NCNN INT8 ต้องใช้เครื่องมือ ncnn2table/ncnn2int8 ของ ncnn เอง - export แบบ fp ได้เท่านั้น")
+        return model.export(format="ncnn", imgsz=imgsz)
+
+    raise SystemExit(f"ไม่รู้จักรูปแบบ {fmt}")
+
+
+def quantize_onnx(path, calib_dir, imgsz):
+    import onnxruntime as ort
+    from onnxruntime.quantization import QuantFormat, QuantType, quantize_static
+
+    input_name = ort.InferenceSession(path, providers=["CPUExecutionProvider"]).get_inputs()[0].name
+    out_path = path.replace(".onnx", "_int8.onnx")
+    quantize_static(
+        path,
+        out_path,
+        ImageFolderCalibrationReader(calib_dir, input_name, imgsz),
+        quant_format=QuantFormat.QDQ,
+        activation_type=QuantType.QUInt8,
+        weight_type=QuantType.QInt8,
+        per_channel=True,
+    )
+    return out_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export YOLOv8 weights for edge inference")
+    parser.add_argument("weights")
+    parser.add_argument("--format", choices=("onnx", "openvino", "ncnn"), default="onnx")
+    parser.add_argument("--imgsz", type=int, default=640)
+    parser.add_argument("--int8", action="store_true")
+    parser.add_argument("--calib-dir", help="folder of sample shelf images for INT8 calibration")
+    parser.add_argument("--dynamic", action="store_true", help="ONNX with a dynamic batch axis for multi-camera batching")
+    args = parser.parse_args()
+    if args.int8 and not args.calib_dir:
+        parser.error("--int8 needs --calib-dir")
+
+    path = export(args.weights, args.format, args.imgsz, args.int8, args.calib_dir, args.dynamic)
+    print(f"[✅] export เสร็จ: {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,412 @@
+import argparse
+import math
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+import numpy as np
+from pymongo import ASCENDING, MongoClient, UpdateOne
+from pymongo.errors import PyMongoError
+from instrumentation import EventLog
+from storage import DB_NAME, INSERT_OVERLAP_S, WRITTEN_AT, InsertFeed, open_mushroom_collection, to_datetime
+from alerts import watch_inserts
+
+# คาดการณ์เวลาที่เห็ดแต่ละดอกจะพร้อมเก็บ จากความกว้าง (real_size_cm) ตามเวลา
+# ใช้เส้นโค้งโตแบบ exponential: log(width) = a + b*t (t เป็นชั่วโมง) ฟิตด้วย least squares แบบถ่วงน้ำหนัก
+# ค่าเก่าลดน้ำหนักลงครึ่งหนึ่งทุก HALF_LIFE_H ชั่วโมง เก็บแค่ผลรวม 5 ตัวต่อดอก จึงอัปเดตทีละจุดได้
+# - GrowthCache: ค่าในหน่วยความจำของ webhook อัปเดตตามรอบบันทึกใหม่ ตอบคำสั่งได้ทันที
+# - python growth.py --uri ... : คำนวณใหม่ทั้งฟาร์มแบบ vectorized แล้วเก็บลง growth_fits
+
+GROWTH_COLLECTION_NAME = "growth_fits"
+# ความกว้าง (ซม.) ที่ถือว่าพร้อมเก็บ ตรงกับขอบล่างของช่วง "mature" ใน MaturityBands
+TARGET_CM = 1.5
+HALF_LIFE_H = 24
+# ต้องมีอย่างน้อย MIN_POINTS จุด ครอบคลุมอย่างน้อย MIN_SPAN_H ชั่วโมงจึงคาดการณ์
+MIN_POINTS = 3
+MIN_SPAN_H = 1.0
+# ดอกที่ไม่เห็นเกิน ACTIVE_H ชั่วโมงถือว่าเก็บไปแล้ว ไม่นับในคำตอบ
+ACTIVE_H = 12
+# ช่วงข้อมูลย้อนหลังที่ใช้ฟิตตอนเริ่มต้น (วัน)
+WINDOW_DAYS = 30
+# อัปเดตจากข้อมูลใหม่ไม่ถี่กว่านี้ (วินาที) แม้จะมีหลายกล้องบันทึกพร้อมกัน
+REFRESH_S = 10
+
+log = EventLog("growth")
+# ช่วงเวลาที่ใช้แบ่งกลุ่มในคำตอบ (ชั่วโมง)
+HORIZONS_H = (24, 72)
+
+PROJECTION = {"camera_id": 1, "location": 1, "mushroom_id": 1, "real_size_cm": 1, "timestamp": 1, "distance_stale": 1,
+              WRITTEN_AT: 1}
+THAI_TZ = timezone(timedelta(hours=7))
+
+
+def open_growth_collection(db, name=GROWTH_COLLECTION_NAME):
+    collection = db[name]
+    collection.create_index(
+        [("camera_id", ASCENDING), ("location", ASCENDING), ("mushroom_id", ASCENDING)],
+        name="growth_key",
+        unique=True,
+    )
+    return collection
+
+
+def stream_measurements(collection, query, batch_size=2000):
+    # อ่านเฉพาะฟิลด์ที่ใช้ทีละ batch_size เอกสาร ไม่โหลดทั้งหมดเข้าหน่วยความจำ
+    cursor = collection.find(query, PROJECTION).batch_size(batch_size)
+    for doc in cursor:
+        if is_measurement(doc):
+            yield doc
+
+
+def is_measurement(doc):
+    # ขนาดที่วัดจากค่าระยะเก่า (stale) เชื่อถือไม่ได้
+    width = doc.get("real_size_cm")
+    return not doc.get("distance_stale") and bool(width) and width > 0
+
+
+def history_query(start, cutoff):
+    # ข้อมูลตั้งแต่ start ที่ถูกบันทึกก่อน cutoff (รวมข้อมูลเก่าที่ไม่มี written_at)
+    # ส่วนที่บันทึกตั้งแต่ cutoff ไปแล้ว GrowthCache อ่านต่อด้วย InsertFeed จึงไม่มีจุดไหนถูกนับซ้ำหรือหลุด
+    return {
+        "timestamp": {"$gte": start},
+        "$or": [{WRITTEN_AT: {"$lt": cutoff}}, {WRITTEN_AT: {"$exists": False}}],
+    }
+
+
+def decay(hours, half_life_h=HALF_LIFE_H):
+    return 0.5 ** (hours / half_life_h)
+
+
+class GrowthFit:
+    # เวลาเป็นชั่วโมงนับจาก origin (epoch วินาทีของจุดแรก), y = log(width)
+    __slots__ = ("origin", "last_t", "last_width", "n", "s0", "st", "sy", "stt", "sty")
+
+    def __init__(self, origin):
+        self.origin = origin
+        self.last_t = 0.0
+        self.last_width = 0.0
+        self.n = 0
+        self.s0 = self.st = self.sy = self.stt = self.sty = 0.0
+
+    def add(self, ts, width, half_life_h=HALF_LIFE_H):
+        t = (ts - self.origin) / 3600
+        y = math.log(width)
+        if self.n and t < self.last_t:
+            # ข้อมูลมาช้า (เช่นส่งซ้ำจาก journal) ถ่วงน้ำหนักตามอายุเทียบกับจุดล่าสุด
+            w = decay(self.last_t - t, half_life_h)
+        else:
+            if self.n:
+                k = decay(t - self.last_t, half_life_h)
+                self.s0 *= k
+                self.st *= k
+                self.sy *= k
+                self.stt *= k
+                self.sty *= k
+            self.last_t = t
+            self.last_width = width
+            w = 1.0
+        self.n += 1
+        self.s0 += w
+        self.st += w * t
+        self.sy += w * y
+        self.stt += w * t * t
+        self.sty += w * t * y
+
+    @property
+    def last_seen(self):
+        return self.origin + self.last_t * 3600
+
+    def eta(self, target_cm=TARGET_CM):
+        # epoch วินาทีที่คาดว่าจะถึง target_cm หรือ None ถ้าข้อมูลไม่พอ/ไม่โต
+        if self.last_width >= target_cm:
+            return self.last_seen
+        return eta_from_sums(self.origin, self.last_t, self.n, self.s0, self.st, self.sy, self.stt, self.sty,
+                             target_cm)
+
+    def to_document(self, camera_id, location, mushroom_id, target_cm=TARGET_CM):
+        eta = self.eta(target_cm)
+        return {
+            "camera_id": camera_id,
+            "location": location,
+            "mushroom_id": mushroom_id,
+            "origin": datetime.fromtimestamp(self.origin, tz=timezone.utc),
+            "last_seen": datetime.fromtimestamp(self.last_seen, tz=timezone.utc),
+            "last_width_cm": self.last_width,
+            "n": self.n,
+            "sums": [self.s0, self.st, self.sy, self.stt, self.sty],
+            "eta": datetime.fromtimestamp(eta, tz=timezone.utc) if eta is not None else None,
+        }
+
+    @classmethod
+    def from_document(cls, doc):
+        fit = cls(to_datetime(doc["origin"]).timestamp())
+        fit.last_t = (to_datetime(doc["last_seen"]).timestamp() - fit.origin) / 3600
+        fit.last_width = doc["last_width_cm"]
+        fit.n = doc["n"]
+        fit.s0, fit.st, fit.sy, fit.stt, fit.sty = doc["sums"]
+        return fit
+
+
+def eta_from_sums(origin, last_t, n, s0, st, sy, stt, sty, target_cm=TARGET_CM):
+    # ใช้ได้ทั้งค่าเดี่ยวและ array (ผลเป็น NaN แทน None ในแบบ array)
+    vectorized = isinstance(s0, np.ndarray)
+    s0, st, sy, stt, sty = (np.asarray(v, dtype=np.float64) for v in (s0, st, sy, stt, sty))
+    det = s0 * stt - st * st
+    with np.errstate(divide="ignore", invalid="ignore"):
+        b = (s0 * sty - st * sy) / det
+        a = (sy - b * st) / s0
+        t_target = (math.log(target_cm) - a) / b
+    valid = (np.asarray(n) >= MIN_POINTS) & (np.asarray(last_t) >= MIN_SPAN_H) & (det > 1e-9) & (b > 0)
+    eta = origin + t_target * 3600
+    if vectorized:
+        return np.where(valid, eta, np.nan)
+    return float(eta) if valid else None
+
+
+def fit_arrays(groups, ts, widths, target_cm=TARGET_CM, half_life_h=HALF_LIFE_H):
+    # ฟิตทุกดอกพร้อมกัน: groups = index ของดอก (0..G-1) ต่อจุด, ts = epoch วินาที, widths = ซม.
+    # ให้ผลเท่ากับการเรียก GrowthFit.add ทีละจุด
+    order = np.lexsort((ts, groups))
+    groups, ts, widths = groups[order], ts[order], widths[order]
+    starts = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]])
+    ends = np.r_[starts[1:], len(groups)] - 1
+    origin = ts[starts]
+    sizes = np.diff(np.r_[starts, len(groups)])
+    t = (ts - np.repeat(origin, sizes)) / 3600
+    last_t = t[ends]
+    w = decay(np.repeat(last_t, sizes) - t, half_life_h)
+    y = np.log(widths)
+    sums = [np.add.reduceat(v, starts) for v in (w, w * t, w * y, w * t * t, w * t * y)]
+    last_width = widths[ends]
+    eta = eta_from_sums(origin, last_t, sizes, *sums, target_cm=target_cm)
+    eta = np.where(last_width >= target_cm, origin + last_t * 3600, eta)
+    return {
+        "group": groups[starts], "origin": origin, "last_t": last_t, "last_width": last_width,
+        "n": sizes, "sums": np.stack(sums, axis=1), "eta": eta,
+    }
+
+
+def collect_arrays(docs):
+    # รวมเอกสารจาก cursor เป็น array สำหรับ fit_arrays คืน (keys, groups, ts, widths)
+    index = {}
+    groups, ts, widths = [], [], []
+    for doc in docs:
+        key = (doc["camera_id"], doc["location"], doc["mushroom_id"])
+        groups.append(index.setdefault(key, len(index)))
+        ts.append(to_datetime(doc["timestamp"]).timestamp())
+        widths.append(doc["real_size_cm"])
+    keys = list(index)
+    return keys, np.asarray(groups, dtype=np.int64), np.asarray(ts), np.asarray(widths, dtype=np.float64)
+
+
+def summarize_etas(items, now, location=None, target_cm=TARGET_CM):
+    # items: (key, GrowthFit) นับจำนวนดอกที่พร้อมแล้ว/พร้อมภายในแต่ละช่วง/หลังจากนั้น/ข้อมูลไม่พอ
+    summary = {"total": 0, "ready": 0, "within": [0] * len(HORIZONS_H), "later": 0, "unknown": 0, "next_eta": None}
+    for (camera_id, loc, _), fit in items:
+        if location is not None and loc != location:
+            continue
+        if now - fit.last_seen > ACTIVE_H * 3600:
+            continue
+        summary["total"] += 1
+        if fit.last_width >= target_cm:
+            summary["ready"] += 1
+            continue
+        eta = fit.eta(target_cm)
+        if eta is None:
+            summary["unknown"] += 1
+            continue
+        # เส้นโค้งบอกว่าควรถึงแล้วแต่ขนาดที่วัดได้ยังไม่ถึง: ถือว่าใกล้พร้อม
+        eta = max(eta, now)
+        hours = (eta - now) / 3600
+        for i, horizon in enumerate(HORIZONS_H):
+            if hours <= horizon:
+                summary["within"][i] += 1
+                break
+        else:
+            summary["later"] += 1
+        if summary["next_eta"] is None or eta < summary["next_eta"]:
+            summary["next_eta"] = eta
+    return summary
+
+
+class GrowthCache:
+    def __init__(self, raw_collection, fit_collection=None, target_cm=TARGET_CM, window_days=WINDOW_DAYS):
+        self.raw_collection = raw_collection
+        self.fit_collection = fit_collection
+        self.target_cm = target_cm
+        self.window_days = window_days
+        self.fits = {}
+        # อ่านเอกสารดิบที่บันทึกหลังจากข้อมูลที่ฟิตไปแล้ว ตาม written_at (รวมข้อมูลที่ส่งซ้ำจาก journal)
+        self.feed = None
+        self.last_refresh = 0.0
+        self.ready = threading.Event()
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._trailing = None
+        self._closed = False
+
+    def load(self, now=None):
+        # เริ่มจากผลที่ batch mode เก็บไว้ ถ้าไม่มีให้ฟิตจากข้อมูลดิบย้อนหลัง window_days
+        now = time.time() if now is None else now
+        fits = {}
+        cutoff = None
+        if self.fit_collection is not None:
+            for doc in self.fit_collection.find({}, {"_id": 0}):
+                fits[(doc["camera_id"], doc["location"], doc["mushroom_id"])] = GrowthFit.from_document(doc)
+                if doc.get("source_until") is not None:
+                    cutoff = to_datetime(doc["source_until"])
+        if cutoff is None:
+            # ไม่มีผลจาก batch mode (หรือเป็นผลรุ่นเก่าที่ไม่รู้ว่านับข้อมูลถึงไหน) ฟิตใหม่จากข้อมูลดิบ
+            fits = {}
+            now_dt = datetime.fromtimestamp(now, tz=timezone.utc)
+            cutoff = now_dt - timedelta(seconds=INSERT_OVERLAP_S)
+            keys, groups, ts, widths = collect_arrays(stream_measurements(
+                self.raw_collection, history_query(now_dt - timedelta(days=self.window_days), cutoff)))
+            if keys:
+                fits = fits_from_arrays(keys, fit_arrays(groups, ts, widths, self.target_cm))
+        with self._lock:
+            self.fits = fits
+            self.feed = InsertFeed(self.raw_collection, since=cutoff, projection=PROJECTION)
+        self.ready.set()
+        log.info("loaded", "โหลดเส้นการเติบโต {count} ดอก", count=len(fits))
+        return len(fits)
+
+    def refresh(self):
+        # เพิ่มเฉพาะเอกสารที่บันทึกหลังจากรอบก่อน ข้อมูลที่มาช้า (timestamp เก่า) ถ่วงน้ำหนักตามอายุใน GrowthFit.add
+        if self.feed is None:
+            return 0
+        count = 0
+        with self._refresh_lock:
+            for doc in self.feed.poll():
+                if not is_measurement(doc):
+                    continue
+                key = (doc["camera_id"], doc["location"], doc["mushroom_id"])
+                ts = to_datetime(doc["timestamp"]).timestamp()
+                with self._lock:
+                    fit = self.fits.get(key)
+                    if fit is None:
+                        fit = self.fits[key] = GrowthFit(ts)
+                    fit.add(ts, doc["real_size_cm"])
+                count += 1
+            self.last_refresh = time.time()
+        return count
+
+    def summary(self, now=None, location=None):
+        now = time.time() if now is None else now
+        with self._lock:
+            items = list(self.fits.items())
+        return summarize_etas(items, now, location, self.target_cm)
+
+    def run(self, batch_collection, stop_event=None):
+        # โหลดครั้งแรกแล้วอัปเดตทุกครั้งที่มีสรุปรอบใหม่ (change stream หรือ poll)
+        self.load_until_ready()
+        watch_inserts(batch_collection, self.on_batch, stop_event)
+
+    def load_until_ready(self):
+        while not self.ready.is_set():
+            try:
+                self.load()
+            except PyMongoError as e:
+                log.error("load_error", "โหลดเส้นการเติบโตไม่สำเร็จ: {error}", error=e)
+                time.sleep(REFRESH_S)
+
+    def on_batch(self, summary):
+        # อัปเดตไม่ถี่กว่า REFRESH_S ถ้าเพิ่งอัปเดตไปให้ตั้งเวลาอัปเดตตามหลังไว้หนึ่งครั้ง
+        # ข้อมูลชุดท้ายของช่วงที่บันทึกถี่ ๆ จึงไม่ค้างรอจนกว่าจะมีรอบใหม่
+        with self._lock:
+            if self._closed or self._trailing is not None:
+                return
+            delay = self.last_refresh + REFRESH_S - time.time()
+            if delay > 0:
+                self._trailing = threading.Timer(delay, self._trailing_refresh)
+                self._trailing.daemon = True
+                self._trailing.start()
+                return
+        self.refresh()
+
+    def _trailing_refresh(self):
+        with self._lock:
+            self._trailing = None
+        try:
+            self.refresh()
+        except PyMongoError as e:
+            log.error("refresh_error", "อัปเดตเส้นการเติบโตไม่สำเร็จ: {error}", error=e)
+
+    def close(self):
+        # ตอนปิดโปรแกรม: ยกเลิกการอัปเดตที่ตั้งเวลาไว้และไม่ตั้งใหม่อีก
+        with self._lock:
+            self._closed = True
+            trailing, self._trailing = self._trailing, None
+        if trailing is not None:
+            trailing.cancel()
+
+
+def fits_from_arrays(keys, result):
+    fits = {}
+    for i, group in enumerate(result["group"]):
+        fit = GrowthFit(float(result["origin"][i]))
+        fit.last_t = float(result["last_t"][i])
+        fit.last_width = float(result["last_width"][i])
+        fit.n = int(result["n"][i])
+        fit.s0, fit.st, fit.sy, fit.stt, fit.sty = (float(v) for v in result["sums"][i])
+        fits[keys[group]] = fit
+    return fits
+
+
+def save_fits(collection, fits, source_until, target_cm=TARGET_CM):
+    # source_until = ข้อมูลดิบที่ฟิตแล้วคือที่บันทึกก่อนเวลานี้ (ดู history_query)
+    ops = []
+    for (camera_id, location, mushroom_id), fit in fits.items():
+        doc = fit.to_document(camera_id, location, mushroom_id, target_cm)
+        doc["source_until"] = source_until
+        ops.append(UpdateOne({"camera_id": camera_id, "location": location, "mushroom_id": mushroom_id},
+                             {"$set": doc}, upsert=True))
+    for i in range(0, len(ops), 1000):
+        collection.bulk_write(ops[i:i + 1000], ordered=False)
+    return len(ops)
+
+
+def format_eta(eta):
+    return datetime.fromtimestamp(eta, tz=THAI_TZ).strftime("%Y-%m-%d %H:%M")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recompute growth curves and harvest ETAs for the whole farm")
+    parser.add_argument("--uri", required=True)
+    parser.add_argument("--db", default=DB_NAME)
+    parser.add_argument("--days", type=int, default=WINDOW_DAYS, help="history window to fit")
+    parser.add_argument("--target-cm", type=float, default=TARGET_CM)
+    parser.add_argument("--dry-run", action="store_true", help="print ETAs without writing growth_fits")
+    args = parser.parse_args()
+
+    db = MongoClient(args.uri)[args.db]
+    raw = open_mushroom_collection(db)
+    started = datetime.now(timezone.utc)
+    start = started - timedelta(days=args.days)
+    cutoff = started - timedelta(seconds=INSERT_OVERLAP_S)
+
+    t0 = time.perf_counter()
+    keys, groups, ts, widths = collect_arrays(stream_measurements(raw, history_query(start, cutoff)))
+    t1 = time.perf_counter()
+    if not keys:
+        log.error("no_data", "ไม่มีข้อมูลขนาดเห็ดในช่วงที่เลือก")
+        return
+    result = fit_arrays(groups, ts, widths, args.target_cm)
+    t2 = time.perf_counter()
+    log.info("fitted", "อ่าน {points} จุด ({count} ดอก) {read_s:.2f}s, ฟิต {fit_ms:.1f}ms",
+             points=len(ts), count=len(keys), read_s=t1 - t0, fit_ms=(t2 - t1) * 1000)
+
+    fits = fits_from_arrays(keys, result)
+    now = time.time()
+    for location in sorted({key[1] for key in keys}):
+        s = summarize_etas(fits.items(), now, location, args.target_cm)
+        next_eta = format_eta(s["next_eta"]) if s["next_eta"] else "-"
+        print(f"{location}: ทั้งหมด {s['total']} พร้อม {s['ready']} "
+              f"ภายใน {HORIZONS_H} ชม. {s['within']} หลังจากนั้น {s['later']} ไม่ทราบ {s['unknown']} ถัดไป {next_eta}")
+
+    if not args.dry_run:
+        written = save_fits(open_growth_collection(db), fits, cutoff, args.target_cm)
+        log.info("saved", "✅ บันทึก growth_fits {count} ดอก", count=written)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,28 @@
+import multiprocessing
+import os
+import tempfile
+from instrumentation import clear_snapshots
+
+# ใช้รัน webhook แบบหลาย worker: gunicorn -c gunicorn.conf.py webhook:app
+# monitor แจ้งเตือนไม่ได้เริ่มใน worker ให้รัน monitor.py แยกหนึ่งตัว
+
+bind = os.environ.get("WEBHOOK_BIND", "0.0.0.0:5050")
+workers = int(os.environ.get("WEBHOOK_WORKERS", multiprocessing.cpu_count() * 2 + 1))
+worker_class = "gthread"
+threads = int(os.environ.get("WEBHOOK_THREADS", 4))
+timeout = 30
+keepalive = 5
+
+# cache ข้อความตอบกลับแบบ MemoryBackend แยกกันต่อ worker การล้าง cache เมื่อมีรอบใหม่จึงไม่ข้าม worker
+# หลาย worker ใช้ SQLite ร่วมกันเป็นค่าเริ่มต้น (ตั้ง RESPONSE_CACHE_DB เองเพื่อเปลี่ยนที่เก็บ) worker ได้ค่านี้ตอน fork
+if workers > 1 and not os.environ.get("RESPONSE_CACHE_DB"):
+    cache_dir = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    os.environ["RESPONSE_CACHE_DB"] = os.path.join(cache_dir, "mushroom_cache.sqlite")
+
+# ห้าม preload: webhook.py เปิด thread ส่งข้อความ LINE ตอน import ซึ่งจะไม่ติดไปหลัง fork
+preload_app = False
+
+
+def on_starting(server):
+    # ตั้ง METRICS_DIR ให้ /metrics รวมค่าของทุก worker: ล้าง snapshot ของการรันครั้งก่อนทิ้ง
+    clear_snapshots(os.environ.get("METRICS_DIR"))
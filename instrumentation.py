@@ -0,0 +1,500 @@
+import bisect
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# ตัววัดผล (counter/gauge/histogram) แบบ Prometheus, sampling profiler และ log แบบมีโครงสร้างที่จำกัดความถี่
+# ใช้ร่วมกันทั้ง maincode.py/orchestrator.py (ฝั่งกล้อง) และ webhook.py
+# - ค่าทั้งหมดอยู่ใน REGISTRY อ่านได้ที่ GET /metrics (webhook ผ่าน Flask, ฝั่งกล้องผ่าน serve_metrics)
+# - ตั้ง METRICS_DIR ให้ worker ของ gunicorn เขียน snapshot ลงโฟลเดอร์เดียวกัน /metrics จะรวมค่าของทุก worker
+# - ตั้ง PROFILER_ENABLED=1 เพื่อเปิด GET /debug/profile?seconds=10 (ได้ stack แบบ collapsed สำหรับทำ flame graph)
+# - LOG_LEVEL=debug|info|warning|error (ตั้งต้น info: ข้อความรายเฟรมเป็น debug จึงไม่พิมพ์), LOG_FORMAT=text|json
+#   ข้อความ event เดียวกันพิมพ์ได้ไม่เกิน LOG_RATE_PER_S ครั้งต่อวินาที (ยอมให้ต่อเนื่องได้ LOG_BURST ครั้ง)
+
+LOG_LEVELS = {"debug": 10, "info": 20, "warning": 30, "error": 40}
+LOG_PREFIX = {"debug": "[Debug]", "info": "[Info]", "warning": "[⚠️]", "error": "[❌]"}
+LOG_RATE_PER_S = float(os.environ.get("LOG_RATE_PER_S", 1))
+LOG_BURST = int(os.environ.get("LOG_BURST", 10))
+
+METRICS_DIR = os.environ.get("METRICS_DIR")
+METRICS_SNAPSHOT_S = 5
+PROFILER_ENABLED = os.environ.get("PROFILER_ENABLED", "") not in ("", "0")
+PROFILE_MAX_S = 60
+
+# ขอบ bucket ของ histogram เวลา (วินาที)
+LATENCY_BUCKETS_S = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_log_config = {
+    "level": LOG_LEVELS.get(os.environ.get("LOG_LEVEL", "info").lower(), LOG_LEVELS["info"]),
+    "json": os.environ.get("LOG_FORMAT", "text").lower() == "json",
+}
+
+
+class _CounterChild:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+
+class _GaugeChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def set(self, value):
+        self.value = value
+
+
+class _HistogramChild:
+    __slots__ = ("buckets", "counts", "sum", "count", "_lock")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # ช่องสุดท้ายคือค่าที่เกิน bucket สูงสุด (+Inf)
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+    def time(self):
+        return _Timer(self)
+
+
+class _Timer:
+    __slots__ = ("child", "start")
+
+    def __init__(self, child):
+        self.child = child
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.child.observe(time.perf_counter() - self.start)
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        values = tuple(str(v) for v in values)
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} ต้องมี label {self.labelnames}")
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def series(self):
+        with self._lock:
+            return list(self._children.items())
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+
+class Gauge(Metric):
+    # fn (ถ้ามี) ถูกเรียกตอนอ่าน /metrics คืนตัวเลข หรือ dict {ค่า label: ตัวเลข} เมื่อมี label เดียว
+    kind = "gauge"
+
+    def __init__(self, name, help, labelnames=(), fn=None, kind=None):
+        super().__init__(name, help, labelnames)
+        self.fn = fn
+        if kind:
+            self.kind = kind
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value):
+        self.labels().set(value)
+
+    def series(self):
+        if self.fn is None:
+            return super().series()
+        try:
+            value = self.fn()
+        except Exception:
+            return []
+        if isinstance(value, dict):
+            return [((str(k),), _fixed(v)) for k, v in value.items()]
+        return [((), _fixed(value))]
+
+
+def _fixed(value):
+    child = _GaugeChild()
+    child.value = value
+    return child
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS_S):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def time(self):
+        return self.labels().time()
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name, *args, **kwargs):
+        # เรียกซ้ำด้วยชื่อเดิมได้ metric ตัวเดิม (หลายกล้อง/หลายโมดูลใช้ร่วมกัน)
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"metric {name} ถูกสร้างเป็น {metric.kind} ไปแล้ว")
+            return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self._get_or_create(Counter, name, help, labelnames)
+
+    def gauge(self, name, help, labelnames=(), fn=None, kind=None):
+        return self._get_or_create(Gauge, name, help, labelnames, fn=fn, kind=kind)
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS_S):
+        return self._get_or_create(Histogram, name, help, labelnames, buckets=buckets)
+
+    def snapshot(self):
+        # ค่าปัจจุบันทั้งหมดในรูปที่ส่งเป็น JSON ได้ (ใช้รวมค่าข้าม process)
+        out = {}
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            series = []
+            for labels, child in metric.series():
+                if metric.kind == "histogram":
+                    with child._lock:
+                        series.append([list(labels), {"counts": list(child.counts), "sum": child.sum,
+                                                      "count": child.count}])
+                else:
+                    series.append([list(labels), child.value])
+            out[metric.name] = {"kind": metric.kind, "help": metric.help, "labelnames": list(metric.labelnames),
+                                "buckets": list(getattr(metric, "buckets", ())), "series": series}
+        return out
+
+    def render(self, metrics_dir=None):
+        # รูปแบบ text exposition ของ Prometheus
+        merged = _merge_snapshots(self.snapshot(), _load_other_snapshots(metrics_dir))
+        lines = []
+        for name, metric in merged.items():
+            lines.append(f"# HELP {name} {metric['help']}")
+            lines.append(f"# TYPE {name} {metric['kind']}")
+            labelnames = metric["labelnames"]
+            for labels, value in metric["series"]:
+                pairs = list(zip(labelnames, labels))
+                if metric["kind"] != "histogram":
+                    lines.append(f"{name}{_labels(pairs)} {_number(value)}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(list(metric["buckets"]) + ["+Inf"], value["counts"]):
+                    cumulative += count
+                    le = bound if bound == "+Inf" else _number(bound)
+                    lines.append(f"{name}_bucket{_labels(pairs + [('le', le)])} {cumulative}")
+                lines.append(f"{name}_sum{_labels(pairs)} {_number(value['sum'])}")
+                lines.append(f"{name}_count{_labels(pairs)} {value['count']}")
+        return "\n".join(lines) + "\n"
+
+    def write_snapshot(self, metrics_dir):
+        path = os.path.join(metrics_dir, f"metrics_{os.getpid()}.json")
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.snapshot(), f)
+        os.replace(tmp, path)
+
+    def start_snapshots(self, metrics_dir, interval=METRICS_SNAPSHOT_S):
+        os.makedirs(metrics_dir, exist_ok=True)
+
+        def run():
+            while True:
+                try:
+                    self.write_snapshot(metrics_dir)
+                except OSError as e:
+                    log.warning("snapshot_error", "เขียน snapshot ของ metrics ไม่สำเร็จ: {error}", error=e)
+                time.sleep(interval)
+
+        thread = threading.Thread(target=run, name="metrics-snapshot", daemon=True)
+        thread.start()
+        return thread
+
+
+def _labels(pairs):
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+def _number(value):
+    value = float(value)
+    if value != value:
+        return "NaN"
+    if value in (float("inf"), float("-inf")):
+        return "+Inf" if value > 0 else "-Inf"
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+def _load_other_snapshots(metrics_dir):
+    if not metrics_dir or not os.path.isdir(metrics_dir):
+        return []
+    own = f"metrics_{os.getpid()}.json"
+    snapshots = []
+    for name in os.listdir(metrics_dir):
+        if name.startswith("metrics_") and name.endswith(".json") and name != own:
+            try:
+                with open(os.path.join(metrics_dir, name), encoding="utf-8") as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+    return snapshots
+
+
+def _merge_snapshots(own, others):
+    # counter/histogram รวมค่าของทุก worker, gauge ใช้ค่าของ process ที่ตอบ request นี้
+    for other in others:
+        for name, metric in other.items():
+            if metric["kind"] == "gauge":
+                continue
+            target = own.setdefault(name, dict(metric, series=[]))
+            index = {tuple(labels): value for labels, value in target["series"]}
+            for labels, value in metric["series"]:
+                key = tuple(labels)
+                current = index.get(key)
+                if current is None:
+                    index[key] = value
+                elif metric["kind"] == "histogram":
+                    index[key] = {"counts": [a + b for a, b in zip(current["counts"], value["counts"])],
+                                  "sum": current["sum"] + value["sum"], "count": current["count"] + value["count"]}
+                else:
+                    index[key] = current + value
+            target["series"] = [[list(k), v] for k, v in index.items()]
+    return own
+
+
+def clear_snapshots(metrics_dir):
+    # เรียกตอนเริ่ม service (gunicorn on_starting) เพื่อไม่ให้ค่าของรอบก่อนปนมา
+    if not metrics_dir or not os.path.isdir(metrics_dir):
+        return
+    for name in os.listdir(metrics_dir):
+        if name.startswith("metrics_"):
+            try:
+                os.remove(os.path.join(metrics_dir, name))
+            except OSError:
+                pass
+
+
+REGISTRY = Registry()
+counter = REGISTRY.counter
+gauge = REGISTRY.gauge
+histogram = REGISTRY.histogram
+
+LOG_SUPPRESSED = counter("log_messages_suppressed_total", "Log lines dropped by the rate limiter",
+                         ("logger", "event"))
+
+
+class SamplingProfiler:
+    # สุ่มดู stack ของทุก thread ทุก interval วินาทีจาก thread แยก ไม่มีค่าใช้จ่ายเลยตอนไม่ได้เปิด
+    # ผลเป็นรูปแบบ collapsed (thread;func (file:line);... จำนวนครั้ง) ใช้กับ flamegraph.pl / speedscope ได้
+    _busy = threading.Lock()
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.samples = 0
+        self.stacks = {}
+
+    def run_for(self, seconds):
+        # คืนค่า None ถ้ามีการ profile อื่นกำลังทำอยู่
+        if not SamplingProfiler._busy.acquire(blocking=False):
+            return None
+        try:
+            me = threading.get_ident()
+            names = {}
+            deadline = time.monotonic() + seconds
+            while time.monotonic() < deadline:
+                for ident, frame in sys._current_frames().items():
+                    if ident == me:
+                        continue
+                    if ident not in names:
+                        names = {t.ident: t.name for t in threading.enumerate()}
+                    stack = []
+                    while frame is not None:
+                        code = frame.f_code
+                        stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                        frame = frame.f_back
+                    stack.append(names.get(ident, str(ident)))
+                    key = ";".join(reversed(stack))
+                    self.stacks[key] = self.stacks.get(key, 0) + 1
+                self.samples += 1
+                time.sleep(self.interval)
+        finally:
+            SamplingProfiler._busy.release()
+        return self.collapsed()
+
+    def collapsed(self):
+        return "".join(f"{stack} {count}\n" for stack, count in
+                       sorted(self.stacks.items(), key=lambda item: item[1], reverse=True))
+
+
+def profile_response(query):
+    # ใช้ร่วมกันระหว่าง Flask (webhook) และ serve_metrics: คืนค่า (status, ข้อความ)
+    if not PROFILER_ENABLED:
+        return 404, "profiler disabled (set PROFILER_ENABLED=1)\n"
+    try:
+        seconds = min(float(query.get("seconds", 10)), PROFILE_MAX_S)
+        interval = float(query.get("interval_ms", 5)) / 1000
+    except ValueError:
+        return 400, "seconds / interval_ms must be numbers\n"
+    result = SamplingProfiler(max(interval, 0.001)).run_for(seconds)
+    if result is None:
+        return 409, "another profile is running\n"
+    return 200, result
+
+
+def serve_metrics(port, host="0.0.0.0", registry=REGISTRY):
+    # HTTP server เล็กๆ ใน thread แยกสำหรับ process ที่ไม่มี Flask (maincode.py / orchestrator.py)
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path == "/metrics":
+                status, body = 200, registry.render()
+            elif url.path == "/debug/profile":
+                status, body = profile_response({k: v[-1] for k, v in parse_qs(url.query).items()})
+            else:
+                status, body = 404, "not found\n"
+            data = body.encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            # ไม่พิมพ์ access log ทุกครั้งที่ Prometheus มาอ่าน
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    log.info("metrics_server", "metrics ที่ http://{host}:{port}/metrics", host=host, port=server.server_port)
+    return server
+
+
+def configure_logging(level=None, fmt=None):
+    if level is not None:
+        _log_config["level"] = LOG_LEVELS[level]
+    if fmt is not None:
+        _log_config["json"] = fmt == "json"
+
+
+class EventLog:
+    # log แทน print: event = ชื่อคงที่ของข้อความ (ใช้จำกัดความถี่และค้นหา), message = template ของ str.format
+    # ข้อความถูกจัดรูปเฉพาะตอนจะพิมพ์จริง ระดับที่ปิดไว้จึงแทบไม่มีค่าใช้จ่าย
+    def __init__(self, name, rate_per_s=None, burst=None):
+        self.name = name
+        self.rate_per_s = LOG_RATE_PER_S if rate_per_s is None else rate_per_s
+        self.burst = LOG_BURST if burst is None else burst
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def enabled(self, level):
+        return LOG_LEVELS[level] >= _log_config["level"]
+
+    def debug(self, event, message, **fields):
+        self.log("debug", event, message, fields)
+
+    def info(self, event, message, **fields):
+        self.log("info", event, message, fields)
+
+    def warning(self, event, message, **fields):
+        self.log("warning", event, message, fields)
+
+    def error(self, event, message, **fields):
+        self.log("error", event, message, fields)
+
+    def log(self, level, event, message, fields):
+        if LOG_LEVELS[level] < _log_config["level"]:
+            return
+        suppressed = self._allow(event)
+        if suppressed is None:
+            LOG_SUPPRESSED.labels(self.name, event).inc()
+            return
+        text = message.format(**fields) if fields else message
+        if _log_config["json"]:
+            record = {"ts": round(time.time(), 3), "level": level, "logger": self.name, "event": event, "msg": text}
+            # ค่าของแต่ละข้อความแยกไว้ใต้ "fields" ชื่ออย่าง level/msg/ts จึงไม่ทับคีย์หลักของ record
+            if fields:
+                record["fields"] = fields
+            if suppressed:
+                record["suppressed"] = suppressed
+            print(json.dumps(record, ensure_ascii=False, default=str))
+        else:
+            print(f"{LOG_PREFIX[level]} {text}" + (f" (ข้ามข้อความนี้ไป {suppressed} ครั้ง)" if suppressed else ""))
+
+    def _allow(self, event):
+        # token bucket ต่อ event คืนจำนวนข้อความที่ถูกข้ามไปก่อนหน้านี้ หรือ None ถ้าต้องข้ามข้อความนี้
+        if self.rate_per_s <= 0:
+            return 0
+        now = time.monotonic()
+        with self._lock:
+            state = self._buckets.get(event)
+            if state is None:
+                state = self._buckets[event] = [float(self.burst), now, 0]
+            tokens = min(float(self.burst), state[0] + (now - state[1]) * self.rate_per_s)
+            state[1] = now
+            if tokens < 1:
+                state[0] = tokens
+                state[2] += 1
+                return None
+            state[0] = tokens - 1
+            suppressed, state[2] = state[2], 0
+            return suppressed
+
+
+log = EventLog("instrumentation")
@@ -0,0 +1,198 @@
+import queue
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import Future
+from email.utils import parsedate_to_datetime
+import requests
+from requests.adapters import HTTPAdapter
+from instrumentation import EventLog, counter, histogram
+
+LINE_API_BASE = "https://api.line.me"
+RETRY_STATUS = {429, 500, 502, 503, 504}
+# ส่งซ้ำด้วย X-Line-Retry-Key เดิมแล้ว LINE ตอบ 409 แปลว่าครั้งก่อนส่งสำเร็จแล้ว
+ALREADY_ACCEPTED_STATUS = 409
+
+# reply token ของ LINE ใช้ได้ในเวลาจำกัด ถ้าส่งไม่ทันในช่วงนี้ก็ไม่ต้องลองต่อ
+REPLY_TOKEN_TTL = 50.0
+
+LINE_API_SECONDS = histogram("line_api_seconds", "LINE Messaging API call latency (each attempt)", ("path",))
+LINE_API_RESPONSES = counter("line_api_responses_total", "LINE API attempts by HTTP status (or 'error')",
+                             ("path", "status"))
+LINE_MESSAGES_DROPPED = counter("line_messages_dropped_total", "Messages not sent", ("reason",))
+log = EventLog("line")
+
+
+def parse_retry_after(value):
+    # Retry-After เป็นได้ทั้งจำนวนวินาทีและวันที่แบบ HTTP
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class LatencyRecorder:
+    # เก็บเวลาที่ใช้ต่อการเรียก API ล่าสุดไว้จำนวนหนึ่ง เพื่อดู p50/p95
+    def __init__(self, size=1000):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+
+    def record(self, elapsed_s, ok):
+        with self._lock:
+            self._samples.append(elapsed_s)
+            self.calls += 1
+            if not ok:
+                self.errors += 1
+
+    def stats(self):
+        with self._lock:
+            samples = sorted(self._samples)
+            calls, errors = self.calls, self.errors
+        if not samples:
+            return {"calls": calls, "errors": errors}
+        return {
+            "calls": calls,
+            "errors": errors,
+            "p50_ms": samples[len(samples) // 2] * 1000,
+            "p95_ms": samples[min(int(len(samples) * 0.95), len(samples) - 1)] * 1000,
+            "max_ms": samples[-1] * 1000,
+        }
+
+
+class LineClient:
+    # client ของ LINE Messaging API ใช้ session เดียว (keep-alive + connection pool)
+    # มี timeout และลองใหม่เมื่อเจอ 429/5xx ตาม Retry-After
+    def __init__(self, access_token, base_url=LINE_API_BASE, timeout=(3.05, 10.0),
+                 max_retries=3, backoff=0.5, pool_size=10):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.latency = LatencyRecorder()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {access_token}",
+        })
+
+    def reply(self, reply_token, messages, deadline=None):
+        return self.post("/v2/bot/message/reply", {"replyToken": reply_token, "messages": messages}, deadline)
+
+    def broadcast(self, messages, retry_key=None):
+        # ข้อความเดียวกันใช้ retry key เดียวกันทุกครั้งที่ลองใหม่ LINE จึงไม่ส่งซ้ำถ้าครั้งก่อนสำเร็จแต่ timeout
+        return self.post("/v2/bot/message/broadcast", {"messages": messages}, retry_key=retry_key or str(uuid.uuid4()))
+
+    def post(self, path, payload, deadline=None, retry_key=None):
+        # คืนค่า response สุดท้าย หรือ None ถ้าเชื่อมต่อไม่ได้เลย
+        # retry_key (UUID) ใช้ได้กับ push/multicast/narrowcast/broadcast เท่านั้น ไม่ใช้กับ reply
+        url = self.base_url + path
+        headers = {"X-Line-Retry-Key": retry_key} if retry_key else None
+        response = None
+        for attempt in range(self.max_retries + 1):
+            start = time.monotonic()
+            try:
+                response = self.session.post(url, json=payload, headers=headers, timeout=self.timeout)
+            except requests.RequestException as e:
+                elapsed = time.monotonic() - start
+                self.latency.record(elapsed, False)
+                LINE_API_SECONDS.labels(path).observe(elapsed)
+                LINE_API_RESPONSES.labels(path, "error").inc()
+                log.warning("request_failed", "เรียก LINE API ไม่สำเร็จ ({path}): {error}", path=path, error=e)
+                response = None
+                wait = self.backoff * (2 ** attempt)
+            else:
+                elapsed = time.monotonic() - start
+                ok = response.status_code < 400
+                self.latency.record(elapsed, ok)
+                LINE_API_SECONDS.labels(path).observe(elapsed)
+                LINE_API_RESPONSES.labels(path, response.status_code).inc()
+                if retry_key and response.status_code == ALREADY_ACCEPTED_STATUS:
+                    log.info("already_accepted", "LINE รับข้อความนี้ไปแล้วจากครั้งก่อน ({path})", path=path)
+                    return response
+                if response.status_code not in RETRY_STATUS:
+                    if not ok:
+                        log.error("bad_status", "LINE API ตอบกลับ {status} ({path}): {body}",
+                                  status=response.status_code, path=path, body=response.text[:200])
+                    return response
+                wait = parse_retry_after(response.headers.get("Retry-After"))
+                if wait is None:
+                    wait = self.backoff * (2 ** attempt)
+
+            if attempt == self.max_retries:
+                break
+            if deadline is not None and time.monotonic() + wait >= deadline:
+                log.warning("deadline", "เลิกส่ง {path} เพราะจะเกินเวลาของ reply token", path=path)
+                break
+            time.sleep(wait)
+        return response
+
+    def close(self):
+        self.session.close()
+
+
+class LineSender:
+    # คิวงานส่งข้อความ ให้ webhook ตอบ 200 ได้ทันทีแล้วค่อยส่ง reply ใน thread เบื้องหลัง
+    def __init__(self, client, workers=4, max_queue=1000):
+        self.client = client
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._threads = []
+        for i in range(workers):
+            thread = threading.Thread(target=self._run, name=f"line-sender-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def reply_async(self, reply_token, messages, received_at=None):
+        received_at = time.monotonic() if received_at is None else received_at
+        deadline = received_at + REPLY_TOKEN_TTL
+        return self._submit(lambda: self.client.reply(reply_token, messages, deadline), deadline)
+
+    def broadcast_async(self, messages):
+        return self._submit(lambda: self.client.broadcast(messages), None)
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def close(self, timeout=5.0):
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def _submit(self, call, deadline):
+        future = Future()
+        try:
+            self._queue.put_nowait((call, deadline, future))
+        except queue.Full:
+            LINE_MESSAGES_DROPPED.labels("queue_full").inc()
+            log.warning("queue_full", "คิวส่งข้อความ LINE เต็ม - ทิ้งข้อความนี้")
+            future.set_result(None)
+        return future
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            call, deadline, future = item
+            if deadline is not None and time.monotonic() >= deadline:
+                LINE_MESSAGES_DROPPED.labels("token_expired").inc()
+                log.warning("token_expired", "reply token หมดอายุก่อนได้ส่ง - ข้ามข้อความนี้")
+                future.set_result(None)
+                continue
+            try:
+                future.set_result(call())
+            except Exception as e:
+                log.error("send_failed", "ส่งข้อความ LINE ผิดพลาด: {error}", error=e)
+                future.set_exception(e)
@@ -0,0 +1,92 @@
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# เซิร์ฟเวอร์จำลอง LINE Messaging API สำหรับทดสอบแบบไม่ต่ออินเทอร์เน็ต
+# ชี้ webhook มาที่นี่ด้วย LINE_API_BASE=http://127.0.0.1:8090
+
+
+class LineStubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, delay=0.0, fail_rate=0.0, fail_status=429, retry_after=1):
+        super().__init__(address, LineStubHandler)
+        self.delay = delay
+        self.fail_rate = fail_rate
+        self.fail_status = fail_status
+        self.retry_after = retry_after
+        self.lock = threading.Lock()
+        self.received = []
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start_background(self):
+        thread = threading.Thread(target=self.serve_forever, name="line-stub", daemon=True)
+        thread.start()
+        return thread
+
+
+class LineStubHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+        if self.server.delay:
+            time.sleep(self.server.delay)
+
+        if not self.headers.get("Authorization", "").startswith("Bearer "):
+            self._respond(401, {"message": "Authentication failed"})
+            return
+        if self.path not in ("/v2/bot/message/reply", "/v2/bot/message/broadcast"):
+            self._respond(404, {"message": "Not found"})
+            return
+        if random.random() < self.server.fail_rate:
+            headers = {"Retry-After": str(self.server.retry_after)} if self.server.fail_status == 429 else {}
+            self._respond(self.server.fail_status, {"message": "stub failure"}, headers)
+            return
+
+        with self.server.lock:
+            self.server.received.append((self.path, json.loads(body or b"{}")))
+        self._respond(200, {})
+
+    def _respond(self, status, payload, headers=None):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the LINE Messaging API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--delay", type=float, default=0.0, help="seconds to wait before answering")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="fraction of calls answered with --fail-status")
+    parser.add_argument("--fail-status", type=int, default=429)
+    parser.add_argument("--retry-after", type=int, default=1)
+    args = parser.parse_args()
+
+    server = LineStubServer((args.host, args.port), args.delay, args.fail_rate, args.fail_status, args.retry_after)
+    print(f"LINE stub listening on {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f"received {len(server.received)} messages")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+import argparse
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+import requests
+
+# ยิง webhook แบบมีลายเซ็นจริง แล้ววัด requests/sec และ latency (p50/p95/p99)
+# ไม่ระบุ --url จะเปิด webhook ในตัวเองโดยใช้ mongomock และ line_stub.py แทน MongoDB/LINE
+
+COMMANDS = ["สถานะเห็ด", "อุณหภูมิ", "ความชื้น", "อุณหภูมิย้อนหลัง", "ความชื้นย้อนหลัง 7", "คาดการณ์เก็บเกี่ยว", "ช่วยเหลือ"]
+
+
+def sign(secret, body):
+    return base64.b64encode(hmac.new(secret.encode(), body, hashlib.sha256).digest()).decode()
+
+
+def make_body(i, events_per_request):
+    events = []
+    for j in range(events_per_request):
+        events.append({
+            "type": "message",
+            "replyToken": f"token-{i}-{j}",
+            "message": {"type": "text", "text": COMMANDS[(i + j) % len(COMMANDS)]},
+        })
+    return json.dumps({"events": events}).encode()
+
+
+def percentile(samples, p):
+    return samples[min(int(len(samples) * p), len(samples) - 1)]
+
+
+def seed(webhook):
+    now = datetime.now(timezone.utc)
+    summary = {
+        "batch_id": "loadtest",
+        "timestamp": now,
+        "camera_id": "cam01",
+        "location": "shelf_3",
+        "mushroom_count": 10,
+        "mature_count": 4,
+        "immature_count": 6,
+        "temperature_c": 27.0,
+        "humidity_percent": 70.0,
+    }
+    webhook.rollup_engine.insert_many([dict(summary)])
+    webhook.batch_store.insert_many([summary])
+
+
+def start_local_server():
+    import mongomock
+    from werkzeug.serving import make_server
+    from line_stub import LineStubServer
+
+    stub = LineStubServer(("127.0.0.1", 0))
+    stub.start_background()
+    os.environ["LINE_API_BASE"] = stub.base_url
+    os.environ["MONGO_URI"] = "mongodb://localhost:27017"
+    mongomock.patch(servers=(("localhost", 27017),)).start()
+
+    import webhook
+    seed(webhook)
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    server = make_server("127.0.0.1", 0, webhook.app, threaded=True)
+    threading.Thread(target=server.serve_forever, name="webhook-server", daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}/webhook", webhook, stub
+
+
+def run(url, secret, total, concurrency, events_per_request):
+    local = threading.local()
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def send(i):
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        body = make_body(i, events_per_request)
+        headers = {"Content-Type": "application/json", "X-Line-Signature": sign(secret, body)}
+        start = time.perf_counter()
+        try:
+            response = local.session.post(url, data=body, headers=headers, timeout=10)
+            ok = response.status_code == 200
+        except requests.RequestException:
+            ok = False
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+            if not ok:
+                errors.append(i)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(send, range(total)))
+    duration = time.perf_counter() - start
+    return sorted(latencies), len(errors), duration
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test for the LINE webhook")
+    parser.add_argument("--url", help="webhook URL of a running server (default: start one with mocked Mongo/LINE)")
+    parser.add_argument("--secret", default=os.environ.get("LINE_CHANNEL_SECRET"), help="channel secret used to sign requests")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--events", type=int, default=1, help="events per webhook delivery")
+    args = parser.parse_args()
+
+    webhook = stub = None
+    url, secret = args.url, args.secret
+    if url is None:
+        url, webhook, stub = start_local_server()
+        secret = webhook.LINE_CHANNEL_SECRET
+    if not secret:
+        parser.error("--secret (or LINE_CHANNEL_SECRET) is required with --url")
+
+    latencies, errors, duration = run(url, secret, args.requests, args.concurrency, args.events)
+    print(f"requests:     {len(latencies)} ({errors} errors), concurrency {args.concurrency}, {args.events} event(s) each")
+    print(f"throughput:   {len(latencies) / duration:.1f} req/s")
+    print(f"latency p50:  {percentile(latencies, 0.50) * 1000:.1f} ms")
+    print(f"latency p95:  {percentile(latencies, 0.95) * 1000:.1f} ms")
+    print(f"latency p99:  {percentile(latencies, 0.99) * 1000:.1f} ms")
+
+    if webhook is not None:
+        # รอให้คิวตอบกลับ LINE ว่างก่อน แล้วรายงานผลฝั่ง reply
+        expected = args.requests * args.events
+        deadline = time.time() + 30
+        while len(stub.received) < expected and time.time() < deadline:
+            time.sleep(0.1)
+        print(f"replies sent: {len(stub.received)}/{expected}, LINE API {webhook.line_client.latency.stats()}")
+        print(f"response cache: {webhook.response_cache.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,249 +1,258 @@
 import cv2
 import time
-import board
-import adafruit_dht
-from ultralytics import YOLO
 from deep_sort_realtime.deepsort_tracker import DeepSort
-from pymongo import MongoClient
-from datetime import datetime, timezone, timedelta
-from DFRobot_RaspberryPi_A02YYUW import DFRobot_A02_Distance as DistanceSensor
-from luma.core.interface.serial import i2c
-from luma.core.render import canvas
-from luma.oled.device import ssd1306 
+from datetime import timezone, timedelta
+from pipeline import Pipeline
+from mongo_writer import make_client
+from detector import create_detector, to_deepsort_detections
+from measurement import CameraModel, MaturityBands, SizeEstimator
+from sensors import A02YYUWDriver, DHT11Driver, SensorService
+from motion_gate import InferenceScheduler
+from track_registry import TrackRegistry
+from reid_index import open_reid_index
+from vision import FRAME_SIZE, BatchSink, MushroomStream
+from instrumentation import EventLog, serve_metrics
+
+# ฮาร์ดแวร์ (จอ OLED, DHT11, A02YYUW, กล้อง) และ MongoDB เปิดใน main() เท่านั้น
+# replay.py จึง import ไฟล์นี้เพื่อใช้เส้นทางตรวจจับ/ติดตาม/วัดขนาด/บันทึกเดียวกันบนเครื่องที่ไม่มีบอร์ดได้
 
 I2C_ADDRESS = 0x3C # Address ของจอ OLED
 OLED_WIDTH = 128
-OLED_HEIGHT = 32 
-
-Serial Interface (I2C) 
-print("Initializing I2C serial interface for OLED...")
-oled_device = None
-try:
-    oled_serial = i2c(port=1, address=I2C_ADDRESS)
-    oled_device = ssd1306(oled_serial, width=OLED_WIDTH, height=OLED_HEIGHT)
-    print("OLED display initialized successfully.")
-    # เคลียร์จอ OLED ตอนเริ่ม
+OLED_HEIGHT = 32
+
+# โหลดโมเดล YOLOv8 เลือก backend ได้: "ultralytics" (.pt), "onnx", "openvino", "ncnn"
+# ไฟล์สำหรับ backend อื่นสร้างด้วย export_model.py
+DETECTOR_BACKEND = "ultralytics"
+MODEL_PATH = r"input your model"
+
+# รัน YOLO เฉพาะเมื่อภาพเปลี่ยนเกิน MOTION_THRESHOLD (สัดส่วนพิกเซล) หรือครบ MAX_INFERENCE_INTERVAL วินาที
+# MIN_INFERENCE_INTERVAL จำกัดความถี่สูงสุดของการรัน YOLO (0 = ไม่จำกัด)
+MOTION_THRESHOLD = 0.02
+MAX_INFERENCE_INTERVAL = 30
+MIN_INFERENCE_INTERVAL = 0
+
+thai_timezone = timezone(timedelta(hours=7))
+
+# พารามิเตอร์กล้อง
+sensor_width_mm = 8.46666582
+image_width_px = 640
+focal_length_mm = 3.2
+# ไฟล์ผล calibrate กล้อง (camera_matrix / dist_coeffs) ถ้ามีจะใช้แทนค่าด้านบน
+CAMERA_CALIBRATION_FILE = None
+CAMERA_ID = "cam01"
+LOCATION = "shelf_3"
+
+# ช่วงความกว้าง (ซม.) ที่ถือว่าพร้อมเก็บ
+MATURITY_BANDS = MaturityBands([("mature", 1.5, 2.0)], default="immature")
+
+log_interval = 3  # วินาที
+
+# track ที่ DeepSort ลบแล้วหรือไม่เห็นเกิน TRACK_TTL_S วินาทีจะถูกปิด (บันทึกขนาดสุดท้ายลง mushroom_track_events)
+# เก็บได้ไม่เกิน MAX_TRACKS ดอกต่อกล้อง และบันทึกซ้ำเมื่อขนาดเปลี่ยนอย่างน้อย SIZE_CHANGE_CM หรือระดับเปลี่ยน
+TRACK_TTL_S = 120
+MAX_TRACKS = 256
+SIZE_CHANGE_CM = 0.05
+
+# จำเห็ดด้วยตำแหน่งบนชั้นวาง + ลักษณะภาพ ให้ได้ mushroom_id เดิมหลังรีสตาร์ทหรือ track หลุด
+# REID_RADIUS_PX = ระยะที่ยอมให้ตำแหน่งเลื่อน, REID_MIN_SIMILARITY = cosine similarity ต่ำสุดที่ถือว่าเป็นดอกเดิม
+REID_INDEX_FILE = f"reid_{CAMERA_ID}_{LOCATION}.npz"
+REID_RADIUS_PX = 40
+REID_MIN_SIMILARITY = 0.8
+
+#เพิ่มตัวแปรสำหรับควบคุมการอัปเดตจอ OLED
+oled_update_interval = 1
+
+# ความถี่ในการพิมพ์สถิติ FPS / ความลึกคิวของแต่ละ stage
+stats_interval = 5  # วินาที
+
+# Prometheus อ่านค่าได้ที่ http://<pi>:METRICS_PORT/metrics (None = ไม่เปิด)
+# ข้อความรายเฟรมพิมพ์เมื่อตั้ง LOG_LEVEL=debug เท่านั้น (ดู instrumentation.py)
+METRICS_PORT = 9108
+
+log = EventLog("maincode")
+
+
+def open_oled():
+    # Serial Interface (I2C) คืนค่า None ถ้าไม่มีจอ
+    log.info("oled_init", "Initializing I2C serial interface for OLED...")
+    try:
+        from luma.core.interface.serial import i2c
+        from luma.oled.device import ssd1306
+        oled_serial = i2c(port=1, address=I2C_ADDRESS)
+        oled_device = ssd1306(oled_serial, width=OLED_WIDTH, height=OLED_HEIGHT)
+        log.info("oled_ready", "OLED display initialized successfully.")
+        # เคลียร์จอ OLED ตอนเริ่ม
+        clear_oled(oled_device)
+        return oled_device
+    except Exception as e:
+        log.warning("oled_error", "Error initializing OLED display: {error} - OLED display will not be used.", error=e)
+        return None
+
+
+def clear_oled(oled_device):
+    from luma.core.render import canvas
     with canvas(oled_device) as draw:
         draw.rectangle(oled_device.bounding_box, outline="black", fill="black")
-except Exception as e:
-    print(f"Error initializing OLED display: {e}")
-    print("OLED display will not be used.")
 
 
-sensor_board = DistanceSensor()
-sensor_board.set_dis_range(0, 4500)
+def show_env_on_oled(oled_device, env_sensor):
+    # เพิ่มส่วนแสดงผลบน OLED สำหรับอุณหภูมิและความชื้นเท่านั้น
+    from luma.core.render import canvas
+    env_reading = env_sensor.latest()
+    current_temp, current_humidity = env_reading.value if env_reading is not None else (None, None)
+    with canvas(oled_device) as draw:
+        # อุณหภูมิ
+        temp_str = f"Temp: {current_temp:.1f} C" if current_temp is not None else "Temp: N/A C"
+        draw.text((0, 0), temp_str, fill="white")
+
+        # ความชื้น
+        humi_str = f"Humi: {current_humidity:.1f} %" if current_humidity is not None else "Humi: N/A %"
+
+        # ตำแหน่ง y สำหรับบรรทัดที่ 2
+        if OLED_HEIGHT == 32:
+            # สำหรับ 128x32, วางบรรทัดที่ 2 ที่ y=16 (กลางๆ จอ)
+            draw.text((0, 16), humi_str, fill="white")
+        elif OLED_HEIGHT == 64:
+            # สำหรับ 128x64, วางบรรทัดที่ 2 ที่ y=20 (เว้นระยะจากบรรทัดแรก)
+            draw.text((0, 20), humi_str, fill="white")
+
+
+def add_sensors(sensor_service, distance_driver, env_driver):
+    # เซ็นเซอร์แต่ละตัวอ่านใน thread ของตัวเอง ค่าที่เก่ากว่า staleness_s จะถูกระบุในเอกสารว่า stale
+    distance_sensor = sensor_service.add("a02yyuw", distance_driver, interval=0.1, staleness_s=1.0)
+    env_sensor = sensor_service.add("dht11", env_driver, interval=2.0, staleness_s=10.0, ema_alpha=0.3)
+    return distance_sensor, env_sensor
+
+
+def open_sensors():
+    import board
+    import adafruit_dht
+    from DFRobot_RaspberryPi_A02YYUW import DFRobot_A02_Distance as DistanceSensor
+
+    sensor_board = DistanceSensor()
+    sensor_board.set_dis_range(0, 4500)
+    # ตั้งค่าเซ็นเซอร์ DHT11 ที่ขา GPIO17
+    dht_device = adafruit_dht.DHT11(board.D17)
+
+    sensor_service = SensorService()
+    distance_sensor, env_sensor = add_sensors(sensor_service, A02YYUWDriver(sensor_board), DHT11Driver(dht_device))
+    return sensor_service, distance_sensor, env_sensor
+
 
-def get_distance_mm():
-    distance = sensor_board.getDistance()
-    if sensor_board.last_operate_status == sensor_board.STA_OK:
-        return distance
+def build_stream(distance_sensor, env_sensor, sink, identity_store=None, reid_index_file=REID_INDEX_FILE):
+    if CAMERA_CALIBRATION_FILE:
+        camera_model = CameraModel.load(CAMERA_CALIBRATION_FILE, FRAME_SIZE)
     else:
-        print("[⚠️] อ่านระยะไม่สำเร็จ - ใช้ค่าปริยาย 100 mm")
-        return 100
+        camera_model = CameraModel.from_sensor(sensor_width_mm, focal_length_mm, FRAME_SIZE)
+    size_estimator = SizeEstimator(camera_model, MATURITY_BANDS)
 
-# โหลดโมเดล YOLOv8 
-model = YOLO(r"input your model")
+    # สร้าง tracker DeepSort
+    tracker = DeepSort(max_age=5)
+    scheduler = InferenceScheduler(MOTION_THRESHOLD, MAX_INFERENCE_INTERVAL, MIN_INFERENCE_INTERVAL)
+    identity = open_reid_index(CAMERA_ID, LOCATION, reid_index_file, identity_store,
+                               radius_px=REID_RADIUS_PX, min_similarity=REID_MIN_SIMILARITY)
 
-# สร้าง tracker DeepSort
-tracker = DeepSort(max_age=5)
+    # สถานะของกล้องตัวนี้: tracker, การจับคู่ track -> mushroom_id, ข้อมูลเห็ดล่าสุด
+    return MushroomStream(CAMERA_ID, LOCATION, tracker, size_estimator, distance_sensor, env_sensor,
+                          sink, scheduler, log_interval, thai_timezone,
+                          TrackRegistry(TRACK_TTL_S, MAX_TRACKS, SIZE_CHANGE_CM, identity=identity))
 
-thai_timezone = timezone(timedelta(hours=7))
 
-# ตั้งค่าเซ็นเซอร์ DHT11 ที่ขา GPIO17
-dht_device = adafruit_dht.DHT11(board.D17)
+def make_stages(stream, detector, clock=None, display=None):
+    # clock = None ใช้เวลาจริง, replay.py ส่งนาฬิกาตามเวลาของวิดีโอแทน
+    # display(now) ถูกเรียกจาก sink stage (ใช้อัปเดตจอ OLED)
+    def inference_stage(item):
+        frame_id, captured_at, frame = item
+        log.debug("frame_read", "อ่านภาพรอบที่ {frame}", frame=frame_id)
 
-# เชื่อมต่อ MongoDB
-client = MongoClient("input your uri")
-db = client["mushroom_db"]
-collection = db["mushroom_data"]
+        frame = stream.prepare(frame)
+        if not stream.wants_inference(frame, None if clock is None else clock()):
+            return frame_id, captured_at, frame, None
 
-# เปิดกล้อง
-cap = cv2.VideoCapture(0)
-if not cap.isOpened():
-    print("Unable to open camera!")
-    exit()
+        # ตรวจจับเห็ดด้วย YOLO (กรองคลาส/คะแนนและตัดขอบภาพใน backend แล้ว)
+        detections = to_deepsort_detections(detector.detect(frame), class_id=0)
 
-# พารามิเตอร์กล้อง
-sensor_width_mm = 8.46666582 
-image_width_px = 640          
-focal_length_mm = 3.2         
+        return frame_id, captured_at, frame, detections
 
-last_log_time = 0
-log_interval = 3  # วินาที
+    def tracking_stage(item):
+        return stream.track(*item)
 
-#เพิ่มตัวแปรสำหรับควบคุมการอัปเดตจอ OLED 
-last_oled_update_time = 0
-oled_update_interval = 1
+    def sink_stage(live_tracks):
+        now = time.time() if clock is None else clock()
+        stream.maybe_flush(live_tracks, now)
+        if display is not None:
+            display(now)
 
+    return inference_stage, tracking_stage, sink_stage
 
-locked_ids = {}
-next_locked_id = 1
-latest_mushroom_data = {}
 
-frame_count = 0
+def main():
+    oled_device = open_oled()
+    sensor_service, distance_sensor, env_sensor = open_sensors()
+    detector = create_detector(DETECTOR_BACKEND, MODEL_PATH, class_id=0, score_threshold=0.3)
 
-print("Starting mushroom detection and sensor reading...")
+    # เชื่อมต่อ MongoDB
+    client = make_client("input your uri")
+    db = client["mushroom_db"]
+    batch_sink = BatchSink(db, thai_timezone, journal_prefix="mongo_spill")
 
-#เพิ่มตัวแปรสำหรับเก็บค่า T/H ล่าสุด
-current_temp = None
-current_humidity = None
+    # เปิดกล้อง
+    cap = cv2.VideoCapture(0)
+    if not cap.isOpened():
+        log.error("camera_error", "Unable to open camera!")
+        exit()
+    # ให้ driver เก็บเฟรมค้างไว้น้อยที่สุด (thread capture จะอ่านตลอดอยู่แล้ว)
+    cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
 
-def read_dht_sensor(dht_device):
-    try:
-        temperature_c = dht_device.temperature
-        humidity = dht_device.humidity
-        if temperature_c is None or humidity is None:
-            raise RuntimeError("Sensor returned None")
-        return temperature_c, humidity
-    except RuntimeError as error:
-        print(f"[Warning] DHT11 อ่านค่าไม่สำเร็จ: {error}")
-        return None, None
-
-try:
-    while True:
-        frame_count += 1
-        ret, frame = cap.read()
-        if not ret:
-            print("Camera read error.")
-            time.sleep(1)
-            continue
-
-        print(f"[Info] อ่านภาพรอบที่ {frame_count}")
-
-        # ปรับขนาดภาพให้ตรงกับโมเดล
-        frame = cv2.resize(frame, (640, 384))
-        height, width, _ = frame.shape
-
-        # อ่านระยะจากเซ็นเซอร์ A02YYUW
-        distance_mm = get_distance_mm()
-
-        # ตรวจจับเห็ดด้วย YOLO
-        results = model(frame)[0]
-
-        detections = []
-        for r in results.boxes.data.cpu().numpy():
-            x1, y1, x2, y2, score, class_id = r
-            class_id = int(class_id)
-            if class_id == 0 and score > 0.3:
-                x1c = max(0, int(x1))
-                y1c = max(0, int(y1))
-                x2c = min(width - 1, int(x2))
-                y2c = min(height - 1, int(y2))
-                w = x2c - x1c
-                h = y2c - y1c
-                if w <= 0 or h <= 0:
-                    continue
-                bbox = [x1c, y1c, w, h]
-                detections.append((bbox, score, class_id))
-
-        # ติดตามด้วย DeepSort
-        tracks = tracker.update_tracks(detections, frame=frame)
-        now = time.time()
-
-        for track in tracks:
-            if not track.is_confirmed():
-                continue
-
-            track_id = track.track_id
-            if track_id not in locked_ids:
-                locked_ids[track_id] = next_locked_id
-                next_locked_id += 1
-            locked_id = locked_ids[track_id]
-
-            x1, y1, x2, y2 = map(int, track.to_tlbr())
-            center_x = (x1 + x2) // 2
-            center_y = (y1 + y2) // 2
-            width_box_px = x2 - x1
-            height_box_px = y2 - y1
-
-            pixel_size_mm = sensor_width_mm / image_width_px  
-            bbox_width_mm = width_box_px * pixel_size_mm
-            object_real_width_mm = (bbox_width_mm * distance_mm) / focal_length_mm
-            object_real_width_cm = object_real_width_mm / 10
-
-            maturity_label = "mature" if 1.5 <= object_real_width_cm <= 2 else "immature"
-
-            label_text = f'ID:{locked_id} Size:{object_real_width_cm:.2f}cm ({maturity_label})'
-
-            cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
-            cv2.putText(frame, label_text, (x1, y1 - 10),
-                                 cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
-
-            latest_mushroom_data[locked_id] = {
-                "mushroom_id": int(locked_id),
-                "maturity_status": maturity_label,
-                "real_size_cm": object_real_width_cm,
-                "timestamp": datetime.now(tz=thai_timezone).isoformat(),
-                "camera_id": "cam01",
-                "location": "shelf_3"
-            }
-
-            print(f"Track ID: {track_id} (Locked ID: {locked_id}), Center: ({center_x}, {center_y}), "
-                          f"Size(px): ({width_box_px}x{height_box_px}), Real Width: {object_real_width_cm:.2f} cm")
-
-        # ถ้าถึงเวลา log และมีข้อมูล
-        if now - last_log_time >= log_interval and latest_mushroom_data:
-            print(f"เวลาเกิน {log_interval} วิ - เตรียมส่งข้อมูลเห็ดจำนวน {len(latest_mushroom_data)}")
-
-            temperature_c, humidity = read_dht_sensor(dht_device)
-            # อัปเดตค่า ล่าสุดเพื่อใช้แสดงบน OLED
-            current_temp = temperature_c
-            current_humidity = humidity
-           
-
-            if temperature_c is not None and humidity is not None:
-                print(f"อ่านค่าได้ Temp: {temperature_c}°C, Humidity: {humidity}%")
-                docs_to_insert = []
-                for data in latest_mushroom_data.values():
-                    doc = data.copy()
-                    doc["temperature_c"] = temperature_c
-                    doc["humidity_percent"] = humidity
-                    docs_to_insert.append(doc)
-                try:
-                    result = collection.insert_many(docs_to_insert)
-                    if result.acknowledged:
-                        print(f"[✅] ส่งข้อมูลสำเร็จ จำนวน {len(result.inserted_ids)} รายการ")
-                    else:
-                        print("[⚠️] MongoDB ไม่ตอบรับการบันทึกข้อมูล")
-                    for d in docs_to_insert:
-                        print(d)
-                except Exception as e:
-                    print(f"[❌] เกิดข้อผิดพลาดในการส่งข้อมูลเข้า MongoDB: {e}")
-            else:
-                print("[Warning] ข้ามบันทึกข้อมูลเพราะเซ็นเซอร์อ่านค่าไม่สมบูรณ์")
-
-            last_log_time = now
-
-        # เพิ่มส่วนแสดงผลบน OLED สำหรับอุณหภูมิและความชื้นเท่านั้น
-        if oled_device is not None and now - last_oled_update_time >= oled_update_interval:
-            with canvas(oled_device) as draw:
-                # อุณหภูมิ
-                temp_str = f"Temp: {current_temp:.1f} C" if current_temp is not None else "Temp: N/A C"
-                draw.text((0, 0), temp_str, fill="white")
-
-                # ความชื้น
-                humi_str = f"Humi: {current_humidity:.1f} %" if current_humidity is not None else "Humi: N/A %"
-                
-                # ตำแหน่ง y สำหรับบรรทัดที่ 2
-                if OLED_HEIGHT == 32:
-                    # สำหรับ 128x32, วางบรรทัดที่ 2 ที่ y=16 (กลางๆ จอ)
-                    draw.text((0, 16), humi_str, fill="white") 
-                elif OLED_HEIGHT == 64:
-                    # สำหรับ 128x64, วางบรรทัดที่ 2 ที่ y=20 (เว้นระยะจากบรรทัดแรก)
-                    draw.text((0, 20), humi_str, fill="white")
+    stream = build_stream(distance_sensor, env_sensor, batch_sink, batch_sink.identity_store)
+    identity = stream.registry.identity
+
+    last_oled_update_time = 0
 
+    def update_oled(now):
+        nonlocal last_oled_update_time
+        if oled_device is not None and now - last_oled_update_time >= oled_update_interval:
+            show_env_on_oled(oled_device, env_sensor)
             last_oled_update_time = now # อัปเดตเวลาที่ OLED ล่าสุด
-    
 
-        time.sleep(0.05)
+    log.info("started", "Starting mushroom detection and sensor reading...")
 
-except KeyboardInterrupt:
-    print("Program interrupted by user")
+    # แยกงานเป็น stage: กล้อง -> YOLO -> DeepSort/วัดขนาด -> บันทึก/OLED
+    # แต่ละ stage เชื่อมกันด้วยคิวที่ทิ้งของเก่า stage ที่ช้าจึงไม่ถ่วงกล้องและตัวตรวจจับ
+    inference_stage, tracking_stage, sink_stage = make_stages(stream, detector, display=update_oled)
+    pipeline = Pipeline(cap)
+    pipeline.add_stage("inference", inference_stage)
+    pipeline.add_stage("tracking", tracking_stage)
+    pipeline.add_stage("sink", sink_stage, sink=True)
 
-finally:
-    cap.release()
-    # เพิ่มส่วนเคลียร์จอ OLED เมื่อโปรแกรมหยุด
-    if oled_device is not None:
-        with canvas(oled_device) as draw:
-            draw.rectangle(oled_device.bounding_box, outline="black", fill="black")
-    # ---
\ No newline at end of file
+    try:
+        if METRICS_PORT is not None:
+            serve_metrics(METRICS_PORT)
+        sensor_service.start()
+        batch_sink.start()
+        pipeline.start()
+        while True:
+            time.sleep(stats_interval)
+            log.info("pipeline_stats", "[Pipeline] {report}", report=pipeline.report())
+            log.info("writer_stats", "[Writers] {stats}", stats=batch_sink.stats())
+            log.info("sensor_stats", "[Sensors] {stats}", stats=sensor_service.stats())
+            log.info("scheduler_stats", "[Scheduler] {stats}", stats=stream.scheduler.stats())
+            log.info("track_stats", "[Tracks] {tracks} [Re-ID] {reid}", tracks=stream.registry.stats(), reid=identity.stats())
+
+    except KeyboardInterrupt:
+        log.info("interrupted", "Program interrupted by user")
+
+    finally:
+        pipeline.stop()
+        sensor_service.stop()
+        stream.close()
+        batch_sink.close()
+        cap.release()
+        # เพิ่มส่วนเคลียร์จอ OLED เมื่อโปรแกรมหยุด
+        if oled_device is not None:
+            clear_oled(oled_device)
+        # ---
+
+
+if __name__ == "__main__":
+    main()
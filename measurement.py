@@ -0,0 +1,133 @@
+import json
+from datetime import datetime
+import cv2
+import numpy as np
+
+# วัดขนาดจริงของเห็ดทุกดอกในเฟรมพร้อมกันด้วย NumPy
+# ผลลัพธ์เป็น structured array หนึ่งแถวต่อดอก แทนการสร้าง dict ต่อ track
+RECORD_DTYPE = np.dtype([
+    ("mushroom_id", np.int32),
+    ("x1", np.int16),
+    ("y1", np.int16),
+    ("x2", np.int16),
+    ("y2", np.int16),
+    ("width_cm", np.float32),
+    ("height_cm", np.float32),
+    ("maturity", np.uint8),
+    ("distance_stale", np.bool_),
+    ("timestamp", np.float64),
+])
+
+
+class CameraModel:
+    # พารามิเตอร์ภายในของกล้อง (camera matrix + lens distortion) ที่ขนาดภาพ image_size (กว้าง, สูง)
+    def __init__(self, camera_matrix, dist_coeffs=None, image_size=(640, 384)):
+        self.camera_matrix = np.asarray(camera_matrix, dtype=np.float64)
+        self.dist_coeffs = None if dist_coeffs is None else np.asarray(dist_coeffs, dtype=np.float64).reshape(-1)
+        if self.dist_coeffs is not None and not self.dist_coeffs.any():
+            self.dist_coeffs = None
+        self.image_size = tuple(image_size)
+
+    @classmethod
+    def from_sensor(cls, sensor_width_mm, focal_length_mm, image_size=(640, 384)):
+        # แบบเดิมของ maincode.py: pinhole ไม่มี distortion จุดกึ่งกลางอยู่กลางภาพ
+        width, height = image_size
+        focal_px = focal_length_mm * width / sensor_width_mm
+        matrix = [[focal_px, 0, width / 2], [0, focal_px, height / 2], [0, 0, 1]]
+        return cls(matrix, None, image_size)
+
+    @classmethod
+    def load(cls, path, image_size=(640, 384)):
+        # ไฟล์ JSON จาก cv2.calibrateCamera: camera_matrix, dist_coeffs, image_size ตอน calibrate
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        camera = cls(data["camera_matrix"], data.get("dist_coeffs"), data.get("image_size", image_size))
+        return camera.scaled(image_size)
+
+    def scaled(self, image_size):
+        # ภาพถูก resize ก่อนเข้าโมเดล ต้องปรับ camera matrix ตามสัดส่วน
+        sx = image_size[0] / self.image_size[0]
+        sy = image_size[1] / self.image_size[1]
+        matrix = self.camera_matrix.copy()
+        matrix[0] *= sx
+        matrix[1] *= sy
+        return CameraModel(matrix, self.dist_coeffs, image_size)
+
+    def normalize(self, points):
+        # พิกัดพิกเซล (N, 2) -> พิกัดบนระนาบภาพที่ระยะ 1 หน่วย (แก้ distortion แล้ว)
+        points = np.asarray(points, dtype=np.float64)
+        if self.dist_coeffs is None:
+            fx, fy = self.camera_matrix[0, 0], self.camera_matrix[1, 1]
+            cx, cy = self.camera_matrix[0, 2], self.camera_matrix[1, 2]
+            return (points - (cx, cy)) / (fx, fy)
+        return cv2.undistortPoints(points.reshape(-1, 1, 2), self.camera_matrix, self.dist_coeffs).reshape(-1, 2)
+
+
+class MaturityBands:
+    # ช่วงความกว้าง (ซม.) ของแต่ละระดับ เช็คตามลำดับ ถ้าไม่เข้าช่วงใดเลยได้ default
+    def __init__(self, bands=(("mature", 1.5, 2.0),), default="immature"):
+        self.bands = [(label, float(low), float(high)) for label, low, high in bands]
+        self.labels = [default] + [label for label, _, _ in self.bands]
+
+    def classify(self, width_cm):
+        index = np.zeros(len(width_cm), dtype=np.uint8)
+        for i, (_, low, high) in enumerate(self.bands, start=1):
+            index[(index == 0) & (width_cm >= low) & (width_cm <= high)] = i
+        return index
+
+
+class SizeEstimator:
+    def __init__(self, camera, bands=None):
+        self.camera = camera
+        self.bands = bands or MaturityBands()
+
+    def measure(self, mushroom_ids, boxes, distance_mm, timestamp):
+        # boxes: (N, 4) x1, y1, x2, y2 เป็นพิกเซล
+        # distance_mm: ค่าเดียวทั้งเฟรม หรือ depth map 2 มิติ (ขนาดใดก็ได้ ครอบทั้งภาพ) เพื่อแก้ระยะรายพื้นที่
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        n = len(boxes)
+        corners = self.camera.normalize(np.concatenate([boxes[:, 0:2], boxes[:, 2:4]]))
+        extent = corners[n:] - corners[:n]
+        depth_cm = self._sample_distance(distance_mm, boxes) / 10
+
+        records = np.empty(n, dtype=RECORD_DTYPE)
+        records["mushroom_id"] = mushroom_ids
+        records["x1"] = boxes[:, 0]
+        records["y1"] = boxes[:, 1]
+        records["x2"] = boxes[:, 2]
+        records["y2"] = boxes[:, 3]
+        records["width_cm"] = extent[:, 0] * depth_cm
+        records["height_cm"] = extent[:, 1] * depth_cm
+        records["maturity"] = self.bands.classify(records["width_cm"])
+        records["timestamp"] = timestamp
+        records["distance_stale"] = False
+        return records
+
+    def _sample_distance(self, distance_mm, boxes):
+        distance_mm = np.asarray(distance_mm, dtype=np.float64)
+        if distance_mm.ndim == 0:
+            return np.full(len(boxes), float(distance_mm))
+        # อ่านค่าจาก depth map ที่ตำแหน่งกึ่งกลางกล่อง
+        grid_h, grid_w = distance_mm.shape
+        width, height = self.camera.image_size
+        cx = (boxes[:, 0] + boxes[:, 2]) / 2
+        cy = (boxes[:, 1] + boxes[:, 3]) / 2
+        gx = np.clip((cx * grid_w / width).astype(np.int64), 0, grid_w - 1)
+        gy = np.clip((cy * grid_h / height).astype(np.int64), 0, grid_h - 1)
+        return distance_mm[gy, gx]
+
+    def label(self, record):
+        return self.bands.labels[record["maturity"]]
+
+    def to_document(self, record, camera_id, location, tz):
+        # แปลงเป็นเอกสาร MongoDB ตอนบันทึกเท่านั้น
+        return {
+            "mushroom_id": int(record["mushroom_id"]),
+            "maturity_status": self.label(record),
+            "real_size_cm": float(record["width_cm"]),
+            "real_height_cm": float(record["height_cm"]),
+            "timestamp": datetime.fromtimestamp(float(record["timestamp"]), tz=tz),
+            "camera_id": camera_id,
+            "location": location,
+            "distance_stale": bool(record["distance_stale"]),
+        }
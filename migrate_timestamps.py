@@ -0,0 +1,84 @@
+import argparse
+import time
+from pymongo import MongoClient, UpdateOne
+from pymongo.errors import BulkWriteError
+from mongo_writer import DUPLICATE_KEY_ERROR
+from storage import DB_NAME, COLLECTION_NAME, ensure_indexes, is_timeseries, open_mushroom_collection, to_datetime
+
+# แปลงเอกสารเก่าที่เก็บ timestamp เป็น ISO string ให้เป็น BSON datetime
+# - ไม่ระบุ --target: แก้ในที่เดิมทีละชุดด้วย bulk_write
+# - ระบุ --target: คัดลอกไปยัง collection ใหม่ (เช่น time-series) เพราะ time-series แก้ timeField ไม่ได้
+
+STRING_TIMESTAMP = {"timestamp": {"$type": "string"}}
+
+
+def migrate_in_place(collection, batch_size):
+    converted = 0
+    while True:
+        docs = list(collection.find(STRING_TIMESTAMP, {"timestamp": 1}).limit(batch_size))
+        if not docs:
+            break
+        ops = [UpdateOne({"_id": d["_id"]}, {"$set": {"timestamp": to_datetime(d["timestamp"])}}) for d in docs]
+        result = collection.bulk_write(ops, ordered=False)
+        converted += result.modified_count
+        print(f"[Info] แปลงแล้ว {converted} รายการ")
+    return converted
+
+
+def migrate_copy(source, target, batch_size, resume=False):
+    # resume=True (target เป็น time-series): time-series ไม่บังคับ _id ไม่ซ้ำ รันซ้ำจึงพึ่งการชน _id ไม่ได้
+    # เริ่มต่อจาก _id สุดท้ายใน target แทน คัดลอกเรียงตาม _id และ insert แบบ ordered ที่อยู่ก่อนหน้าจึงครบแล้ว
+    query = {}
+    if resume:
+        last = target.find_one({}, {"_id": 1}, sort=[("_id", -1)])
+        if last is not None:
+            query = {"_id": {"$gt": last["_id"]}}
+            print(f"[Info] คัดลอกต่อจาก _id {last['_id']}")
+    copied = 0
+    batch = []
+    for doc in source.find(query).sort("_id", 1).batch_size(batch_size):
+        doc["timestamp"] = to_datetime(doc["timestamp"])
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            copied += _insert_ignoring_duplicates(target, batch, ordered=resume)
+            batch = []
+            print(f"[Info] คัดลอกแล้ว {copied} รายการ")
+    if batch:
+        copied += _insert_ignoring_duplicates(target, batch, ordered=resume)
+    return copied
+
+
+def _insert_ignoring_duplicates(target, docs, ordered=False):
+    # รันซ้ำได้ (collection ปกติ): เอกสารที่คัดลอกไปแล้วจะชน _id และถูกข้ามไป error อื่นต้องหยุดให้เห็น
+    try:
+        return len(target.insert_many(docs, ordered=ordered).inserted_ids)
+    except BulkWriteError as e:
+        if any(err.get("code") != DUPLICATE_KEY_ERROR for err in e.details.get("writeErrors", [])):
+            raise
+        return e.details.get("nInserted", 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert string timestamps in mushroom_data to BSON datetime")
+    parser.add_argument("--uri", required=True)
+    parser.add_argument("--db", default=DB_NAME)
+    parser.add_argument("--source", default=COLLECTION_NAME)
+    parser.add_argument("--target", help="copy into this collection instead of updating in place")
+    parser.add_argument("--timeseries", action="store_true", help="create --target as a time-series collection")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    db = MongoClient(args.uri)[args.db]
+    source = db[args.source]
+    start = time.time()
+    if args.target:
+        target = open_mushroom_collection(db, args.target, timeseries=args.timeseries)
+        count = migrate_copy(source, target, args.batch_size, resume=is_timeseries(db, args.target))
+    else:
+        count = migrate_in_place(source, args.batch_size)
+        ensure_indexes(source)
+    print(f"[✅] เสร็จสิ้น {count} รายการ ใช้เวลา {time.time() - start:.1f} วินาที")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,312 @@
+import os
+import queue
+import shutil
+import threading
+import time
+import bson
+from bson import json_util
+from pymongo import MongoClient
+from pymongo.errors import BulkWriteError, PyMongoError
+from pymongo.write_concern import WriteConcern
+from instrumentation import EventLog, counter, histogram
+
+DUPLICATE_KEY_ERROR = 11000
+
+FLUSH_SECONDS = histogram("mongo_flush_seconds", "insert_many latency per batch", ("writer",))
+WRITER_DOCS = counter("mongo_writer_docs_total", "Documents handled by MongoBatchWriter by outcome",
+                      ("writer", "outcome"))
+log = EventLog("mongo_writer")
+
+
+def make_client(uri, max_pool_size=4, timeout_ms=3000):
+    # ใช้ client ตัวเดียวตลอดโปรแกรม ตั้ง timeout สั้น ๆ เพื่อไม่ให้ค้างนานตอนเน็ตหลุด
+    return MongoClient(
+        uri,
+        maxPoolSize=max_pool_size,
+        serverSelectionTimeoutMS=timeout_ms,
+        connectTimeoutMS=timeout_ms,
+        socketTimeoutMS=timeout_ms * 2,
+        retryWrites=True,
+    )
+
+
+def tuned_collection(collection, w=1, journal=False):
+    # ข้อมูลเซ็นเซอร์เขียนซ้ำทุกไม่กี่วินาที ไม่ต้องรอ journal ฝั่ง server
+    return collection.with_options(write_concern=WriteConcern(w=w, j=journal))
+
+
+class MongoBatchWriter(threading.Thread):
+    # เขียนข้อมูลลง MongoDB เป็นชุดใน thread แยก
+    # ถ้าต่อ server ไม่ได้จะเก็บลงไฟล์ journal ในเครื่อง แล้วค่อยส่งตามลำดับเมื่อกลับมาต่อได้
+    def __init__(self, collection, journal_path="mongo_spill.jsonl", max_queue=10000,
+                 batch_size=200, flush_interval=2.0, retry_interval=10.0, name="mongo"):
+        super().__init__(name=f"mongo-writer-{name}", daemon=True)
+        self.writer_name = name
+        self.collection = collection
+        self.journal_path = journal_path
+        # ไฟล์ journal ที่กำลังส่งอยู่ (ย้ายออกมาก่อนส่ง เพื่อให้ submit() เขียน journal ใหม่ได้ระหว่างรอ server)
+        self.drain_path = journal_path + ".draining"
+        # เอกสารที่ server ไม่มีทางรับ (แปลงเป็น BSON ไม่ได้ หรือถูกปฏิเสธ) เก็บไว้ให้ตรวจดูเอง ไม่ส่งซ้ำ
+        self.rejected_path = journal_path + ".rejected"
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retry_interval = retry_interval
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._journal_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._next_retry = 0.0
+
+        self.docs_written = 0
+        self.docs_spilled = 0
+        self.docs_replayed = 0
+        self.docs_failed = 0
+        self.flush_count = 0
+        self.last_flush_ms = 0.0
+        self._flush_ms_total = 0.0
+
+    def submit(self, docs):
+        # ไม่บล็อกผู้เรียก ถ้าคิวเต็มจะเขียนลง journal ทันที
+        overflow = []
+        for doc in docs:
+            try:
+                self._queue.put_nowait(doc)
+            except queue.Full:
+                overflow.append(doc)
+        if overflow:
+            self._spill(overflow)
+        return len(docs) - len(overflow)
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def stats(self):
+        with self._stats_lock:
+            avg_ms = self._flush_ms_total / self.flush_count if self.flush_count else 0.0
+            return {
+                "docs_written": self.docs_written,
+                "docs_spilled": self.docs_spilled,
+                "docs_replayed": self.docs_replayed,
+                "docs_failed": self.docs_failed,
+                "queue_depth": self._queue.qsize(),
+                "last_flush_ms": self.last_flush_ms,
+                "avg_flush_ms": avg_ms,
+            }
+
+    def close(self, timeout=10.0):
+        self._stop_event.set()
+        self.join(timeout)
+
+    def run(self):
+        while not self._stop_event.is_set():
+            batch = self._collect_batch()
+            self._run_guarded(self._drain_journal)
+            if batch:
+                self._run_guarded(self._write, batch)
+        # ส่งของที่เหลือในคิวก่อนปิด ถ้าส่งไม่ได้ก็ลง journal
+        leftover = []
+        while True:
+            try:
+                leftover.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        for i in range(0, len(leftover), self.batch_size):
+            self._run_guarded(self._write, leftover[i:i + self.batch_size])
+
+    def _run_guarded(self, func, batch=None):
+        # error ที่ไม่คาดคิด (เช่นดิสก์เต็มตอนเขียน journal) ต้องไม่ทำให้ thread ตายแล้วคิวหยุดส่งเงียบ ๆ
+        try:
+            if batch is None:
+                func()
+            else:
+                func(batch)
+        except Exception as e:
+            self._next_retry = time.monotonic() + self.retry_interval
+            if batch is None:
+                log.error("drain_error", "ส่งข้อมูลจาก journal ไม่สำเร็จ ({writer}): {error!r}",
+                          writer=self.writer_name, error=e)
+                return
+            log.error("write_error", "บันทึกข้อมูล {writer} ไม่สำเร็จ ทิ้ง {count} รายการ: {error!r}",
+                      writer=self.writer_name, count=len(batch), error=e)
+            WRITER_DOCS.labels(self.writer_name, "failed").inc(len(batch))
+            with self._stats_lock:
+                self.docs_failed += len(batch)
+
+    def _collect_batch(self):
+        # รวมเป็นชุดจนครบ batch_size หรือครบ flush_interval แล้วแต่อย่างไหนถึงก่อน
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or self._stop_event.is_set():
+                break
+            try:
+                batch.append(self._queue.get(timeout=min(remaining, 0.5)))
+            except queue.Empty:
+                continue
+        return batch
+
+    def _server_backoff(self):
+        return time.monotonic() < self._next_retry
+
+    def _insert(self, docs):
+        # คืนจำนวนเอกสารที่ถูกบันทึกจริง หรือ None ถ้าส่งไม่ได้ชั่วคราว (ผู้เรียกต้องเก็บลง journal)
+        # ข้อมูลซ้ำที่เคยบันทึกไปแล้ว (ส่งซ้ำจาก journal) และเอกสารที่ถูกปฏิเสธถาวรจะไม่ถูกนับ
+        start = time.monotonic()
+        try:
+            self.collection.insert_many(docs, ordered=False)
+            inserted = len(docs)
+        except BulkWriteError as e:
+            inserted = e.details.get("nInserted", 0)
+            errors = e.details.get("writeErrors", [])
+            bad = [err for err in errors if err.get("code") != DUPLICATE_KEY_ERROR]
+            if bad:
+                log.error("rejected", "MongoDB ปฏิเสธข้อมูล {count} รายการ ({writer}): {errmsg}",
+                          writer=self.writer_name, count=len(bad), errmsg=bad[0].get("errmsg"))
+                self._reject([docs[err["index"]] for err in bad if "index" in err], bad[0].get("errmsg"))
+        except PyMongoError as e:
+            log.warning("unreachable", "ติดต่อ MongoDB ไม่ได้ ({error}) - เก็บข้อมูล {writer} ลง journal",
+                        writer=self.writer_name, error=e)
+            self._next_retry = time.monotonic() + self.retry_interval
+            return None
+        except Exception as e:
+            # เช่น InvalidDocument จากค่า numpy หรือ OverflowError จาก int ที่ใหญ่เกิน 8 byte
+            # แยกเอกสารที่แปลงเป็น BSON ไม่ได้ออกไป แล้วส่งที่เหลือใหม่ ถ้าไม่ใช่ปัญหาที่ตัวเอกสารถือว่าส่งไม่ได้ชั่วคราว
+            good = []
+            for doc in docs:
+                error = _encode_error(doc)
+                if error is None:
+                    good.append(doc)
+                else:
+                    self._reject([doc], error)
+            if len(good) < len(docs):
+                log.error("invalid_document", "แปลงข้อมูล {writer} เป็น BSON ไม่ได้ {count} รายการ: {error!r}",
+                          writer=self.writer_name, count=len(docs) - len(good), error=e)
+                return self._insert(good) if good else 0
+            log.error("insert_error", "บันทึกข้อมูล {writer} ไม่สำเร็จ ({error!r}) - เก็บลง journal",
+                      writer=self.writer_name, error=e)
+            self._next_retry = time.monotonic() + self.retry_interval
+            return None
+        elapsed = time.monotonic() - start
+        FLUSH_SECONDS.labels(self.writer_name).observe(elapsed)
+        elapsed_ms = elapsed * 1000
+        with self._stats_lock:
+            self.flush_count += 1
+            self.last_flush_ms = elapsed_ms
+            self._flush_ms_total += elapsed_ms
+        return inserted
+
+    def _write(self, batch):
+        # ถ้ายังมีของค้างใน journal ต้องเขียนต่อท้าย journal เพื่อรักษาลำดับ
+        if self._server_backoff() or self._journal_has_data():
+            self._spill(batch)
+            return
+        inserted = self._insert(batch)
+        if inserted is None:
+            self._spill(batch)
+            return
+        WRITER_DOCS.labels(self.writer_name, "written").inc(inserted)
+        with self._stats_lock:
+            self.docs_written += inserted
+
+    def _journal_has_data(self):
+        if os.path.exists(self.drain_path):
+            return True
+        try:
+            return os.path.getsize(self.journal_path) > 0
+        except OSError:
+            return False
+
+    def _spill(self, docs):
+        lines, bad = [], []
+        for doc in docs:
+            try:
+                lines.append(json_util.dumps(doc) + "\n")
+            except Exception:
+                bad.append(doc)
+        if bad:
+            self._reject(bad, "not JSON/BSON serializable")
+        with self._journal_lock:
+            with open(self.journal_path, "a", encoding="utf-8") as f:
+                f.writelines(lines)
+                f.flush()
+                os.fsync(f.fileno())
+        WRITER_DOCS.labels(self.writer_name, "spilled").inc(len(lines))
+        with self._stats_lock:
+            self.docs_spilled += len(lines)
+
+    def _reject(self, docs, reason):
+        # เก็บเอกสารที่ส่งไม่ได้ถาวรแยกไว้ (ค่าที่แปลงไม่ได้เขียนเป็น repr) แทนที่จะวนส่งซ้ำหรือทิ้งเงียบ ๆ
+        with self._journal_lock:
+            with open(self.rejected_path, "a", encoding="utf-8") as f:
+                for doc in docs:
+                    f.write(json_util.dumps({"reason": str(reason), "doc": doc}, default=repr) + "\n")
+        WRITER_DOCS.labels(self.writer_name, "failed").inc(len(docs))
+        with self._stats_lock:
+            self.docs_failed += len(docs)
+
+    def _drain_journal(self):
+        if self._server_backoff():
+            return
+        # ย้าย journal ออกมาเป็นไฟล์ drain ภายใต้ lock แล้วส่งทีละ batch_size โดยไม่ถือ lock
+        # submit() ที่ต้อง spill ตอนคิวเต็มจึงไม่ต้องรอ insert_many ที่อาจค้างจน timeout
+        with self._journal_lock:
+            if not os.path.exists(self.drain_path):
+                if not self._journal_has_data():
+                    return
+                os.replace(self.journal_path, self.drain_path)
+        sent = 0
+        unsent_path = None
+        with open(self.drain_path, "r", encoding="utf-8") as f:
+            while True:
+                lines, docs = self._read_journal_chunk(f)
+                if not lines:
+                    break
+                inserted = self._insert(docs) if docs else 0
+                if inserted is None:
+                    # เก็บส่วนที่ยังส่งไม่ได้ไว้ในไฟล์ drain (แทนที่แบบ atomic) รอบหน้าส่งต่อจากตรงนี้
+                    unsent_path = self.drain_path + ".tmp"
+                    with open(unsent_path, "w", encoding="utf-8") as out:
+                        out.writelines(lines)
+                        shutil.copyfileobj(f, out)
+                        out.flush()
+                        os.fsync(out.fileno())
+                    break
+                sent += inserted
+        if unsent_path:
+            os.replace(unsent_path, self.drain_path)
+        else:
+            os.remove(self.drain_path)
+        if sent:
+            log.info("journal_replayed", "✅ ส่งข้อมูลค้างจาก journal สำเร็จ {count} รายการ ({writer})",
+                     writer=self.writer_name, count=sent)
+            WRITER_DOCS.labels(self.writer_name, "replayed").inc(sent)
+            with self._stats_lock:
+                self.docs_replayed += sent
+                self.docs_written += sent
+
+    def _read_journal_chunk(self, f):
+        # อ่านไม่เกิน batch_size บรรทัด บรรทัดที่อ่านไม่ออก (เช่นไฟล์ขาดตอนไฟดับ) แยกไปไฟล์ rejected
+        lines, docs = [], []
+        while len(lines) < self.batch_size:
+            line = f.readline()
+            if not line:
+                break
+            if not line.strip():
+                continue
+            try:
+                doc = json_util.loads(line)
+            except Exception as e:
+                self._reject([line.rstrip("\n")], repr(e))
+                continue
+            lines.append(line)
+            docs.append(doc)
+        return lines, docs
+
+
+def _encode_error(doc):
+    try:
+        bson.encode(doc)
+    except Exception as e:
+        return repr(e)
+    return None
@@ -0,0 +1,16 @@
+from instrumentation import EventLog
+from webhook import check_environment
+
+# รัน monitor แจ้งเตือนสภาพแวดล้อมเป็น process เดียวแยกจาก worker ของ gunicorn
+# เพื่อไม่ให้ทุก worker ส่งแจ้งเตือนซ้ำกัน:
+#   gunicorn -c gunicorn.conf.py webhook:app
+#   python monitor.py
+
+log = EventLog("monitor")
+
+if __name__ == "__main__":
+    log.info("started", "Starting environment monitor...")
+    try:
+        check_environment()
+    except KeyboardInterrupt:
+        log.info("interrupted", "Monitor stopped by user")
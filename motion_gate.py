@@ -0,0 +1,72 @@
+import threading
+import time
+import cv2
+import numpy as np
+
+# ตัดสินใจว่าเฟรมไหนต้องรัน YOLO จริง เห็ดโตช้า ภาพส่วนใหญ่แทบไม่ต่างจากเฟรมก่อน
+# เทียบภาพย่อขนาดขาวดำกับภาพตอนที่รัน YOLO ครั้งล่าสุด ถ้าเปลี่ยนเกิน threshold หรือนานเกิน
+# max_interval_s จึงรันใหม่ และไม่รันถี่กว่า min_interval_s (กำหนด duty cycle สูงสุด)
+
+
+class InferenceScheduler:
+    def __init__(self, threshold=0.02, max_interval_s=30.0, min_interval_s=0.0,
+                 pixel_threshold=15, size=(64, 36)):
+        self.threshold = threshold
+        self.max_interval_s = max_interval_s
+        self.min_interval_s = min_interval_s
+        self.pixel_threshold = pixel_threshold
+        self.size = size
+        self._reference = None
+        self._last_inference = None
+        self._lock = threading.Lock()
+        self.frames = 0
+        self.inferences = 0
+        self.skipped = 0
+        self.last_score = 0.0
+
+    def change_score(self, frame):
+        # สัดส่วนพิกเซล (0-1) ของภาพย่อที่ต่างจากภาพอ้างอิงเกิน pixel_threshold
+        small = self._thumbnail(frame)
+        if self._reference is None:
+            return 1.0, small
+        diff = cv2.absdiff(small, self._reference)
+        return float(np.count_nonzero(diff > self.pixel_threshold)) / diff.size, small
+
+    def should_infer(self, frame, now=None):
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self.frames += 1
+            score, small = self.change_score(frame)
+            self.last_score = score
+            since = None if self._last_inference is None else now - self._last_inference
+
+            run = since is None or score >= self.threshold or since >= self.max_interval_s
+            if run and since is not None and since < self.min_interval_s:
+                run = False
+
+            if run:
+                self._reference = small
+                self._last_inference = now
+                self.inferences += 1
+            else:
+                self.skipped += 1
+            return run
+
+    def duty_cycle(self):
+        with self._lock:
+            return self.inferences / self.frames if self.frames else 0.0
+
+    def stats(self):
+        return {
+            "frames": self.frames,
+            "inferences": self.inferences,
+            "skipped": self.skipped,
+            "duty_cycle": round(self.duty_cycle(), 3),
+            "last_score": round(self.last_score, 4),
+        }
+
+    def _thumbnail(self, frame):
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+        small = cv2.resize(gray, self.size, interpolation=cv2.INTER_AREA)
+        # เบลอเล็กน้อยกัน noise ของเซ็นเซอร์ภาพถูกนับเป็นการเปลี่ยนแปลง
+        return cv2.GaussianBlur(small, (3, 3), 0)
@@ -0,0 +1,274 @@
+import argparse
+import json
+import multiprocessing
+import threading
+import time
+from datetime import timedelta, timezone
+import cv2
+from deep_sort_realtime.deepsort_tracker import DeepSort
+from pipeline import STAGE_SECONDS, DropOldestQueue, FrameGrabber, Stage, StageStats
+from detector import create_detector, to_deepsort_detections
+from measurement import CameraModel, MaturityBands, SizeEstimator
+from motion_gate import InferenceScheduler
+from mongo_writer import make_client
+from sensors import A02YYUWDriver, DHT11Driver, MockDriver, SensorService
+from track_registry import TrackRegistry
+from reid_index import open_reid_index
+from vision import FRAME_SIZE, BatchSink, MushroomStream
+from instrumentation import EventLog, serve_metrics
+
+# รันหลายกล้อง/หลายชั้นวางใน process เดียว ใช้โมเดลตัวเดียวร่วมกัน (รวมภาพจากทุกกล้องเป็น batch)
+# แต่ละกล้องมี tracker, การจับคู่ ID และเซ็นเซอร์ของตัวเอง
+#   python orchestrator.py cameras.json
+# ดูตัวอย่างไฟล์ตั้งค่าใน cameras.example.json
+
+thai_timezone = timezone(timedelta(hours=7))
+# เซ็นเซอร์ที่ต่อกับ GPIO/UART จริง เปิดได้จาก process เดียวเท่านั้น
+HARDWARE_SENSOR_TYPES = ("a02yyuw", "dht11")
+
+log = EventLog("orchestrator")
+
+
+def open_source(source):
+    # ตัวเลข = กล้อง USB, นอกนั้นเป็น path ไฟล์วิดีโอหรือ URL (เช่น rtsp://)
+    if isinstance(source, int) or (isinstance(source, str) and source.isdigit()):
+        cap = cv2.VideoCapture(int(source))
+        cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+    else:
+        cap = cv2.VideoCapture(source)
+    if not cap.isOpened():
+        raise RuntimeError(f"Unable to open camera source {source!r}")
+    return cap
+
+
+def build_sensors(specs):
+    service = SensorService()
+    for name, spec in specs.items():
+        kind = spec["type"]
+        if kind == "a02yyuw":
+            from DFRobot_RaspberryPi_A02YYUW import DFRobot_A02_Distance
+            sensor_board = DFRobot_A02_Distance()
+            sensor_board.set_dis_range(0, 4500)
+            service.add(name, A02YYUWDriver(sensor_board), interval=spec.get("interval", 0.1),
+                        staleness_s=spec.get("staleness_s", 1.0))
+        elif kind == "dht11":
+            import adafruit_dht
+            import board
+            device = adafruit_dht.DHT11(getattr(board, spec.get("pin", "D17")))
+            service.add(name, DHT11Driver(device), interval=spec.get("interval", 2.0),
+                        staleness_s=spec.get("staleness_s", 10.0), ema_alpha=0.3)
+        elif kind == "mock":
+            service.add(name, MockDriver(spec["values"], spec.get("fail_rate", 0.0)),
+                        interval=spec.get("interval", 1.0), staleness_s=spec.get("staleness_s", 10.0))
+        else:
+            raise ValueError(f"unknown sensor type {kind!r} for sensor {name!r}")
+    return service
+
+
+def build_stream(spec, config, sensors, sink):
+    if spec.get("calibration_file"):
+        camera = CameraModel.load(spec["calibration_file"], FRAME_SIZE)
+    else:
+        camera = CameraModel.from_sensor(spec.get("sensor_width_mm", 8.46666582),
+                                         spec.get("focal_length_mm", 3.2), FRAME_SIZE)
+    bands = MaturityBands(spec.get("maturity_bands", config.get("maturity_bands", [["mature", 1.5, 2.0]])))
+    gate = config.get("motion_gate", {})
+    scheduler = InferenceScheduler(gate.get("threshold", 0.02), gate.get("max_interval_s", 30),
+                                   gate.get("min_interval_s", 0))
+    tracks = config.get("tracks", {})
+    reid = config.get("reid", {})
+    identity = open_reid_index(spec["camera_id"], spec["location"], f"reid_{spec['camera_id']}_{spec['location']}.npz",
+                               sink.identity_store, radius_px=reid.get("radius_px", 40),
+                               min_similarity=reid.get("min_similarity", 0.8))
+    registry = TrackRegistry(tracks.get("ttl_s", 120), tracks.get("max_tracks", 256), tracks.get("change_cm", 0.05),
+                             identity=identity)
+    return MushroomStream(
+        spec["camera_id"], spec["location"], DeepSort(max_age=5), SizeEstimator(camera, bands),
+        sensors.get(spec["distance_sensor"]), sensors.get(spec["env_sensor"]), sink,
+        scheduler, config.get("log_interval", 3), thai_timezone, registry,
+    )
+
+
+class StreamRunner:
+    # กล้องหนึ่งตัว: thread อ่านภาพ -> (รอ batch จาก orchestrator) -> thread tracking -> thread บันทึก
+    def __init__(self, stream, cap, stop_event):
+        self.stream = stream
+        self.cap = cap
+        self.frames = DropOldestQueue(maxsize=1)
+        self.detections = DropOldestQueue(maxsize=1)
+        snapshots = DropOldestQueue(maxsize=1)
+        name = stream.camera_id
+        self.grabber = FrameGrabber(cap, self.frames, stop_event, name=f"capture-{name}")
+        self.tracking = Stage(f"tracking-{name}", lambda item: stream.track(*item), self.detections, snapshots, stop_event)
+        self.sink = Stage(f"sink-{name}", stream.maybe_flush, snapshots, None, stop_event)
+        self.threads = [self.grabber, self.tracking, self.sink]
+
+
+class Orchestrator:
+    def __init__(self, detector, runners, stop_event):
+        self.detector = detector
+        self.runners = runners
+        self.stop_event = stop_event
+        self.batch_stats = StageStats()
+        self.batch_latency = STAGE_SECONDS.labels("inference")
+        self.frames_inferred = 0
+        self.batches = 0
+        self._thread = threading.Thread(target=self._run_inference, name="inference", daemon=True)
+
+    def start(self):
+        for runner in self.runners:
+            for thread in runner.threads:
+                thread.start()
+        self._thread.start()
+
+    def stop(self, timeout=2.0):
+        self.stop_event.set()
+        self._thread.join(timeout)
+        for runner in self.runners:
+            for thread in runner.threads:
+                thread.join(timeout)
+            runner.cap.release()
+            runner.stream.close()
+
+    def _run_inference(self):
+        while not self.stop_event.is_set():
+            # เก็บเฟรมล่าสุดจากทุกกล้องที่มีเฟรมใหม่ แล้วรัน YOLO ครั้งเดียวทั้ง batch
+            batch = []
+            for runner in self.runners:
+                item = runner.frames.get(timeout=0)
+                if item is None:
+                    continue
+                frame_id, captured_at, frame = item
+                frame = runner.stream.prepare(frame)
+                if runner.stream.wants_inference(frame):
+                    batch.append((runner, frame_id, captured_at, frame))
+                else:
+                    runner.detections.put((frame_id, captured_at, frame, None))
+            if not batch:
+                time.sleep(0.005)
+                continue
+
+            start = time.monotonic()
+            try:
+                results = self.detector.detect_batch([frame for _, _, _, frame in batch])
+            except Exception as e:
+                log.error("inference_error", "inference ผิดพลาด: {error}", error=e)
+                continue
+            elapsed = time.monotonic() - start
+            self.batch_stats.record(elapsed)
+            self.batch_latency.observe(elapsed)
+            self.batches += 1
+            self.frames_inferred += len(batch)
+            for (runner, frame_id, captured_at, frame), dets in zip(batch, results):
+                runner.detections.put((frame_id, captured_at, frame, to_deepsort_detections(dets, self.detector.class_id)))
+
+    def report(self):
+        batches, frames = self.batches, self.frames_inferred
+        self.batches = self.frames_inferred = 0
+        fps, avg_ms = self.batch_stats.snapshot()
+        lines = [f"inference {fps:.1f} batch/s {avg_ms:.0f}ms avg batch {frames / batches if batches else 0:.1f}"]
+        for runner in self.runners:
+            capture_fps, _ = runner.grabber.stats.snapshot()
+            tracking_fps, tracking_ms = runner.tracking.stats.snapshot()
+            scheduler = runner.stream.scheduler
+            lines.append(
+                f"  {runner.stream.camera_id}@{runner.stream.location}: capture {capture_fps:.1f} fps | "
+                f"tracking {tracking_fps:.1f} fps {tracking_ms:.0f}ms | "
+                f"inferences {scheduler.inferences} skipped {scheduler.skipped} | "
+                f"tracks {runner.stream.registry.stats()}"
+            )
+        return "\n".join(lines)
+
+
+def split_streams(streams, sensor_specs, processes):
+    # กล้องที่ใช้เซ็นเซอร์ฮาร์ดแวร์ตัวเดียวกัน (ทางตรงหรือผ่านกล้องอื่น) ต้องอยู่ process เดียวกัน
+    # รวมเป็นกลุ่มก่อน แล้วแจกกลุ่มใหญ่ก่อนให้ process ที่มีกล้องน้อยที่สุด จำนวน process อาจน้อยกว่าที่ขอ
+    clusters = []
+    for spec in streams:
+        hardware = {name for name in (spec["distance_sensor"], spec["env_sensor"])
+                    if sensor_specs.get(name, {}).get("type") in HARDWARE_SENSOR_TYPES}
+        members = [spec]
+        for cluster in [c for c in clusters if c[0] & hardware]:
+            clusters.remove(cluster)
+            hardware |= cluster[0]
+            members = cluster[1] + members
+        clusters.append((hardware, members))
+    groups = [[] for _ in range(min(processes, len(clusters)))]
+    for _, members in sorted(clusters, key=lambda c: len(c[1]), reverse=True):
+        min(groups, key=len).extend(members)
+    return groups
+
+
+def run_group(config, stream_specs, group_index=0):
+    # เซ็นเซอร์ฮาร์ดแวร์เปิดได้ทีละ process: สร้างเฉพาะตัวที่กล้องในกลุ่มนี้ใช้
+    used = {s["distance_sensor"] for s in stream_specs} | {s["env_sensor"] for s in stream_specs}
+    sensors = build_sensors({name: spec for name, spec in config["sensors"].items() if name in used})
+
+    client = make_client(config["mongo_uri"])
+    sink = BatchSink(client[config.get("db", "mushroom_db")], thai_timezone,
+                     journal_prefix=f"mongo_spill_{group_index}")
+    det = config["detector"]
+    detector = create_detector(det["backend"], det["model_path"], class_id=det.get("class_id", 0),
+                               score_threshold=det.get("score_threshold", 0.3))
+
+    stop_event = threading.Event()
+    runners = [StreamRunner(build_stream(spec, config, sensors, sink), open_source(spec["source"]), stop_event)
+               for spec in stream_specs]
+    orchestrator = Orchestrator(detector, runners, stop_event)
+    log.info("group_started", "[group {group}] Starting {count} stream(s): {cameras}", group=group_index,
+             count=len(runners), cameras=", ".join(s["camera_id"] for s in stream_specs))
+
+    try:
+        # แต่ละ process เปิด /metrics ของตัวเองที่ metrics_port + ลำดับกลุ่ม
+        if config.get("metrics_port") is not None:
+            serve_metrics(config["metrics_port"] + group_index)
+        sensors.start()
+        sink.start()
+        orchestrator.start()
+        while True:
+            time.sleep(config.get("stats_interval", 5))
+            log.info("group_stats", "[group {group}] {report}", group=group_index, report=orchestrator.report())
+            log.info("writer_stats", "[group {group}] [Writers] {stats}", group=group_index, stats=sink.stats())
+    except KeyboardInterrupt:
+        log.info("interrupted", "[group {group}] interrupted by user", group=group_index)
+    finally:
+        orchestrator.stop()
+        sensors.stop()
+        sink.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run several cameras/shelves with one shared detector")
+    parser.add_argument("config", help="JSON config, see cameras.example.json")
+    parser.add_argument("--processes", type=int, help="split streams across this many processes (overrides config)")
+    args = parser.parse_args()
+
+    with open(args.config, encoding="utf-8") as f:
+        config = json.load(f)
+    streams = config["streams"]
+    processes = min(args.processes or config.get("processes", 1), len(streams))
+
+    if processes <= 1:
+        run_group(config, streams)
+        return
+
+    # แต่ละ process โหลดโมเดลของตัวเองและ batch ภาพของกล้องในกลุ่มตัวเอง
+    groups = split_streams(streams, config["sensors"], processes)
+    if len(groups) < processes:
+        log.warning("processes_reduced", "ใช้ {count} process แทน {requested} เพราะกล้องใช้เซ็นเซอร์ฮาร์ดแวร์ร่วมกัน",
+                    count=len(groups), requested=processes)
+    ctx = multiprocessing.get_context("spawn")
+    workers = [ctx.Process(target=run_group, args=(config, group, i), name=f"streams-{i}")
+               for i, group in enumerate(groups)]
+    for worker in workers:
+        worker.start()
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        for worker in workers:
+            worker.join(10)
+
+
+if __name__ == "__main__":
+    main()
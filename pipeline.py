@@ -0,0 +1,158 @@
+import threading
+import time
+from collections import deque
+from instrumentation import EventLog, histogram
+
+STAGE_SECONDS = histogram("vision_stage_seconds", "Time spent per item in each pipeline stage", ("stage",))
+log = EventLog("pipeline")
+
+
+class DropOldestQueue:
+    # คิวแบบจำกัดขนาด ถ้าเต็มจะทิ้งของเก่าที่สุด เพื่อให้ stage ถัดไปได้ข้อมูลใหม่เสมอ
+    def __init__(self, maxsize=1):
+        self._items = deque(maxlen=maxsize)
+        self._cond = threading.Condition()
+        self.dropped = 0
+
+    def put(self, item):
+        with self._cond:
+            if len(self._items) == self._items.maxlen:
+                self.dropped += 1
+            self._items.append(item)
+            self._cond.notify()
+
+    def get(self, timeout=None):
+        # คืนค่า None ถ้าหมดเวลารอแล้วยังไม่มีข้อมูล
+        with self._cond:
+            if not self._items:
+                self._cond.wait(timeout)
+            if not self._items:
+                return None
+            return self._items.popleft()
+
+    def qsize(self):
+        with self._cond:
+            return len(self._items)
+
+
+class StageStats:
+    # นับจำนวนงานที่ทำเสร็จ ใช้คำนวณ FPS ของแต่ละ stage
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._count = 0
+        self._busy_s = 0.0
+        self._window_start = time.monotonic()
+
+    def record(self, busy_s):
+        with self._lock:
+            self._count += 1
+            self._busy_s += busy_s
+
+    def snapshot(self):
+        # คืนค่า (fps, เวลาเฉลี่ยต่อชิ้นเป็น ms) แล้วเริ่มนับรอบใหม่
+        with self._lock:
+            now = time.monotonic()
+            elapsed = max(now - self._window_start, 1e-6)
+            fps = self._count / elapsed
+            avg_ms = (self._busy_s / self._count * 1000) if self._count else 0.0
+            self._count = 0
+            self._busy_s = 0.0
+            self._window_start = now
+            return fps, avg_ms
+
+
+class FrameGrabber(threading.Thread):
+    # thread อ่านกล้องตลอดเวลา เก็บไว้แค่เฟรมล่าสุด ไม่ให้เฟรมเก่าค้างใน buffer ของ V4L2
+    def __init__(self, cap, output, stop_event, name="capture"):
+        super().__init__(name=name, daemon=True)
+        self.cap = cap
+        self.output = output
+        self.stop_event = stop_event
+        self.stats = StageStats()
+        self.latency = STAGE_SECONDS.labels(name)
+        self.frame_count = 0
+
+    def run(self):
+        while not self.stop_event.is_set():
+            start = time.monotonic()
+            ret, frame = self.cap.read()
+            if not ret:
+                log.warning("camera_read_error", "Camera read error ({name})", name=self.name)
+                time.sleep(1)
+                continue
+            self.frame_count += 1
+            self.output.put((self.frame_count, time.time(), frame))
+            elapsed = time.monotonic() - start
+            self.stats.record(elapsed)
+            self.latency.observe(elapsed)
+
+
+class Stage(threading.Thread):
+    # stage ทั่วไป: ดึงงานจาก input เรียก func แล้วส่งผลต่อไปที่ output (ถ้ามี)
+    # func คืนค่า None เมื่อไม่ต้องการส่งต่อ
+    def __init__(self, name, func, input, output, stop_event):
+        super().__init__(name=name, daemon=True)
+        self.func = func
+        self.input = input
+        self.output = output
+        self.stop_event = stop_event
+        self.stats = StageStats()
+        self.latency = STAGE_SECONDS.labels(name)
+
+    def run(self):
+        while not self.stop_event.is_set():
+            item = self.input.get(timeout=0.5)
+            if item is None:
+                continue
+            start = time.monotonic()
+            try:
+                result = self.func(item)
+            except Exception as e:
+                log.error("stage_error", "stage {stage} ผิดพลาด: {error}", stage=self.name, error=e)
+                continue
+            elapsed = time.monotonic() - start
+            self.stats.record(elapsed)
+            self.latency.observe(elapsed)
+            if result is not None and self.output is not None:
+                self.output.put(result)
+
+
+class Pipeline:
+    # รวม capture thread กับ stage ต่าง ๆ เข้าด้วยกัน พร้อมรายงาน FPS และความลึกของคิว
+    def __init__(self, cap, queue_size=1):
+        self.stop_event = threading.Event()
+        self.queue_size = queue_size
+        self.frames = DropOldestQueue(maxsize=1)
+        self.grabber = FrameGrabber(cap, self.frames, self.stop_event)
+        self.stages = []
+        self._last_output = self.frames
+
+    def add_stage(self, name, func, sink=False):
+        output = None if sink else DropOldestQueue(maxsize=self.queue_size)
+        stage = Stage(name, func, self._last_output, output, self.stop_event)
+        self.stages.append(stage)
+        self._last_output = output
+        return stage
+
+    def start(self):
+        self.grabber.start()
+        for stage in self.stages:
+            stage.start()
+
+    def stop(self, timeout=2.0):
+        self.stop_event.set()
+        self.grabber.join(timeout)
+        for stage in self.stages:
+            stage.join(timeout)
+
+    def report(self):
+        parts = []
+        fps, avg_ms = self.grabber.stats.snapshot()
+        parts.append(f"{self.grabber.name} {fps:.1f} fps")
+        for stage in self.stages:
+            fps, avg_ms = stage.stats.snapshot()
+            parts.append(
+                f"{stage.name} {fps:.1f} fps {avg_ms:.0f}ms "
+                f"(q={stage.input.qsize()}, drop={stage.input.dropped})"
+            )
+        return " | ".join(parts)
@@ -0,0 +1,273 @@
+import os
+import threading
+from datetime import datetime, timezone
+import cv2
+import numpy as np
+from pymongo import ASCENDING, UpdateOne
+from pymongo.errors import PyMongoError
+from instrumentation import EventLog
+from storage import to_datetime
+
+# จำเห็ดแต่ละดอกด้วยตำแหน่งบนชั้นวาง + ลักษณะภาพ (embedding) เพื่อให้ mushroom_id เดิม
+# กลับมาเมื่อ DeepSort ให้ track ใหม่ (บังกล้องชั่วคราว) หรือหลังรีสตาร์ท maincode.py
+# ค้นด้วย grid ตามตำแหน่งก่อน แล้วเทียบ cosine similarity เฉพาะดอกในช่องรอบๆ ด้วย NumPy
+# เก็บถาวรทั้งไฟล์ .npz ในเครื่องและ collection mushroom_identities
+
+IDENTITY_COLLECTION_NAME = "mushroom_identities"
+
+# histogram HSV ของภาพในกล่อง (H x S x V)
+HIST_BINS = (8, 4, 4)
+EMBEDDING_DIM = HIST_BINS[0] * HIST_BINS[1] * HIST_BINS[2]
+
+log = EventLog("reid_index")
+
+
+def appearance_embeddings(frame, boxes):
+    # รากที่สองของ histogram ที่ normalize แล้วมีความยาวเป็น 1 เสมอ ผลคูณ dot จึงเป็น cosine similarity
+    # (Hellinger) กล่องที่อยู่นอกภาพได้เวกเตอร์ศูนย์
+    hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
+    height, width = frame.shape[:2]
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    x1 = np.clip(boxes[:, 0], 0, width).astype(np.int32)
+    y1 = np.clip(boxes[:, 1], 0, height).astype(np.int32)
+    x2 = np.clip(boxes[:, 2], 0, width).astype(np.int32)
+    y2 = np.clip(boxes[:, 3], 0, height).astype(np.int32)
+    out = np.zeros((len(boxes), EMBEDDING_DIM), dtype=np.float32)
+    for i in range(len(boxes)):
+        if x2[i] <= x1[i] or y2[i] <= y1[i]:
+            continue
+        hist = cv2.calcHist([hsv[y1[i]:y2[i], x1[i]:x2[i]]], [0, 1, 2], None, list(HIST_BINS),
+                            [0, 180, 0, 256, 0, 256]).ravel()
+        out[i] = np.sqrt(hist / hist.sum())
+    return out
+
+
+def open_identity_collection(db, name=IDENTITY_COLLECTION_NAME):
+    collection = db[name]
+    collection.create_index(
+        [("camera_id", ASCENDING), ("location", ASCENDING), ("mushroom_id", ASCENDING)],
+        name="identity_key",
+        unique=True,
+    )
+    return collection
+
+
+class IdentityStore:
+    # upsert หนึ่งเอกสารต่อเห็ดหนึ่งดอก รูปแบบเดียวกับ collection.insert_many เพื่อใช้กับ MongoBatchWriter ได้
+    def __init__(self, collection):
+        self.collection = collection
+
+    def insert_many(self, docs, ordered=False):
+        ops = []
+        for doc in docs:
+            doc["last_seen"] = to_datetime(doc["last_seen"])
+            key = {"camera_id": doc["camera_id"], "location": doc["location"], "mushroom_id": doc["mushroom_id"]}
+            ops.append(UpdateOne(key, {"$set": doc}, upsert=True))
+        if ops:
+            return self.collection.bulk_write(ops, ordered=ordered)
+
+    def load(self, camera_id, location):
+        return list(self.collection.find({"camera_id": camera_id, "location": location}, {"_id": 0}))
+
+
+def open_reid_index(camera_id, location, path=None, store=None, **kwargs):
+    # ใช้ไฟล์ในเครื่องก่อน (ไม่ต้องรอเน็ต) ถ้าไม่มีไฟล์ค่อยโหลดจาก Mongo
+    if path and os.path.exists(path):
+        index = ReIdIndex.load(path, camera_id, location, **kwargs)
+        log.info("loaded", "โหลด re-ID index {count} ดอกจาก {source}", count=len(index), source=path)
+        return index
+    docs = []
+    if store is not None:
+        try:
+            docs = store.load(camera_id, location)
+        except PyMongoError as e:
+            log.warning("load_error", "โหลด re-ID index จาก MongoDB ไม่สำเร็จ: {error}", error=e)
+    index = ReIdIndex.from_documents(docs, camera_id, location, path=path, **kwargs)
+    log.info("loaded", "โหลด re-ID index {count} ดอกจาก {source}", count=len(index), source="MongoDB")
+    return index
+
+
+class ReIdIndex:
+    def __init__(self, camera_id, location, cell_px=64, radius_px=40, min_similarity=0.8,
+                 max_gap_s=86400, forget_s=14 * 86400, ema_alpha=0.2, path=None):
+        self.camera_id = camera_id
+        self.location = location
+        self.path = path
+        self.cell_px = cell_px
+        self.radius_px = radius_px
+        self.min_similarity = min_similarity
+        # จับคู่เฉพาะดอกที่เห็นล่าสุดไม่เกิน max_gap_s และลืมดอกที่ไม่เห็นเกิน forget_s (เก็บเกี่ยวไปแล้ว)
+        self.max_gap_s = max_gap_s
+        self.forget_s = forget_s
+        self.ema_alpha = ema_alpha
+        self.next_id = 1
+        self.matched = 0
+        self.created = 0
+        self._size = 0
+        self.ids = np.empty(64, dtype=np.int64)
+        self.centers = np.empty((64, 2), dtype=np.float32)
+        self.embeddings = np.empty((64, EMBEDDING_DIM), dtype=np.float32)
+        self.last_seen = np.empty(64, dtype=np.float64)
+        self._rows = {}
+        self._grid = {}
+        self._dirty = set()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._size
+
+    def allocate(self):
+        with self._lock:
+            mushroom_id = self.next_id
+            self.next_id += 1
+            self.created += 1
+        return mushroom_id
+
+    def match_many(self, centers, embeddings, now, exclude=()):
+        # คืน mushroom_id ที่ตรงกับแต่ละกล่อง หรือ None ถ้าไม่พบ ดอกหนึ่งถูกจับคู่ได้ครั้งเดียว
+        results = []
+        taken = set(exclude)
+        r2 = self.radius_px ** 2
+        with self._lock:
+            for center, embedding in zip(np.asarray(centers, dtype=np.float32), np.asarray(embeddings, dtype=np.float32)):
+                rows = self._candidates(center)
+                mushroom_id = None
+                if len(rows):
+                    d = self.centers[rows] - center
+                    ok = (d[:, 0] ** 2 + d[:, 1] ** 2 <= r2) & (self.last_seen[rows] >= now - self.max_gap_s)
+                    sims = self.embeddings[rows] @ embedding
+                    ok &= sims >= self.min_similarity
+                    if taken:
+                        ok &= ~np.isin(self.ids[rows], list(taken))
+                    if ok.any():
+                        best = rows[ok][np.argmax(sims[ok])]
+                        mushroom_id = int(self.ids[best])
+                        taken.add(mushroom_id)
+                        self.matched += 1
+                results.append(mushroom_id)
+        return results
+
+    def observe(self, mushroom_ids, centers, embeddings, now):
+        # อัปเดตตำแหน่ง/embedding ของดอกที่เห็นในเฟรมนี้ ดอกใหม่จะถูกเพิ่มเข้า index
+        centers = np.asarray(centers, dtype=np.float32)
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        with self._lock:
+            for mushroom_id, center, embedding in zip(mushroom_ids, centers, embeddings):
+                mushroom_id = int(mushroom_id)
+                row = self._rows.get(mushroom_id)
+                if row is None:
+                    row = self._append(mushroom_id, center, embedding, now)
+                else:
+                    if embedding.any():
+                        mixed = (1 - self.ema_alpha) * self.embeddings[row] + self.ema_alpha * embedding
+                        self.embeddings[row] = mixed / max(np.linalg.norm(mixed), 1e-12)
+                    self._move(row, center)
+                    self.last_seen[row] = now
+                self._dirty.add(mushroom_id)
+                if mushroom_id >= self.next_id:
+                    self.next_id = mushroom_id + 1
+
+    def take_dirty(self):
+        # เอกสารของดอกที่เปลี่ยนตั้งแต่ครั้งก่อน สำหรับ upsert ลง Mongo
+        with self._lock:
+            docs = [self._document(self._rows[m]) for m in self._dirty if m in self._rows]
+            self._dirty = set()
+        return docs
+
+    def prune(self, now):
+        with self._lock:
+            keep = np.flatnonzero(self.last_seen[:self._size] >= now - self.forget_s)
+            removed = self._size - len(keep)
+            if removed:
+                self._rebuild(keep)
+        return removed
+
+    def save(self, path=None):
+        # เขียนไฟล์ชั่วคราวแล้ว rename เพื่อไม่ให้ไฟล์เสียถ้าไฟดับระหว่างเขียน
+        path = path or self.path
+        with self._lock:
+            n = self._size
+            tmp = f"{path}.tmp"
+            with open(tmp, "wb") as f:
+                np.savez(f, ids=self.ids[:n], centers=self.centers[:n], embeddings=self.embeddings[:n],
+                         last_seen=self.last_seen[:n], next_id=np.int64(self.next_id))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path, camera_id, location, **kwargs):
+        index = cls(camera_id, location, path=path, **kwargs)
+        with np.load(path) as data:
+            for mushroom_id, center, embedding, last_seen in zip(data["ids"], data["centers"],
+                                                                  data["embeddings"], data["last_seen"]):
+                index._append(int(mushroom_id), center, embedding, float(last_seen))
+            index.next_id = max(int(data["next_id"]), index.next_id)
+        return index
+
+    @classmethod
+    def from_documents(cls, docs, camera_id, location, **kwargs):
+        index = cls(camera_id, location, **kwargs)
+        for doc in docs:
+            index._append(int(doc["mushroom_id"]), np.asarray(doc["center"], dtype=np.float32),
+                          np.asarray(doc["embedding"], dtype=np.float32), to_datetime(doc["last_seen"]).timestamp())
+            index.next_id = max(index.next_id, int(doc["mushroom_id"]) + 1)
+        return index
+
+    def stats(self):
+        return {"size": self._size, "matched": self.matched, "created": self.created, "next_id": self.next_id}
+
+    def _cell(self, center):
+        return int(center[0] // self.cell_px), int(center[1] // self.cell_px)
+
+    def _candidates(self, center):
+        gx, gy = self._cell(center)
+        reach = int(np.ceil(self.radius_px / self.cell_px))
+        rows = []
+        for x in range(gx - reach, gx + reach + 1):
+            for y in range(gy - reach, gy + reach + 1):
+                rows.extend(self._grid.get((x, y), ()))
+        return np.asarray(rows, dtype=np.int64)
+
+    def _append(self, mushroom_id, center, embedding, now):
+        if self._size == len(self.ids):
+            capacity = 2 * len(self.ids)
+            self.ids = np.resize(self.ids, capacity)
+            self.centers = np.resize(self.centers, (capacity, 2))
+            self.embeddings = np.resize(self.embeddings, (capacity, EMBEDDING_DIM))
+            self.last_seen = np.resize(self.last_seen, capacity)
+        row = self._size
+        self._size += 1
+        self.ids[row] = mushroom_id
+        self.centers[row] = center
+        self.embeddings[row] = embedding
+        self.last_seen[row] = now
+        self._rows[mushroom_id] = row
+        self._grid.setdefault(self._cell(center), []).append(row)
+        return row
+
+    def _move(self, row, center):
+        old, new = self._cell(self.centers[row]), self._cell(center)
+        self.centers[row] = center
+        if old != new:
+            self._grid[old].remove(row)
+            if not self._grid[old]:
+                del self._grid[old]
+            self._grid.setdefault(new, []).append(row)
+
+    def _rebuild(self, keep):
+        ids, centers = self.ids[keep].copy(), self.centers[keep].copy()
+        embeddings, last_seen = self.embeddings[keep].copy(), self.last_seen[keep].copy()
+        self._size = 0
+        self._rows = {}
+        self._grid = {}
+        for args in zip(ids, centers, embeddings, last_seen):
+            self._append(int(args[0]), *args[1:])
+
+    def _document(self, row):
+        return {
+            "camera_id": self.camera_id,
+            "location": self.location,
+            "mushroom_id": int(self.ids[row]),
+            "center": [float(v) for v in self.centers[row]],
+            "embedding": [round(float(v), 5) for v in self.embeddings[row]],
+            "last_seen": datetime.fromtimestamp(float(self.last_seen[row]), tz=timezone.utc),
+        }
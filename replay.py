@@ -0,0 +1,297 @@
+import argparse
+import bisect
+import contextlib
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+import cv2
+import numpy as np
+from detector import create_detector
+from export_model import list_images
+from sensors import SensorService
+from vision import BatchSink
+import maincode
+
+# เล่นวิดีโอ/โฟลเดอร์ภาพที่บันทึกไว้ + trace ของเซ็นเซอร์ ผ่าน stage ตรวจจับ/ติดตาม/วัดขนาด/บันทึกชุดเดียวกับ maincode.py
+# เร็วที่สุดเท่าที่เครื่องทำได้ (ไม่รอตามเวลาจริง) แทนฮาร์ดแวร์ด้วยค่าจาก trace และ MongoDB ด้วย mongomock
+# แล้วรายงาน latency ต่อ stage, FPS, RAM สูงสุด และจำนวนเอกสารที่บันทึก
+#   python replay.py recordings/shelf3.mp4 --sensor-trace recordings/shelf3_sensors.jsonl \
+#       --backend onnx --model best_int8.onnx --output replay_baseline.json
+#   python replay.py recordings/shelf3.mp4 --sensor-trace ... --baseline replay_baseline.json
+# ใช้ --baseline เป็นด่านตรวจก่อน merge: จบด้วย exit code 1 ถ้าช้าลงเกิน --max-regression หรือจำนวนเอกสารเปลี่ยน
+#
+# trace เป็น JSONL หนึ่งบรรทัดต่อการอ่านหนึ่งครั้ง ค่าดิบผ่าน median/EMA ของ SensorSampler เหมือนตอนรันจริง
+#   {"t": 0.0, "sensor": "a02yyuw", "raw": [118.0]}
+#   {"t": 2.0, "sensor": "dht11", "raw": [25.1, 85.0]}
+# t = วินาทีนับจากเฟรมแรก ไม่ระบุ trace จะใช้ค่าคงที่จาก --distance-mm / --env
+
+STAGES = ("capture", "inference", "tracking", "sink")
+
+# ขอบ bucket ของ histogram (ms) เพิ่มทีละเท่าตัว
+HISTOGRAM_EDGES_MS = [0.125 * 2 ** i for i in range(16)]
+
+
+class FolderCapture:
+    # อ่านโฟลเดอร์ภาพเรียงตามชื่อ ให้ใช้แทน cv2.VideoCapture ได้
+    def __init__(self, folder):
+        self.paths = list_images(folder)
+        self.index = 0
+
+    def read(self):
+        while self.index < len(self.paths):
+            frame = cv2.imread(self.paths[self.index])
+            self.index += 1
+            if frame is not None:
+                return True, frame
+        return False, None
+
+    def release(self):
+        pass
+
+
+def open_replay_source(path, fps=None):
+    if os.path.isdir(path):
+        return FolderCapture(path), fps or 10.0
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        raise SystemExit(f"เปิดไฟล์วิดีโอ {path} ไม่ได้")
+    return cap, fps or cap.get(cv2.CAP_PROP_FPS) or 10.0
+
+
+class ReplayClock:
+    # เวลาของเฟรมที่กำลังเล่น ใช้แทน time.time() ใน stage และเซ็นเซอร์
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class TraceFeeder:
+    # ป้อนค่าจาก trace เข้า SensorSampler (ไม่ start thread) ตามเวลาของเฟรม
+    # repeat = True ส่งค่าล่าสุดซ้ำทุกเฟรม (ค่าคงที่ ไม่มีวัน stale)
+    def __init__(self, samplers, entries, start, repeat=False):
+        self.samplers = samplers
+        self.repeat = repeat
+        self.entries = sorted(entries, key=lambda e: e["t"])
+        self.times = [start + e["t"] for e in self.entries]
+        self.position = 0
+        unknown = {e["sensor"] for e in self.entries} - set(samplers)
+        if unknown:
+            raise SystemExit(f"trace มีเซ็นเซอร์ที่ไม่รู้จัก: {sorted(unknown)} (มี {sorted(samplers)})")
+
+    @classmethod
+    def from_file(cls, samplers, path, start):
+        with open(path, encoding="utf-8") as f:
+            entries = [json.loads(line) for line in f if line.strip()]
+        return cls(samplers, entries, start)
+
+    @classmethod
+    def constant(cls, samplers, values, start):
+        return cls(samplers, [{"t": 0.0, "sensor": name, "raw": raw} for name, raw in values.items()], start, repeat=True)
+
+    def advance(self, now):
+        end = bisect.bisect_right(self.times, now)
+        for i in range(self.position, end):
+            entry = self.entries[i]
+            self.samplers[entry["sensor"]].publish(tuple(entry["raw"]), self.times[i])
+        self.position = max(self.position, end)
+        if self.repeat:
+            for entry in self.entries[:end]:
+                self.samplers[entry["sensor"]].publish(tuple(entry["raw"]), now)
+
+
+class LatencyHistogram:
+    def __init__(self):
+        self.samples = []
+
+    def add(self, seconds):
+        self.samples.append(seconds * 1000)
+
+    def summary(self):
+        ms = np.asarray(self.samples)
+        if not len(ms):
+            return {"count": 0}
+        return {
+            "count": len(ms),
+            "mean_ms": round(float(ms.mean()), 3),
+            "p50_ms": round(float(np.percentile(ms, 50)), 3),
+            "p95_ms": round(float(np.percentile(ms, 95)), 3),
+            "p99_ms": round(float(np.percentile(ms, 99)), 3),
+            "max_ms": round(float(ms.max()), 3),
+        }
+
+    def lines(self, width=40):
+        counts = np.bincount(np.searchsorted(HISTOGRAM_EDGES_MS, self.samples), minlength=len(HISTOGRAM_EDGES_MS) + 1)
+        nonzero = np.flatnonzero(counts)
+        if not len(nonzero):
+            return []
+        out = []
+        for i in range(nonzero[0], nonzero[-1] + 1):
+            upper = f"<{HISTOGRAM_EDGES_MS[i]:g}" if i < len(HISTOGRAM_EDGES_MS) else f">={HISTOGRAM_EDGES_MS[-1]:g}"
+            bar = "#" * int(round(width * counts[i] / counts.max()))
+            out.append(f"  {upper:>9} ms {counts[i]:>7} {bar}")
+        return out
+
+
+def docs_written(db):
+    return {name: db[name].count_documents({}) for name in sorted(db.list_collection_names())}
+
+
+def replay(args, start):
+    import mongomock
+
+    cap, fps = open_replay_source(args.source, args.fps)
+    detector = create_detector(args.backend, args.model, class_id=0, score_threshold=0.3)
+    db = mongomock.MongoClient()["mushroom_db"]
+    clock = ReplayClock(start)
+
+    sensor_service = SensorService()
+    distance_sensor, env_sensor = maincode.add_sensors(sensor_service, None, None)
+    if args.sensor_trace:
+        feeder = TraceFeeder.from_file(sensor_service.samplers, args.sensor_trace, start)
+    else:
+        feeder = TraceFeeder.constant(sensor_service.samplers,
+                                      {"a02yyuw": [args.distance_mm], "dht11": args.env}, start)
+
+    histograms = {name: LatencyHistogram() for name in STAGES}
+    histograms["total"] = LatencyHistogram()
+    frames = 0
+    with tempfile.TemporaryDirectory() as tmp:
+        batch_sink = BatchSink(db, maincode.thai_timezone, journal_prefix=os.path.join(tmp, "replay_spill"))
+        with contextlib.ExitStack() as quiet:
+            if not args.verbose:
+                quiet.enter_context(contextlib.redirect_stdout(quiet.enter_context(open(os.devnull, "w"))))
+            # re-ID เริ่มจากว่างทุกครั้ง ไม่อ่าน/เขียนไฟล์ของเครื่องจริง
+            stream = maincode.build_stream(distance_sensor, env_sensor, batch_sink, reid_index_file=None)
+            inference_stage, tracking_stage, sink_stage = maincode.make_stages(stream, detector, clock=clock)
+            batch_sink.start()
+            run_start = None
+            while args.limit is None or frames < args.limit:
+                if frames == args.warmup:
+                    run_start = time.perf_counter()
+                t0 = time.perf_counter()
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                frames += 1
+                captured_at = start + (frames - 1) / fps
+                clock.now = captured_at
+                feeder.advance(captured_at)
+                t1 = time.perf_counter()
+                item = inference_stage((frames, captured_at, frame))
+                t2 = time.perf_counter()
+                live_tracks = tracking_stage(item)
+                t3 = time.perf_counter()
+                sink_stage(live_tracks)
+                t4 = time.perf_counter()
+                if frames > args.warmup:
+                    for name, seconds in zip(STAGES + ("total",), (t1 - t0, t2 - t1, t3 - t2, t4 - t3, t4 - t0)):
+                        histograms[name].add(seconds)
+            run_s = time.perf_counter() - run_start if run_start is not None else 0.0
+            stream.close(clock())
+            batch_sink.close()
+        cap.release()
+
+    timed = max(frames - args.warmup, 0)
+    return {
+        "source": args.source,
+        "backend": args.backend,
+        "model": args.model,
+        "start": start,
+        "frames": frames,
+        "timed_frames": timed,
+        "video_fps": fps,
+        "fps": round(timed / run_s, 2) if run_s else 0.0,
+        "stages": {name: h.summary() for name, h in histograms.items()},
+        # ru_maxrss บน Linux มีหน่วยเป็น KB
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "docs_written": docs_written(db),
+        "writers": batch_sink.stats(),
+        "scheduler": stream.scheduler.stats(),
+        "tracks": stream.registry.stats(),
+    }, histograms
+
+
+def print_report(report, histograms):
+    print(f"frames {report['frames']} (timed {report['timed_frames']}), "
+          f"{report['fps']:.1f} fps end-to-end, peak RSS {report['peak_rss_mb']:.0f} MB")
+    print(f"{'stage':<10} {'count':>6} {'mean ms':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for name, s in report["stages"].items():
+        if s["count"]:
+            print(f"{name:<10} {s['count']:>6} {s['mean_ms']:>8.2f} {s['p50_ms']:>8.2f} {s['p95_ms']:>8.2f} "
+                  f"{s['p99_ms']:>8.2f} {s['max_ms']:>8.2f}")
+    for name, histogram in histograms.items():
+        print(f"[{name}]")
+        for line in histogram.lines():
+            print(line)
+    print(f"scheduler {report['scheduler']}")
+    print(f"tracks {report['tracks']}")
+    print(f"docs written {report['docs_written']}")
+
+
+def compare(report, baseline, max_regression, slack_ms=1.0):
+    # คืนรายการปัญหา: ช้าลงเกินที่ยอมได้ หรือผลลัพธ์ (จำนวนเอกสาร) ไม่ตรงกับ baseline
+    # stage ที่ใช้เวลาไม่ถึงมิลลิวินาทีแกว่งได้หลายเท่าตัว จึงยอมให้ช้าลงได้อีก slack_ms เสมอ
+    problems = []
+    if report["frames"] != baseline["frames"]:
+        problems.append(f"frames {report['frames']} != baseline {baseline['frames']} (คนละ footage?)")
+    if report["fps"] < baseline["fps"] * (1 - max_regression):
+        problems.append(f"fps {report['fps']:.1f} < baseline {baseline['fps']:.1f}")
+    for name, s in report["stages"].items():
+        base = baseline["stages"].get(name, {})
+        if s.get("count") and base.get("count") and s["p95_ms"] > base["p95_ms"] * (1 + max_regression) + slack_ms:
+            problems.append(f"{name} p95 {s['p95_ms']:.2f} ms > baseline {base['p95_ms']:.2f} ms")
+    if report["docs_written"] != baseline["docs_written"]:
+        problems.append(f"docs written {report['docs_written']} != baseline {baseline['docs_written']}")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded footage through the vision pipeline and benchmark it")
+    parser.add_argument("source", help="video file or folder of images")
+    parser.add_argument("--sensor-trace", help="JSONL sensor trace (see header of replay.py)")
+    parser.add_argument("--fps", type=float, help="frame rate of the recording (default: from the video, else 10)")
+    parser.add_argument("--backend", default=maincode.DETECTOR_BACKEND)
+    parser.add_argument("--model", default=maincode.MODEL_PATH)
+    parser.add_argument("--limit", type=int, help="stop after this many frames")
+    parser.add_argument("--warmup", type=int, default=5, help="frames excluded from the timings")
+    parser.add_argument("--start", type=float,
+                        help="epoch time of the first frame (default: the baseline's, else the current hour)")
+    parser.add_argument("--distance-mm", type=float, default=120.0, help="constant distance without a trace")
+    parser.add_argument("--env", type=float, nargs=2, default=[25.0, 85.0], metavar=("TEMP_C", "HUMIDITY"),
+                        help="constant temperature/humidity without a trace")
+    parser.add_argument("--output", help="write the report as JSON")
+    parser.add_argument("--baseline", help="JSON report to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.15, help="allowed slowdown vs baseline")
+    parser.add_argument("--slack-ms", type=float, default=1.0, help="extra p95 slowdown always allowed per stage")
+    parser.add_argument("--verbose", action="store_true", help="keep the pipeline's own log output")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    # เวลาเริ่มต้องตรงกับ baseline เพราะ bucket ของ rollup นับตามเวลาของเฟรม
+    start = args.start or (baseline["start"] if baseline else time.time() // 3600 * 3600)
+
+    report, histograms = replay(args, start)
+    print_report(report, histograms)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False, default=str)
+        print(f"report -> {args.output}")
+    if baseline is not None:
+        problems = compare(report, baseline, args.max_regression, args.slack_ms)
+        for problem in problems:
+            print(f"[❌] {problem}")
+        if problems:
+            sys.exit(1)
+        print(f"[✅] ไม่ช้ากว่า baseline เกิน {100 * args.max_regression:.0f}% และจำนวนเอกสารตรงกัน")
+
+
+if __name__ == "__main__":
+    main()
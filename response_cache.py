@@ -0,0 +1,217 @@
+import json
+import sqlite3
+import threading
+import time
+
+# cache ข้อความตอบกลับของคำสั่งอ่านข้อมูลใน webhook (สถานะเห็ด/อุณหภูมิ/ความชื้น/ย้อนหลัง)
+# - หมดอายุตาม ttl_s (ตั้งเท่ากับรอบการบันทึกของ maincode.py) และถูกล้างทันทีเมื่อมีสรุปรอบใหม่ (invalidate)
+# - ถ้ามีหลายคำขอ key เดียวกันพร้อมกัน (เช่นหลังแจ้งเตือน broadcast) จะค้น MongoDB แค่ครั้งเดียว
+#   คำขออื่นรอผลเดียวกัน ข้าม worker ได้ด้วย SqliteBackend (ใช้ lease ต่อ key)
+# - MemoryBackend ใช้ภายใน process, SqliteBackend ใช้ไฟล์ร่วมกันหลาย worker (เช่นบน /dev/shm)
+
+
+class MemoryBackend:
+    def __init__(self):
+        self._entries = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        return self._entries.get(key)
+
+    def set(self, key, value, expires, generation):
+        self._entries[key] = (value, expires, generation)
+
+    def generation(self):
+        return self._generation
+
+    def bump_generation(self):
+        with self._lock:
+            self._generation += 1
+            # entry ของรุ่นเก่าใช้ไม่ได้แล้ว ล้างทิ้งเพื่อไม่ให้ dict โต
+            self._entries = {}
+            return self._generation
+
+    def try_lock(self, key, expires):
+        # ภายใน process ResponseCache กันการคำนวณซ้ำไว้แล้ว
+        return True
+
+    def unlock(self, key, expires):
+        pass
+
+
+class SqliteBackend:
+    def __init__(self, path, timeout=5.0):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value TEXT, expires REAL, generation INTEGER)")
+        conn.execute("CREATE TABLE IF NOT EXISTS leases (key TEXT PRIMARY KEY, expires REAL)")
+        conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER)")
+        conn.execute("INSERT OR IGNORE INTO meta VALUES ('generation', 0)")
+
+    def _conn(self):
+        # sqlite3 connection ใช้ข้าม thread ไม่ได้ เปิดแยกต่อ thread
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        row = self._conn().execute("SELECT value, expires, generation FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1], row[2]
+
+    def set(self, key, value, expires, generation):
+        self._conn().execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)",
+                             (key, json.dumps(value), expires, generation))
+
+    def generation(self):
+        return self._conn().execute("SELECT value FROM meta WHERE name = 'generation'").fetchone()[0]
+
+    def bump_generation(self):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("UPDATE meta SET value = value + 1 WHERE name = 'generation'")
+            generation = conn.execute("SELECT value FROM meta WHERE name = 'generation'").fetchone()[0]
+            conn.execute("DELETE FROM entries WHERE generation < ?", (generation,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return generation
+
+    def try_lock(self, key, expires):
+        # ได้ lease ถ้ายังไม่มีใครถือ หรือ lease เดิมหมดอายุแล้ว (worker ที่ถือตายไป)
+        cursor = self._conn().execute(
+            "INSERT INTO leases VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET expires = excluded.expires "
+            "WHERE leases.expires < ?", (key, expires, time.time()))
+        return cursor.rowcount == 1
+
+    def unlock(self, key, expires):
+        # ลบเฉพาะ lease ของเราเอง (expires ตรงกัน) ถ้า lease หมดอายุไปแล้วและ worker อื่นถือต่อ จะไม่ไปลบของเขา
+        self._conn().execute("DELETE FROM leases WHERE key = ? AND expires = ?", (key, expires))
+
+
+class _Flight:
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class ResponseCache:
+    def __init__(self, ttl_s=3.0, backend=None, lease_s=10.0, poll_interval=0.02):
+        self.ttl_s = ttl_s
+        self.backend = backend or MemoryBackend()
+        self.lease_s = lease_s
+        self.poll_interval = poll_interval
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.shared_waits = 0
+        self.invalidations = 0
+        self._inflight = {}
+        self._lock = threading.Lock()
+        # ตัวนับถูกเพิ่มจากหลาย thread พร้อมกัน (event_pool ของ webhook)
+        self._stats_lock = threading.Lock()
+
+    def get_or_compute(self, key, compute):
+        value = self._lookup(key)
+        if value is not None:
+            self._count("hits")
+            return value
+
+        with self._lock:
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = _Flight()
+        if not leader:
+            # มีอีก thread กำลังค้นอยู่ รอผลเดียวกัน
+            self._count("coalesced")
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = self._compute(key, compute)
+            return flight.value
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            flight.event.set()
+
+    def invalidate(self):
+        self._count("invalidations")
+        return self.backend.bump_generation()
+
+    def stats(self):
+        with self._stats_lock:
+            stats = {
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "shared_waits": self.shared_waits,
+                "invalidations": self.invalidations,
+            }
+        lookups = stats["hits"] + stats["misses"] + stats["coalesced"] + stats["shared_waits"]
+        stats["hit_ratio"] = round((lookups - stats["misses"]) / lookups, 3) if lookups else 0.0
+        return stats
+
+    def _count(self, name):
+        with self._stats_lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def _lookup(self, key, generation=None):
+        entry = self.backend.get(key)
+        if entry is None:
+            return None
+        value, expires, entry_generation = entry
+        generation = self.backend.generation() if generation is None else generation
+        if expires < time.time() or entry_generation != generation:
+            return None
+        return value
+
+    def _compute(self, key, compute):
+        generation = self.backend.generation()
+        deadline = time.time() + self.lease_s
+        # worker อื่นกำลังค้น key นี้อยู่: รอให้ค่าปรากฏใน backend จนกว่า lease ของเขาจะหมด
+        # ถ้ารอจนหมดเวลาแล้วยังไม่ได้ lease ก็ค้นเองโดยไม่ถือ lease (และไม่ปลด lease ของคนอื่น)
+        lease = None
+        while True:
+            expires = time.time() + self.lease_s
+            if self.backend.try_lock(key, expires):
+                lease = expires
+                break
+            value = self._lookup(key, generation)
+            if value is not None:
+                self._count("shared_waits")
+                return value
+            if time.time() >= deadline:
+                break
+            time.sleep(self.poll_interval)
+        try:
+            # ได้ lease หลังจาก worker อื่นเพิ่งค้นเสร็จ: ใช้ค่าของเขา
+            value = self._lookup(key, generation)
+            if value is not None:
+                self._count("shared_waits")
+                return value
+            self._count("misses")
+            value = compute()
+            # ถ้ามีการ invalidate ระหว่างค้น entry นี้จะเป็นรุ่นเก่าและไม่ถูกใช้
+            self.backend.set(key, value, time.time() + self.ttl_s, generation)
+            return value
+        finally:
+            if lease is not None:
+                self.backend.unlock(key, lease)
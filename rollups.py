@@ -0,0 +1,283 @@
+import argparse
+from datetime import timedelta
+from pymongo import ASCENDING, MongoClient, UpdateOne
+from pymongo.errors import BulkWriteError
+from instrumentation import EventLog
+from storage import DB_NAME, as_utc, open_batch_collection, open_mushroom_collection, to_datetime
+
+ROLLUP_COLLECTION_NAME = "env_rollups"
+METRICS = ("temperature_c", "humidity_percent")
+RESOLUTIONS = ("minute", "hour", "day")
+BUCKET_SIZES = {"minute": timedelta(minutes=1), "hour": timedelta(hours=1), "day": timedelta(days=1)}
+
+# หน้าต่างเวลาไม่เกินเท่านี้จะอ่านจาก bucket ความละเอียดนั้น (ได้ไม่กี่สิบเอกสารต่อการค้น)
+RESOLUTION_LIMITS = [
+    ("minute", timedelta(hours=2)),
+    ("hour", timedelta(days=7)),
+]
+
+log = EventLog("rollups")
+
+
+def truncate(ts, resolution):
+    ts = as_utc(ts)
+    if resolution == "minute":
+        return ts.replace(second=0, microsecond=0)
+    if resolution == "hour":
+        return ts.replace(minute=0, second=0, microsecond=0)
+    return ts.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def bucket_ranges(start, end, resolution):
+    # แบ่งช่วง [start, end) เป็น (resolution, bucket_start ตั้งแต่, bucket_start ก่อน)
+    # ใช้ bucket ระดับ resolution เฉพาะที่อยู่ในช่วงทั้งก้อน ขอบที่ไม่เต็ม bucket ใช้ความละเอียดถัดลงไป
+    # ขอบระดับนาทีนับทั้ง bucket จึงคลาดจากช่วงที่ขอได้ไม่เกินหนึ่งนาที
+    start, end = as_utc(start), as_utc(end)
+    index = RESOLUTIONS.index(resolution)
+    if index == 0:
+        first = truncate(start, resolution)
+        return [(resolution, first, end)] if first < end else []
+    finer = RESOLUTIONS[index - 1]
+    first = truncate(start, resolution)
+    if first < start:
+        first += BUCKET_SIZES[resolution]
+    last = truncate(end, resolution)
+    if first >= last:
+        return bucket_ranges(start, end, finer)
+    ranges = [(resolution, first, last)]
+    if start < first:
+        ranges += bucket_ranges(start, first, finer)
+    if last < end:
+        ranges += bucket_ranges(last, end, finer)
+    return ranges
+
+
+def pick_resolution(window):
+    for resolution, limit in RESOLUTION_LIMITS:
+        if window <= limit:
+            return resolution
+    return "day"
+
+
+def open_rollup_collection(db, name=ROLLUP_COLLECTION_NAME):
+    collection = db[name]
+    collection.create_index(
+        [("resolution", ASCENDING), ("camera_id", ASCENDING), ("location", ASCENDING), ("bucket_start", ASCENDING)],
+        name="bucket_key",
+        unique=True,
+    )
+    collection.create_index([("resolution", ASCENDING), ("bucket_start", ASCENDING)], name="resolution_bucket")
+    return collection
+
+
+class RollupEngine:
+    # เก็บ count/sum/min/max ของอุณหภูมิและความชื้นเป็น bucket รายนาที/ชั่วโมง/วัน
+    # อัปเดตจากเอกสารสรุปต่อรอบ (mushroom_batches) จึงนับค่าเซ็นเซอร์หนึ่งครั้งต่อรอบ ไม่ใช่ต่อเห็ดหนึ่งดอก
+    def __init__(self, collection, raw_collection=None):
+        self.collection = collection
+        self.raw_collection = raw_collection
+
+    def insert_many(self, summaries, ordered=False):
+        # รูปแบบเดียวกับ collection.insert_many เพื่อใช้กับ MongoBatchWriter ได้ (ได้ journal ตอนเน็ตหลุดด้วย)
+        # writer ส่งชุดเดิมซ้ำจาก journal ได้ (เช่น timeout หลัง server บันทึกไปแล้ว) จึงต้องนับซ้ำไม่ได้:
+        # - bucket รายนาทีจำ batch_id ที่นับแล้ว รอบที่เคยนับไม่ match แล้ว upsert ชน unique index (duplicate key)
+        # - bucket รายชั่วโมง/วันคำนวณใหม่ทั้งก้อนจาก bucket ที่ละเอียดกว่าด้วย $set (ไม่เก็บ batch_id หลายหมื่นตัวต่อวัน)
+        ops = []
+        sources = []
+        touched = set()
+        for i, summary in enumerate(summaries):
+            # ค่าที่ค้างจากเซ็นเซอร์เก่า (stale) ไม่นับรวมในสถิติย้อนหลัง
+            if summary.get("env_stale"):
+                continue
+            ts = to_datetime(summary["timestamp"])
+            values = {m: float(summary[m]) for m in METRICS}
+            key = self._key(RESOLUTIONS[0], summary["camera_id"], summary["location"], truncate(ts, RESOLUTIONS[0]))
+            ops.append(UpdateOne({**key, "batch_ids": {"$ne": summary["batch_id"]}}, {
+                "$inc": {"count": 1, **{f"{m}.sum": v for m, v in values.items()}},
+                "$min": {f"{m}.min": v for m, v in values.items()},
+                "$max": {f"{m}.max": v for m, v in values.items()},
+                "$addToSet": {"batch_ids": summary["batch_id"]},
+            }, upsert=True))
+            sources.append(i)
+            touched.add((summary["camera_id"], summary["location"], ts))
+        if not ops:
+            return None
+        try:
+            result = self.collection.bulk_write(ops, ordered=ordered)
+        except BulkWriteError as e:
+            # ชี้ index ของ error กลับไปที่เอกสารสรุป ให้ writer ข้ามรอบที่นับแล้วและกักเฉพาะรอบที่ถูกปฏิเสธจริง
+            details = dict(e.details)
+            details["writeErrors"] = [dict(err, index=sources[err["index"]]) for err in details.get("writeErrors", [])]
+            details["nInserted"] = details.get("nUpserted", 0) + details.get("nModified", 0)
+            self._rebuild(touched)
+            raise BulkWriteError(details)
+        self._rebuild(touched)
+        return result
+
+    def _rebuild(self, touched):
+        # touched = (camera_id, location, timestamp) ของรอบที่เพิ่งเขียน คำนวณ bucket ที่ครอบรอบเหล่านั้นใหม่ทีละระดับ
+        for finer, resolution in zip(RESOLUTIONS, RESOLUTIONS[1:]):
+            ops = []
+            for camera_id, location, bucket_start in sorted({(c, l, truncate(ts, resolution)) for c, l, ts in touched}):
+                match = self._key(finer, camera_id, location,
+                                  {"$gte": bucket_start, "$lt": bucket_start + BUCKET_SIZES[resolution]})
+                result = list(self.collection.aggregate([
+                    {"$match": match},
+                    {"$group": {
+                        "_id": None,
+                        "count": {"$sum": "$count"},
+                        **{f"{m}_sum": {"$sum": f"${m}.sum"} for m in METRICS},
+                        **{f"{m}_min": {"$min": f"${m}.min"} for m in METRICS},
+                        **{f"{m}_max": {"$max": f"${m}.max"} for m in METRICS},
+                    }},
+                ]))
+                if not result:
+                    continue
+                stats = result[0]
+                ops.append(UpdateOne(self._key(resolution, camera_id, location, bucket_start), {"$set": {
+                    "count": stats["count"],
+                    **{m: {"sum": stats[f"{m}_sum"], "min": stats[f"{m}_min"], "max": stats[f"{m}_max"]}
+                       for m in METRICS},
+                }}, upsert=True))
+            if ops:
+                self.collection.bulk_write(ops, ordered=False)
+
+    def _key(self, resolution, camera_id, location, bucket_start):
+        return {"resolution": resolution, "camera_id": camera_id, "location": location, "bucket_start": bucket_start}
+
+    def summarize(self, metric, start, end, camera_id=None, location=None):
+        # คืนค่า dict ของ count/avg/min/max หรือ None ถ้าไม่มีข้อมูลในช่วงนั้น
+        ranges = bucket_ranges(start, end, pick_resolution(end - start))
+        if not ranges:
+            return None
+        query = self._scope(camera_id, location)
+        query["$or"] = [{"resolution": resolution, "bucket_start": {"$gte": first, "$lt": last}}
+                        for resolution, first, last in ranges]
+
+        count = 0
+        total = 0.0
+        low = None
+        high = None
+        for bucket in self.collection.find(query, {"count": 1, metric: 1, "_id": 0}):
+            stats = bucket[metric]
+            count += bucket["count"]
+            total += stats["sum"]
+            low = stats["min"] if low is None else min(low, stats["min"])
+            high = stats["max"] if high is None else max(high, stats["max"])
+        if count:
+            return {"count": count, "avg": total / count, "min": low, "max": high}
+        if self.raw_collection is not None:
+            return self._aggregate_raw(metric, start, end, camera_id, location)
+        return None
+
+    def _aggregate_raw(self, metric, start, end, camera_id, location):
+        # ยังไม่มี rollup (เช่นก่อนรัน backfill) ให้ MongoDB คำนวณเองด้วย $group แทนการดึงทุกเอกสารมา
+        match = self._scope(camera_id, location)
+        match["timestamp"] = {"$gte": start, "$lte": end}
+        result = list(self.raw_collection.aggregate([
+            {"$match": match},
+            {"$group": {
+                "_id": None,
+                "count": {"$sum": 1},
+                "avg": {"$avg": f"${metric}"},
+                "min": {"$min": f"${metric}"},
+                "max": {"$max": f"${metric}"},
+            }},
+        ]))
+        if not result:
+            return None
+        result[0].pop("_id")
+        return result[0]
+
+    def backfill(self, batch_collection=None):
+        # คำนวณ bucket ทั้งหมดใหม่จากข้อมูลเดิมด้วย aggregation ฝั่ง server (ต้องใช้ MongoDB 5.0+)
+        # ควรรันตอนที่ maincode.py ยังไม่ได้เขียนข้อมูล เพราะจะเขียนทับ bucket เดิม
+        # ช่วงก่อนมีเอกสารสรุป (mushroom_batches) ใช้ข้อมูลดิบ ตั้งแต่สรุปรอบแรกไปใช้เอกสารสรุป รวมใน pipeline เดียว
+        first_batch = None
+        if batch_collection is not None:
+            first_batch = batch_collection.find_one({"timestamp": {"$type": "date"}}, {"timestamp": 1},
+                                                    sort=[("timestamp", ASCENDING)])
+        batch_stages = []
+        if first_batch is not None:
+            batch_stages = [
+                {"$match": {"timestamp": {"$gte": first_batch["timestamp"]}, "env_stale": {"$ne": True}}},
+                {"$project": {"camera_id": 1, "location": 1, "timestamp": 1, **{m: 1 for m in METRICS}}},
+            ]
+
+        if self.raw_collection is None:
+            source = batch_collection
+            stages = batch_stages
+        else:
+            source = self.raw_collection
+            match = {"timestamp": {"$type": "date"}, "env_stale": {"$ne": True}}
+            if first_batch is not None:
+                match["timestamp"]["$lt"] = first_batch["timestamp"]
+            # ข้อมูลดิบเก็บค่าเซ็นเซอร์ซ้ำทุกดอก รวมให้เหลือหนึ่งค่าต่อรอบก่อน
+            stages = [{"$match": match}, {"$group": {
+                "_id": {
+                    "camera_id": "$camera_id",
+                    "location": "$location",
+                    "batch": {"$ifNull": ["$batch_id", {"$dateTrunc": {"date": "$timestamp", "unit": "second"}}]},
+                },
+                "camera_id": {"$first": "$camera_id"},
+                "location": {"$first": "$location"},
+                "timestamp": {"$min": "$timestamp"},
+                **{m: {"$first": f"${m}"} for m in METRICS},
+            }}]
+            if batch_stages:
+                stages.append({"$unionWith": {"coll": batch_collection.name, "pipeline": batch_stages}})
+
+        for resolution in RESOLUTIONS:
+            pipeline = stages + [
+                {"$group": {
+                    "_id": {
+                        "camera_id": "$camera_id",
+                        "location": "$location",
+                        "bucket_start": {"$dateTrunc": {"date": "$timestamp", "unit": resolution}},
+                    },
+                    "count": {"$sum": 1},
+                    **{f"{m}_sum": {"$sum": f"${m}"} for m in METRICS},
+                    **{f"{m}_min": {"$min": f"${m}"} for m in METRICS},
+                    **{f"{m}_max": {"$max": f"${m}"} for m in METRICS},
+                }},
+                {"$project": {
+                    "_id": 0,
+                    "resolution": {"$literal": resolution},
+                    "camera_id": "$_id.camera_id",
+                    "location": "$_id.location",
+                    "bucket_start": "$_id.bucket_start",
+                    "count": 1,
+                    **{m: {"sum": f"${m}_sum", "min": f"${m}_min", "max": f"${m}_max"} for m in METRICS},
+                }},
+                {"$merge": {
+                    "into": self.collection.name,
+                    "on": ["resolution", "camera_id", "location", "bucket_start"],
+                    "whenMatched": "replace",
+                    "whenNotMatched": "insert",
+                }},
+            ]
+            source.aggregate(pipeline, allowDiskUse=True)
+            log.info("backfilled", "✅ backfill rollup ระดับ {resolution} เสร็จแล้ว", resolution=resolution)
+
+    def _scope(self, camera_id, location):
+        query = {}
+        if camera_id is not None:
+            query["camera_id"] = camera_id
+        if location is not None:
+            query["location"] = location
+        return query
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild environment rollups from existing data")
+    parser.add_argument("--uri", required=True)
+    parser.add_argument("--db", default=DB_NAME)
+    args = parser.parse_args()
+
+    db = MongoClient(args.uri)[args.db]
+    engine = RollupEngine(open_rollup_collection(db), open_mushroom_collection(db))
+    engine.backfill(open_batch_collection(db))
+
+
+if __name__ == "__main__":
+    main()
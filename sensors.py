@@ -0,0 +1,150 @@
+import random
+import threading
+import time
+from collections import deque, namedtuple
+from instrumentation import EventLog, counter
+
+# อ่านเซ็นเซอร์แต่ละตัวใน thread ของตัวเองตามความถี่ของเซ็นเซอร์
+# ผู้อ่าน (vision loop / logger) ได้ค่าล่าสุดทันทีโดยไม่ต้องรอและไม่ต้องล็อก
+
+# value = ค่าหลังกรอง, raw = ค่าดิบ, timestamp = เวลาที่อ่านได้ (time.time())
+Reading = namedtuple("Reading", ["value", "raw", "timestamp"])
+
+SENSOR_READS = counter("sensor_reads_total", "Sensor reads by outcome", ("sensor", "outcome"))
+log = EventLog("sensors")
+
+
+class SensorReadError(Exception):
+    pass
+
+
+class DHT11Driver:
+    def __init__(self, device):
+        self.device = device
+
+    def read(self):
+        try:
+            temperature_c = self.device.temperature
+            humidity = self.device.humidity
+        except RuntimeError as error:
+            raise SensorReadError(f"DHT11 อ่านค่าไม่สำเร็จ: {error}")
+        if temperature_c is None or humidity is None:
+            raise SensorReadError("DHT11 returned None")
+        return float(temperature_c), float(humidity)
+
+
+class A02YYUWDriver:
+    def __init__(self, board):
+        self.board = board
+
+    def read(self):
+        distance = self.board.getDistance()
+        if self.board.last_operate_status != self.board.STA_OK:
+            raise SensorReadError("A02YYUW อ่านระยะไม่สำเร็จ")
+        return (float(distance),)
+
+
+class MockDriver:
+    # driver จำลองสำหรับทดสอบนอกบอร์ด: values เป็น tuple คงที่ หรือฟังก์ชันที่คืน tuple
+    def __init__(self, values, fail_rate=0.0, delay=0.0):
+        self.values = values
+        self.fail_rate = fail_rate
+        self.delay = delay
+
+    def read(self):
+        if self.delay:
+            time.sleep(self.delay)
+        if random.random() < self.fail_rate:
+            raise SensorReadError("mock failure")
+        return tuple(self.values() if callable(self.values) else self.values)
+
+
+class SensorSampler(threading.Thread):
+    # median filter ตัดค่ากระโดด แล้วตามด้วย EMA ให้ค่านิ่ง
+    def __init__(self, name, driver, interval, staleness_s, median_window=5, ema_alpha=0.5, history=64):
+        super().__init__(name=f"sensor-{name}", daemon=True)
+        self.sensor = name
+        self.driver = driver
+        self.interval = interval
+        self.staleness_s = staleness_s
+        self.ema_alpha = ema_alpha
+        self.history = deque(maxlen=history)
+        self.failures = 0
+        self.reads = 0
+        self._window = deque(maxlen=median_window)
+        self._ema = None
+        self._latest = None
+        self._stop_event = threading.Event()
+
+    def latest(self):
+        # การอ่าน/เขียน reference ของ tuple ใน Python เป็น atomic จึงไม่ต้องล็อก
+        return self._latest
+
+    def is_stale(self, now=None):
+        reading = self._latest
+        if reading is None:
+            return True
+        now = time.time() if now is None else now
+        return now - reading.timestamp > self.staleness_s
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            start = time.monotonic()
+            try:
+                raw = self.driver.read()
+            except SensorReadError as e:
+                self.failures += 1
+                SENSOR_READS.labels(self.sensor, "failed").inc()
+                log.warning(f"read_failed:{self.sensor}", "{error}", sensor=self.sensor, error=e)
+            except Exception as e:
+                self.failures += 1
+                SENSOR_READS.labels(self.sensor, "error").inc()
+                log.warning(f"read_error:{self.sensor}", "เซ็นเซอร์ {sensor} ผิดพลาด: {error}", sensor=self.sensor, error=e)
+            else:
+                self.reads += 1
+                SENSOR_READS.labels(self.sensor, "ok").inc()
+                self.publish(raw)
+            self._stop_event.wait(max(self.interval - (time.monotonic() - start), 0))
+
+    def publish(self, raw, timestamp=None):
+        # replay.py เรียกตรงเพื่อป้อนค่าจาก trace ที่บันทึกไว้ (timestamp = เวลาของค่านั้น)
+        self._window.append(raw)
+        median = tuple(sorted(column)[len(column) // 2] for column in zip(*self._window))
+        if self._ema is None:
+            self._ema = median
+        else:
+            a = self.ema_alpha
+            self._ema = tuple(a * m + (1 - a) * e for m, e in zip(median, self._ema))
+        reading = Reading(self._ema, raw, time.time() if timestamp is None else timestamp)
+        self.history.append(reading)
+        self._latest = reading
+
+
+class SensorService:
+    def __init__(self):
+        self.samplers = {}
+
+    def add(self, name, driver, interval, staleness_s, **kwargs):
+        sampler = SensorSampler(name, driver, interval, staleness_s, **kwargs)
+        self.samplers[name] = sampler
+        return sampler
+
+    def get(self, name):
+        return self.samplers[name]
+
+    def start(self):
+        for sampler in self.samplers.values():
+            sampler.start()
+
+    def stop(self, timeout=2.0):
+        for sampler in self.samplers.values():
+            sampler.stop()
+        for sampler in self.samplers.values():
+            sampler.join(timeout)
+
+    def stats(self):
+        return {name: {"reads": s.reads, "failures": s.failures, "stale": s.is_stale()}
+                for name, s in self.samplers.items()}
@@ -0,0 +1,149 @@
+import argparse
+import contextlib
+import gc
+import os
+import random
+import time
+import tracemalloc
+import numpy as np
+from measurement import CameraModel, MaturityBands, SizeEstimator
+from sensors import Reading
+from track_registry import TrackRegistry
+from vision import FRAME_SIZE, MushroomStream
+
+# จำลองการติดตามเห็ดหลายสัปดาห์ (เวลาจำลอง) ที่มี track เกิด/ตายตลอดเวลา
+# แล้วตรวจว่าหน่วยความจำไม่โตตามเวลา และบันทึกเฉพาะดอกที่ค่าเปลี่ยน
+#   python soak_tracks.py --weeks 3 --population 40
+
+
+class SimTrack:
+    def __init__(self, track_id, box, growth):
+        self.track_id = str(track_id)
+        self.box = box
+        self.growth = growth
+
+    def is_confirmed(self):
+        return True
+
+    def to_tlbr(self):
+        return self.box
+
+
+class SimTracker:
+    # แทน DeepSort: แต่ละ track หายไปด้วยความน่าจะเป็น p_die ต่อก้าว แล้วเติม track ใหม่ให้ครบ population
+    def __init__(self, population, lifetime_steps, rng):
+        self.population = population
+        self.p_die = 1.0 / lifetime_steps
+        self.rng = rng
+        self.next_id = 1
+        self.tracks = []
+        self.died = 0
+
+    def update_tracks(self, detections, frame=None):
+        alive = [t for t in self.tracks if self.rng.random() >= self.p_die]
+        self.died += len(self.tracks) - len(alive)
+        while len(alive) < self.population:
+            x, y = self.rng.uniform(0, 560), self.rng.uniform(0, 320)
+            size = self.rng.uniform(10, 30)
+            alive.append(SimTrack(self.next_id, [x, y, x + size, y + size * 0.8], self.rng.uniform(0.0, 0.02)))
+            self.next_id += 1
+        for track in alive:
+            # เห็ดโตช้าๆ ส่วนใหญ่ขนาดแทบไม่เปลี่ยนระหว่างก้าว
+            track.box[2] += track.growth
+            track.box[3] += track.growth * 0.8
+        self.tracks = alive
+        return alive
+
+
+class FixedSensor:
+    def __init__(self, *value):
+        self.reading = Reading(value, value, time.time())
+
+    def latest(self):
+        return self.reading
+
+    def is_stale(self, now=None):
+        return False
+
+
+class CountingSink:
+    def __init__(self):
+        self.flushes = 0
+        self.docs = 0
+        self.live_docs = 0
+        self.events = 0
+
+    def submit(self, docs, live_docs=None, now=None, scope=None, env=None):
+        self.flushes += 1
+        self.docs += len(docs)
+        self.live_docs += len(live_docs or docs)
+        return "soak", len(docs)
+
+    def submit_events(self, events):
+        self.events += len(events)
+        return len(events)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Soak test for bounded track state")
+    parser.add_argument("--weeks", type=float, default=3)
+    parser.add_argument("--step-s", type=float, default=30, help="simulated seconds between inferences")
+    parser.add_argument("--log-interval", type=float, default=60)
+    parser.add_argument("--population", type=int, default=40)
+    parser.add_argument("--lifetime-h", type=float, default=12, help="mean simulated track lifetime")
+    # ขีดจำกัดเป็น KiB ไม่ใช่เปอร์เซ็นต์ - baseline หลังวันแรกมีแค่ ~100 KiB และแกว่งขึ้นลงหลายสิบ KiB ตาม
+    # track ที่ยังเปิดอยู่/log ที่ถูกจำกัดอัตรา เปอร์เซ็นต์จึงฟ้องผิดทั้งที่ไม่รั่ว ส่วน state ที่ไม่ถูกจำกัดจะโตเป็นเส้นตรง
+    # หลายร้อย KiB ต่อสัปดาห์และเกินเกณฑ์นี้ได้ชัด
+    parser.add_argument("--max-growth-kib", type=float, default=64, help="allowed traced memory growth after day 1")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    tracker = SimTracker(args.population, args.lifetime_h * 3600 / args.step_s, rng)
+    sink = CountingSink()
+    estimator = SizeEstimator(CameraModel.from_sensor(8.46666582, 3.2, FRAME_SIZE), MaturityBands())
+    registry = TrackRegistry(ttl_s=120, max_tracks=args.population * 4)
+    stream = MushroomStream("soak", "shelf_soak", tracker, estimator, FixedSensor(120.0),
+                            FixedSensor(25.0, 85.0), sink, log_interval=args.log_interval, registry=registry)
+    frame = np.zeros((FRAME_SIZE[1], FRAME_SIZE[0], 3), dtype=np.uint8)
+    detections = [([0, 0, 1, 1], 1.0, 0)]
+
+    steps_per_day = int(86400 / args.step_s)
+    days = int(args.weeks * 7)
+    start = time.time()
+    sim_time = start
+    baseline = None
+    peak_after = 0
+    tracemalloc.start()
+    print(f"{'day':>4} {'live':>5} {'opened':>8} {'closed':>8} {'docs':>9} {'live docs':>10} {'traced KiB':>11}")
+    with open(os.devnull, "w") as devnull:
+        for day in range(1, days + 1):
+            with contextlib.redirect_stdout(devnull):
+                for _ in range(steps_per_day):
+                    sim_time += args.step_s
+                    stream.track(0, sim_time, frame, detections)
+                    stream.maybe_flush(len(registry), sim_time)
+            gc.collect()
+            current, _ = tracemalloc.get_traced_memory()
+            if day == 1:
+                baseline = current
+            else:
+                peak_after = max(peak_after, current)
+            print(f"{day:>4} {len(registry):>5} {registry.opened:>8} {sum(registry.closed.values()):>8} "
+                  f"{sink.docs:>9} {sink.live_docs:>10} {current / 1024:>11.1f}")
+    tracemalloc.stop()
+
+    print(f"simulated {days} days in {time.time() - start:.1f}s, tracks closed {registry.closed}, events {sink.events}")
+    print(f"rows written {sink.docs} vs {sink.live_docs} with full re-insert "
+          f"({100 * sink.docs / max(sink.live_docs, 1):.1f}%)")
+
+    assert len(registry) <= registry.max_tracks
+    assert sink.events == sum(registry.closed.values()) == tracker.died
+    assert sink.docs < sink.live_docs
+    growth_kib = (peak_after - baseline) / 1024 if days > 1 else 0.0
+    print(f"memory growth after day 1: {growth_kib:.1f} KiB")
+    assert growth_kib <= args.max_growth_kib, f"memory grew {growth_kib:.1f} KiB (limit {args.max_growth_kib:.0f} KiB)"
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+from datetime import datetime, timedelta, timezone
+from dateutil.parser import parse
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import CollectionInvalid
+
+DB_NAME = "mushroom_db"
+COLLECTION_NAME = "mushroom_data"
+BATCH_COLLECTION_NAME = "mushroom_batches"
+TRACK_EVENT_COLLECTION_NAME = "mushroom_track_events"
+# เวลาที่เอกสารถูกส่งเข้า MongoDB สำเร็จ (ต่างจาก timestamp ที่เป็นเวลาวัด) ข้อมูลที่ส่งซ้ำจาก journal จึงได้ค่าใหม่
+WRITTEN_AT = "written_at"
+# InsertFeed ถอยหลังเท่านี้ (วินาที) ทุกรอบ กันเอกสารที่ insert เสร็จช้าหรือมาจากเครื่องที่นาฬิกาช้ากว่าหลุด
+INSERT_OVERLAP_S = 60
+
+
+def to_datetime(value):
+    # แปลง timestamp (ทั้งแบบ string เก่าและ datetime) ให้เป็น datetime แบบ UTC
+    if isinstance(value, str):
+        value = parse(value)
+    return as_utc(value)
+
+
+def as_utc(dt):
+    # pymongo คืน datetime แบบไม่มี timezone (เป็น UTC อยู่แล้ว) ถ้าไม่ได้ตั้ง tz_aware
+    if dt.tzinfo is None:
+        return dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(timezone.utc)
+
+
+def open_mushroom_collection(db, name=COLLECTION_NAME, timeseries=False):
+    # timeseries=True จะสร้าง time-series collection (MongoDB 5.0+) ถ้ายังไม่มี
+    # metaField = camera_id: กล้องหนึ่งตัวดูชั้นวางเดียว เอกสารของกล้อง/ชั้นเดียวกันจึงอยู่ใน bucket เดียวกัน
+    # ถ้ามี collection ชื่อนี้อยู่แล้วจะใช้ตัวเดิมและแค่สร้าง index
+    if timeseries and name not in db.list_collection_names():
+        try:
+            db.create_collection(name, timeseries={"timeField": "timestamp", "metaField": "camera_id",
+                                                   "granularity": "seconds"})
+        except CollectionInvalid:
+            pass
+    collection = db[name]
+    if timeseries and is_timeseries(db, name) and db.client.server_info()["versionArray"] < [6]:
+        # MongoDB 5.x สร้าง index บน time-series ได้แค่ metaField/timeField (location, written_at เป็นค่าวัด)
+        # การค้นตามชั้นวางและ InsertFeed (written_at) จะไม่มี index จึงควรใช้ MongoDB 6.0 ขึ้นไป
+        collection.create_index([("camera_id", ASCENDING), ("timestamp", DESCENDING)], name="camera_timestamp")
+    else:
+        ensure_indexes(collection)
+    return collection
+
+
+def is_timeseries(db, name):
+    info = next(iter(db.list_collections(filter={"name": name})), None)
+    return info is not None and info.get("type") == "timeseries"
+
+
+def ensure_indexes(collection):
+    # ค้นตามกล้อง/ชั้นวาง + ช่วงเวลา และหาเอกสารล่าสุดของทั้งฟาร์ม
+    collection.create_index(
+        [("camera_id", ASCENDING), ("location", ASCENDING), ("timestamp", DESCENDING)],
+        name="camera_location_timestamp",
+    )
+    collection.create_index([("timestamp", DESCENDING)], name="timestamp_desc")
+    collection.create_index([(WRITTEN_AT, ASCENDING)], name="written_at")
+
+
+def open_batch_collection(db, name=BATCH_COLLECTION_NAME):
+    # เอกสารสรุปหนึ่งชิ้นต่อการบันทึกหนึ่งรอบ ต่อกล้อง/ชั้นวาง
+    collection = db[name]
+    ensure_indexes(collection)
+    collection.create_index([("batch_id", ASCENDING)], name="batch_id")
+    return collection
+
+
+def open_track_event_collection(db, name=TRACK_EVENT_COLLECTION_NAME):
+    # เอกสารหนึ่งชิ้นต่อเห็ดหนึ่งดอกที่เลิกติดตามแล้ว (ขนาด/ระดับความพร้อมครั้งสุดท้าย)
+    collection = db[name]
+    ensure_indexes(collection)
+    return collection
+
+
+def build_batch_summaries(batch_id, docs, timestamp, scope=None, env=None):
+    # สรุปจำนวนเห็ดที่พร้อม/ไม่พร้อม และค่าเฉลี่ยอุณหภูมิ/ความชื้น แยกตามกล้องและชั้นวาง
+    # scope = (camera_id, location) ที่ต้องมีสรุปเสมอแม้ไม่มีเห็ดเลย ค่า env จะมาจาก env แทนค่าเฉลี่ย
+    groups = {}
+    if scope is not None:
+        groups[scope] = []
+    for doc in docs:
+        groups.setdefault((doc["camera_id"], doc["location"]), []).append(doc)
+
+    summaries = []
+    for (camera_id, location), group in groups.items():
+        mature_count = sum(1 for d in group if d.get("maturity_status", "").lower() == "mature")
+        if not group:
+            summaries.append({"batch_id": batch_id, "timestamp": timestamp, "camera_id": camera_id, "location": location,
+                              "mushroom_count": 0, "mature_count": 0, "immature_count": 0,
+                              "temperature_c": float(env["temperature_c"]),
+                              "humidity_percent": float(env["humidity_percent"]),
+                              "env_stale": env.get("env_stale", False)})
+            continue
+        summaries.append({
+            "batch_id": batch_id,
+            "timestamp": timestamp,
+            "camera_id": camera_id,
+            "location": location,
+            "mushroom_count": len(group),
+            "mature_count": mature_count,
+            "immature_count": len(group) - mature_count,
+            "temperature_c": sum(float(d["temperature_c"]) for d in group) / len(group),
+            "humidity_percent": sum(float(d["humidity_percent"]) for d in group) / len(group),
+            "env_stale": any(d.get("env_stale", False) for d in group),
+        })
+    return summaries
+
+
+class MushroomStore:
+    # จุดเดียวที่อ่าน/เขียน mushroom_data (และ mushroom_batches) ทั้งฝั่ง maincode.py และ webhook.py
+    def __init__(self, collection):
+        self.collection = collection
+
+    def insert_many(self, docs, ordered=False):
+        written_at = datetime.now(timezone.utc)
+        for doc in docs:
+            doc["timestamp"] = to_datetime(doc["timestamp"])
+            doc[WRITTEN_AT] = written_at
+        return self.collection.insert_many(docs, ordered=ordered)
+
+    def latest(self, camera_id=None, location=None):
+        return self.collection.find_one(self._scope(camera_id, location), sort=[("timestamp", DESCENDING)])
+
+    def latest_per_scope(self):
+        # เอกสารล่าสุดของแต่ละ (กล้อง, ชั้นวาง) ไม่อ่านประวัติทั้งหมด: distinct ใช้ index camera_location_timestamp
+        # กระโดดทีละค่า (DISTINCT_SCAN) แล้วหาตัวล่าสุดของแต่ละคู่ด้วย find_one บน index เดียวกัน
+        docs = []
+        for camera_id in self.collection.distinct("camera_id"):
+            for location in self.collection.distinct("location", {"camera_id": camera_id}):
+                doc = self.latest(camera_id, location)
+                if doc is not None:
+                    docs.append(doc)
+        return sorted(docs, key=lambda doc: (doc["location"], doc["camera_id"]))
+
+    def find_range(self, start, end, camera_id=None, location=None, projection=None):
+        query = self._scope(camera_id, location)
+        query["timestamp"] = {"$gte": start, "$lte": end}
+        return self.collection.find(query, projection)
+
+    def _scope(self, camera_id, location):
+        query = {}
+        if camera_id is not None:
+            query["camera_id"] = camera_id
+        if location is not None:
+            query["location"] = location
+        return query
+
+
+class InsertFeed:
+    # อ่านเอกสารที่เพิ่งถูก insert เรียงตาม written_at แทน timestamp/_id ที่อาจย้อนหลังได้ (ส่งซ้ำจาก journal, หลายกล้อง)
+    # ทุกรอบถอยหลัง overlap_s แล้วข้าม _id ที่เคยส่งไปแล้ว เอกสารเวลาซ้ำกันหรือเสร็จช้าเล็กน้อยจึงไม่หลุดและไม่ซ้ำ
+    # เอกสารเก่าที่ไม่มี written_at (ก่อนมีฟิลด์นี้) จะไม่ถูกอ่าน
+    def __init__(self, collection, since=None, overlap_s=INSERT_OVERLAP_S, query=None, projection=None):
+        self.collection = collection
+        self.overlap = timedelta(seconds=overlap_s)
+        self.since = as_utc(since) if since is not None else datetime.now(timezone.utc) - self.overlap
+        self.query = query or {}
+        self.projection = projection
+        self._seen = {}
+
+    def poll(self):
+        # generator: since จะขยับเมื่ออ่านครบทั้งรอบแล้วเท่านั้น
+        query = dict(self.query)
+        query[WRITTEN_AT] = {"$gte": self.since}
+        latest = self.since
+        for doc in self.collection.find(query, self.projection).sort(WRITTEN_AT, ASCENDING):
+            written_at = as_utc(doc[WRITTEN_AT])
+            latest = max(latest, written_at)
+            if doc["_id"] in self._seen:
+                continue
+            self._seen[doc["_id"]] = written_at
+            yield doc
+        self.since = max(self.since, latest - self.overlap)
+        self._seen = {key: at for key, at in self._seen.items() if at >= self.since}
@@ -0,0 +1,160 @@
+import threading
+from collections import OrderedDict
+import numpy as np
+
+# สถานะของเห็ดที่กำลังติดตาม มีขอบเขตจำกัด ไม่โตไปเรื่อยๆ ตามจำนวน track ที่ DeepSort เคยสร้าง
+# track ถูกปิดเมื่อ DeepSort ลบ track นั้นแล้ว (lost), ไม่ได้อัปเดตเกิน ttl_s (ttl)
+# หรือมี track เกิน max_tracks (evicted: ปิดตัวที่เห็นล่าสุดนานที่สุดก่อน)
+# track ที่ถูก evict แต่ DeepSort ยังถืออยู่จะไม่ถูกรับกลับ (admits) จนกว่า DeepSort จะลบ ไม่งั้นจะเปิดเป็นดอกใหม่ทุกเฟรม
+# ตอนปิดจะเรียก on_close(state, reason) พร้อมขนาด/ระดับความพร้อมครั้งสุดท้าย
+# take_changed() คืนเฉพาะ record ที่ขนาด/ระดับเปลี่ยนไปจากที่บันทึกครั้งก่อน
+# ถ้ามี identity (ReIdIndex) track ใหม่จะถูกจับคู่กับเห็ดที่เคยเห็นก่อนให้ id ใหม่
+
+
+class TrackState:
+    __slots__ = ("mushroom_id", "track_id", "record", "first_seen", "last_seen", "dirty", "written")
+
+    def __init__(self, mushroom_id, track_id, now):
+        self.mushroom_id = mushroom_id
+        self.track_id = track_id
+        self.record = None
+        self.first_seen = now
+        self.last_seen = now
+        self.dirty = False
+        # (width_cm, height_cm, maturity, distance_stale) ที่บันทึกลง Mongo ครั้งล่าสุด
+        self.written = None
+
+
+class TrackRegistry:
+    def __init__(self, ttl_s=120.0, max_tracks=256, change_cm=0.05, on_close=None, identity=None):
+        self.ttl_s = ttl_s
+        self.max_tracks = max_tracks
+        self.change_cm = change_cm
+        self.on_close = on_close
+        self.identity = identity
+        self.next_id = 1
+        self.opened = 0
+        self.closed = {"lost": 0, "ttl": 0, "evicted": 0}
+        self._by_track = {}
+        # mushroom_id -> TrackState เรียงตามเวลาที่เห็นล่าสุด (ตัวแรก = เก่าสุด)
+        self._states = OrderedDict()
+        # track ที่ปิดไปแล้วแต่ค่าล่าสุดยังไม่ได้บันทึก
+        self._closed_dirty = []
+        # track_id ที่ถูก evict ไปแล้วแต่ DeepSort ยังรายงานอยู่ (ไม่เกินจำนวน track ของ DeepSort)
+        self._evicted = set()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._states)
+
+    def admits(self, track_id):
+        return track_id not in self._evicted
+
+    def assign(self, track_ids, now, centers=None, embeddings=None):
+        # คืน mushroom_id ของแต่ละ track ถ้าเป็น track ใหม่จะได้ id ที่ identity จับคู่ได้ หรือ id ถัดไป
+        ids = []
+        with self._lock:
+            known = {}
+            if self.identity is not None:
+                new = [i for i, track_id in enumerate(track_ids) if track_id not in self._by_track]
+                if new:
+                    matched = self.identity.match_many(np.asarray(centers)[new], np.asarray(embeddings)[new], now,
+                                                       exclude=self._states.keys())
+                    known = dict(zip(new, matched))
+            for i, track_id in enumerate(track_ids):
+                state = self._by_track.get(track_id)
+                if state is None:
+                    state = TrackState(self._new_id(known.get(i)), track_id, now)
+                    self.opened += 1
+                    self._by_track[track_id] = state
+                    self._states[state.mushroom_id] = state
+                state.last_seen = now
+                self._states.move_to_end(state.mushroom_id)
+                ids.append(state.mushroom_id)
+        return ids
+
+    def update(self, records):
+        with self._lock:
+            for record in records:
+                state = self._states.get(int(record["mushroom_id"]))
+                if state is None:
+                    continue
+                # copy() เพื่อไม่ให้ record ยึด array ทั้งเฟรมไว้ในหน่วยความจำ
+                state.record = record.copy()
+                if not state.dirty and self._changed(state):
+                    state.dirty = True
+
+    def expire(self, live_track_ids, now):
+        # live_track_ids = track ทั้งหมดที่ tracker ยังถืออยู่ (รวมที่ยังไม่ confirmed)
+        closing = []
+        with self._lock:
+            for state in list(self._states.values()):
+                if state.track_id not in live_track_ids:
+                    closing.append((state, "lost"))
+                elif now - state.last_seen > self.ttl_s:
+                    closing.append((state, "ttl"))
+            for state, _ in closing:
+                self._remove(state)
+            self._evicted &= live_track_ids
+            while len(self._states) > self.max_tracks:
+                _, state = self._states.popitem(last=False)
+                del self._by_track[state.track_id]
+                self._evicted.add(state.track_id)
+                closing.append((state, "evicted"))
+            for state, reason in closing:
+                self.closed[reason] += 1
+                if state.dirty:
+                    self._closed_dirty.append(state.record)
+        if self.on_close is not None:
+            for state, reason in closing:
+                if state.record is not None:
+                    self.on_close(state, reason)
+        return closing
+
+    def take_changed(self):
+        # record ที่ต้องบันทึกรอบนี้ แล้วถือว่าบันทึกแล้ว
+        with self._lock:
+            changed = self._closed_dirty
+            self._closed_dirty = []
+            for state in self._states.values():
+                if state.dirty:
+                    changed.append(state.record)
+                    state.written = self._values(state.record)
+                    state.dirty = False
+        return changed
+
+    def live_records(self):
+        with self._lock:
+            return [state.record for state in self._states.values() if state.record is not None]
+
+    def stats(self):
+        return {"live": len(self._states), "opened": self.opened, "closed": dict(self.closed),
+                "pending_closed": len(self._closed_dirty)}
+
+    def _new_id(self, matched):
+        if matched is not None:
+            return matched
+        if self.identity is not None:
+            return self.identity.allocate()
+        mushroom_id = self.next_id
+        self.next_id += 1
+        return mushroom_id
+
+    def _remove(self, state):
+        del self._states[state.mushroom_id]
+        del self._by_track[state.track_id]
+
+    def _changed(self, state):
+        if state.written is None:
+            return True
+        width, height, maturity, stale = state.written
+        record = state.record
+        return (int(record["maturity"]) != maturity
+                or bool(record["distance_stale"]) != stale
+                or abs(float(record["width_cm"]) - width) >= self.change_cm
+                or abs(float(record["height_cm"]) - height) >= self.change_cm)
+
+    @staticmethod
+    def _values(record):
+        return (float(record["width_cm"]), float(record["height_cm"]),
+                int(record["maturity"]), bool(record["distance_stale"]))
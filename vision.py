@@ -0,0 +1,237 @@
+import time
+import uuid
+from datetime import datetime
+import cv2
+import numpy as np
+from mongo_writer import MongoBatchWriter, tuned_collection
+from storage import (MushroomStore, build_batch_summaries, open_batch_collection, open_mushroom_collection,
+                     open_track_event_collection)
+from rollups import RollupEngine, open_rollup_collection
+from reid_index import IdentityStore, appearance_embeddings, open_identity_collection
+from track_registry import TrackRegistry
+from instrumentation import EventLog, gauge, histogram
+
+# ขนาดภาพที่ส่งเข้าโมเดลและใช้วัดขนาด
+FRAME_SIZE = (640, 384)
+
+# บันทึก re-ID index ลงไฟล์และ MongoDB ทุกๆ เท่านี้วินาที (และตอนปิดโปรแกรม)
+IDENTITY_SAVE_INTERVAL = 300
+
+DETECTIONS_PER_FRAME = histogram("vision_detections_per_frame", "Detections passed to the tracker per inferred frame",
+                                 ("camera",), buckets=(0, 1, 2, 5, 10, 20, 50, 100, 200))
+LIVE_TRACKS = gauge("vision_live_tracks", "Mushrooms currently tracked", ("camera",))
+log = EventLog("vision")
+
+
+class BatchSink:
+    # ส่งข้อมูลหนึ่งรอบการบันทึกไปยัง writer ทั้งสามชุด: ข้อมูลดิบ, สรุปต่อรอบ, rollup
+    def __init__(self, db, tz, journal_prefix="mongo_spill"):
+        self.tz = tz
+        # เขียนข้อมูลเป็นชุดใน thread แยก ถ้าเน็ตหลุดจะเก็บลงไฟล์ไว้ส่งทีหลัง
+        self.mongo_writer = MongoBatchWriter(
+            MushroomStore(tuned_collection(open_mushroom_collection(db))),
+            journal_path=f"{journal_prefix}.jsonl", name="mongo")
+        # สรุปต่อรอบการบันทึก ให้ webhook อ่านสถานะล่าสุดได้ในการค้นครั้งเดียว
+        self.batch_writer = MongoBatchWriter(
+            MushroomStore(tuned_collection(open_batch_collection(db))),
+            journal_path=f"{journal_prefix}_batches.jsonl", name="batch")
+        # อัปเดต bucket รายนาที/ชั่วโมง/วัน ของอุณหภูมิ/ความชื้น สำหรับคำสั่งดูย้อนหลัง
+        self.rollup_writer = MongoBatchWriter(
+            RollupEngine(tuned_collection(open_rollup_collection(db))),
+            journal_path=f"{journal_prefix}_rollups.jsonl", name="rollup")
+        # เหตุการณ์เลิกติดตามเห็ด (track closed) พร้อมขนาดสุดท้าย
+        self.event_writer = MongoBatchWriter(
+            MushroomStore(tuned_collection(open_track_event_collection(db))),
+            journal_path=f"{journal_prefix}_events.jsonl", name="events")
+        # ตำแหน่ง/embedding ของเห็ดแต่ละดอก สำหรับให้ id เดิมหลังรีสตาร์ท
+        self.identity_store = IdentityStore(open_identity_collection(db))
+        self.identity_writer = MongoBatchWriter(self.identity_store, journal_path=f"{journal_prefix}_identities.jsonl",
+                                                name="identities")
+        self.writers = {"mongo": self.mongo_writer, "batch": self.batch_writer, "rollup": self.rollup_writer,
+                        "events": self.event_writer, "identities": self.identity_writer}
+
+    def submit(self, docs, live_docs=None, now=None, scope=None, env=None):
+        # docs = เฉพาะเห็ดที่ค่าเปลี่ยน (ลง mushroom_data), live_docs = ทุกดอกที่ยังติดตามอยู่ (ใช้สรุปสถานะ)
+        # now = เวลาของรอบนี้ (time.time()) ไม่ระบุจะใช้เวลาปัจจุบัน
+        # scope/env = กล้อง/ชั้นวางและค่าสภาพแวดล้อมของรอบนี้ ให้มีสรุป (และ rollup/alert) แม้ชั้นว่าง
+        batch_id = uuid.uuid4().hex
+        for doc in docs:
+            doc["batch_id"] = batch_id
+        queued = self.mongo_writer.submit(docs) if docs else 0
+        recorded_at = datetime.now(tz=self.tz) if now is None else datetime.fromtimestamp(now, tz=self.tz)
+        summaries = build_batch_summaries(batch_id, docs if live_docs is None else live_docs, recorded_at,
+                                          scope=scope, env=env)
+        self.rollup_writer.submit([dict(s) for s in summaries])
+        self.batch_writer.submit(summaries)
+        return batch_id, queued
+
+    def submit_events(self, events):
+        return self.event_writer.submit(events)
+
+    def submit_identities(self, docs):
+        return self.identity_writer.submit(docs)
+
+    def start(self):
+        for writer in self.writers.values():
+            writer.start()
+
+    def close(self):
+        for writer in self.writers.values():
+            writer.close()
+
+    def stats(self):
+        return {name: writer.stats() for name, writer in self.writers.items()}
+
+
+class MushroomStream:
+    # สถานะของกล้องหนึ่งตัว: tracker, การจับคู่ track -> mushroom_id, ข้อมูลล่าสุด และเซ็นเซอร์ที่ผูกไว้
+    def __init__(self, camera_id, location, tracker, size_estimator, distance_sensor, env_sensor, sink,
+                 scheduler=None, log_interval=3, tz=None, registry=None):
+        self.camera_id = camera_id
+        self.location = location
+        self.tracker = tracker
+        self.size_estimator = size_estimator
+        self.distance_sensor = distance_sensor
+        self.env_sensor = env_sensor
+        self.sink = sink
+        self.scheduler = scheduler
+        self.log_interval = log_interval
+        self.tz = tz
+        self.registry = registry if registry is not None else TrackRegistry()
+        self.registry.on_close = self._track_closed
+        self.last_log_time = 0
+        self.identity_saved = time.time()
+        self._detections_metric = DETECTIONS_PER_FRAME.labels(camera_id)
+        self._live_metric = LIVE_TRACKS.labels(camera_id)
+
+    def prepare(self, frame):
+        # ปรับขนาดภาพให้ตรงกับโมเดล
+        return cv2.resize(frame, FRAME_SIZE)
+
+    def wants_inference(self, frame, now=None):
+        # ภาพแทบไม่เปลี่ยน: ไม่ต้องรัน YOLO ใช้ผลตรวจจับและสถานะ DeepSort เดิม
+        return self.scheduler is None or self.scheduler.should_infer(frame, now)
+
+    def track(self, frame_id, captured_at, frame, detections):
+        # detections เป็น None เมื่อข้ามการตรวจจับในเฟรมนี้
+        if detections is None:
+            return len(self.registry)
+        self._detections_metric.observe(len(detections))
+
+        # อ่านระยะล่าสุดจากเซ็นเซอร์ A02YYUW (ไม่รอ)
+        distance_reading = self.distance_sensor.latest()
+
+        # ติดตามด้วย DeepSort
+        tracks = self.tracker.update_tracks(detections, frame=frame)
+
+        # track ที่ registry evict ไปแล้วไม่นับจนกว่า DeepSort จะลบ (กัน id ใหม่ซ้ำ ๆ ตอน track เต็ม)
+        confirmed = [track for track in tracks if track.is_confirmed() and self.registry.admits(track.track_id)]
+        if confirmed and distance_reading is None:
+            log.warning("no_distance", "{camera}: ยังไม่มีค่าระยะ - ข้ามการวัดขนาดในเฟรมนี้", camera=self.camera_id)
+        elif confirmed:
+            distance_mm = distance_reading.value[0]
+            boxes = np.array([track.to_tlbr() for track in confirmed], dtype=np.float32)
+            identity = self.registry.identity
+            centers = embeddings = None
+            if identity is not None:
+                # คำนวณ embedding ก่อนวาดกรอบลงภาพ
+                centers = (boxes[:, 0:2] + boxes[:, 2:4]) / 2
+                embeddings = appearance_embeddings(frame, boxes)
+            ids = np.asarray(self.registry.assign([track.track_id for track in confirmed], captured_at,
+                                                  centers, embeddings), dtype=np.int32)
+            if identity is not None:
+                identity.observe(ids, centers, embeddings, captured_at)
+
+            # วัดขนาด/จัดระดับความพร้อมของทุกดอกในเฟรมพร้อมกัน
+            records = self.size_estimator.measure(ids, boxes, distance_mm, captured_at)
+            records["distance_stale"] = self.distance_sensor.is_stale(captured_at)
+            self.registry.update(records)
+
+            for record in records:
+                x1, y1, x2, y2 = int(record["x1"]), int(record["y1"]), int(record["x2"]), int(record["y2"])
+                label_text = f'ID:{record["mushroom_id"]} Size:{record["width_cm"]:.2f}cm ({self.size_estimator.label(record)})'
+                cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
+                cv2.putText(frame, label_text, (x1, y1 - 10),
+                            cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
+
+            log.debug("frame_tracked", "{camera} เฟรม {frame}: ติดตามเห็ด {tracked} ดอก ระยะ {distance_mm:.0f} mm",
+                      camera=self.camera_id, frame=frame_id, tracked=len(records), distance_mm=distance_mm)
+
+        # ปิด track ที่ DeepSort ลบไปแล้ว/ไม่ได้อัปเดตนานเกินไป
+        self.registry.expire({track.track_id for track in tracks}, captured_at)
+
+        # sink อ่านข้อมูลจาก registry เอง ส่งต่อแค่จำนวนดอกที่ยังติดตามอยู่
+        self._live_metric.set(len(self.registry))
+        return len(self.registry)
+
+    def maybe_flush(self, live_tracks, now=None):
+        # บันทึกเมื่อครบ log_interval คืนค่า batch_id หรือ None
+        # ชั้นที่ไม่มีเห็ดก็ยังส่งสรุป (ค่าสภาพแวดล้อม, rollup, alert) ตามรอบ live_docs จะว่างเท่านั้น
+        now = time.time() if now is None else now
+        if now - self.last_log_time < self.log_interval:
+            return None
+        self.last_log_time = now
+        live = self.registry.live_records()
+        log.debug("flush", "{camera}: เวลาเกิน {interval} วิ - เตรียมส่งข้อมูลเห็ดจำนวน {live}",
+                  camera=self.camera_id, interval=self.log_interval, live=len(live))
+
+        env_reading = self.env_sensor.latest()
+        if env_reading is None:
+            log.warning("no_env", "{camera}: ข้ามบันทึกข้อมูลเพราะยังไม่เคยอ่านค่า DHT11 ได้", camera=self.camera_id)
+            return None
+
+        temperature_c, humidity = env_reading.value
+        env_stale = self.env_sensor.is_stale(now)
+        log.debug("env", "อ่านค่าได้ Temp: {temperature_c:.1f}°C, Humidity: {humidity:.1f}% stale={stale}",
+                  temperature_c=temperature_c, humidity=humidity, stale=env_stale)
+        env = {"temperature_c": temperature_c, "humidity_percent": humidity, "env_stale": env_stale}
+        # บันทึกเฉพาะดอกที่ขนาด/ระดับเปลี่ยน ส่วนสรุปสถานะนับจากทุกดอกที่ยังติดตามอยู่
+        docs_to_insert = [self._document(record, env) for record in self.registry.take_changed()]
+        live_docs = [self._document(record, env) for record in live]
+        batch_id, queued = self.sink.submit(docs_to_insert, live_docs, now, scope=(self.camera_id, self.location),
+                                            env=env)
+        log.debug("flushed", "✅ {camera}: ส่งข้อมูลเข้าคิวบันทึก {queued} รายการ (เปลี่ยนแปลง {changed}/{live} ดอก, batch {batch_id})",
+                  camera=self.camera_id, queued=queued, changed=len(docs_to_insert), live=len(live), batch_id=batch_id)
+        if log.enabled("debug"):
+            for d in docs_to_insert:
+                log.debug("doc", "{doc}", doc=d)
+        if now - self.identity_saved >= IDENTITY_SAVE_INTERVAL:
+            self.save_identity(now)
+        return batch_id
+
+    def save_identity(self, now=None):
+        identity = self.registry.identity
+        if identity is None:
+            return
+        now = time.time() if now is None else now
+        self.identity_saved = now
+        removed = identity.prune(now)
+        if identity.path:
+            try:
+                identity.save()
+            except OSError as e:
+                log.warning("identity_save_failed", "บันทึก re-ID index ลงไฟล์ไม่สำเร็จ: {error}", error=e)
+        docs = identity.take_dirty()
+        if docs:
+            self.sink.submit_identities(docs)
+        log.info("identity_saved", "{camera}: บันทึก re-ID index {size} ดอก (อัปเดต {updated}, ลบ {removed})",
+                 camera=self.camera_id, size=len(identity), updated=len(docs), removed=removed)
+
+    def close(self, now=None):
+        self.save_identity(now)
+
+    def _document(self, record, env):
+        doc = self.size_estimator.to_document(record, self.camera_id, self.location, self.tz)
+        doc.update(env)
+        return doc
+
+    def _track_closed(self, state, reason):
+        event = self.size_estimator.to_document(state.record, self.camera_id, self.location, self.tz)
+        event["event"] = "track_closed"
+        event["reason"] = reason
+        event["first_seen"] = datetime.fromtimestamp(state.first_seen, tz=self.tz)
+        event["last_seen"] = datetime.fromtimestamp(state.last_seen, tz=self.tz)
+        self.sink.submit_events([event])
+        log.info("track_closed", "{camera}: เลิกติดตามเห็ด ID {mushroom_id} ({reason}) ขนาดสุดท้าย {size_cm:.2f}cm {status}",
+                 camera=self.camera_id, mushroom_id=state.mushroom_id, reason=reason,
+                 size_cm=event["real_size_cm"], status=event["maturity_status"])
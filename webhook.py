@@ -1,92 +1,219 @@
-import time
-import requests
-from flask import Flask, request
+import atexit
+import base64
+import hashlib
+import hmac
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, Response, request
 from pymongo import MongoClient
 from datetime import datetime, timedelta, timezone
-from dateutil.parser import parse
 import threading
+from storage import MushroomStore, as_utc, open_batch_collection, open_mushroom_collection
+from rollups import RollupEngine, open_rollup_collection
+from line_client import LINE_API_BASE, LineClient, LineSender
+from alerts import AlertEngine, load_rules, watch_inserts
+from growth import GrowthCache, HORIZONS_H, format_eta, open_growth_collection
+from response_cache import MemoryBackend, ResponseCache, SqliteBackend
+from instrumentation import METRICS_DIR, REGISTRY, EventLog, counter, gauge, histogram, profile_response
 
 LINE_ACCESS_TOKEN = "Link"
-MONGO_URI = "uri"
+LINE_CHANNEL_SECRET = os.environ.get("LINE_CHANNEL_SECRET", "input your channel secret")
+# ตั้ง LINE_API_BASE=http://127.0.0.1:8090 เพื่อทดสอบกับ line_stub.py
+line_api_base = os.environ.get("LINE_API_BASE", LINE_API_BASE)
+MONGO_URI = os.environ.get("MONGO_URI", "uri")
 DB_NAME = "mushroom_db"
 COLLECTION_NAME = "mushroom_data"
 
 app = Flask(__name__)
 client = MongoClient(MONGO_URI)
-collection = client[DB_NAME][COLLECTION_NAME]
+collection = open_mushroom_collection(client[DB_NAME], COLLECTION_NAME)
+line_client = LineClient(LINE_ACCESS_TOKEN, base_url=line_api_base)
+line_sender = LineSender(line_client)
+batch_store = MushroomStore(open_batch_collection(client[DB_NAME]))
+rollup_engine = RollupEngine(open_rollup_collection(client[DB_NAME]), collection)
+# เส้นการเติบโตของเห็ดแต่ละดอก โหลดครั้งแรกและอัปเดตตามรอบบันทึกใหม่ใน thread เบื้องหลัง
+growth_cache = GrowthCache(collection, open_growth_collection(client[DB_NAME]))
+atexit.register(growth_cache.close)
+
+# cache ข้อความตอบกลับ อายุเท่ากับรอบการบันทึก (log_interval ใน maincode.py) และล้างเมื่อมีรอบใหม่
+# ตั้ง RESPONSE_CACHE_DB=/dev/shm/mushroom_cache.sqlite ให้ทุก worker ของ gunicorn ใช้ cache (และการล้าง cache) ร่วมกัน
+# gunicorn.conf.py ตั้งให้เองเมื่อมีมากกว่าหนึ่ง worker ไม่ตั้งจะเป็น cache ในหน่วยความจำของ process นี้เท่านั้น
+RESPONSE_CACHE_TTL = float(os.environ.get("RESPONSE_CACHE_TTL", 3))
+RESPONSE_CACHE_DB = os.environ.get("RESPONSE_CACHE_DB")
+response_cache = ResponseCache(RESPONSE_CACHE_TTL,
+                               SqliteBackend(RESPONSE_CACHE_DB) if RESPONSE_CACHE_DB else MemoryBackend())
+
+def on_new_batch(summary):
+    response_cache.invalidate()
+    growth_cache.on_batch(summary)
+
+def watch_batches():
+    growth_cache.load_until_ready()
+    watch_inserts(batch_store.collection, on_new_batch)
+
+threading.Thread(target=watch_batches, name="batch-watch", daemon=True).start()
+
+# ตัววัดผลที่ /metrics (รวมทุก worker เมื่อตั้ง METRICS_DIR) ดู instrumentation.py
+COMMANDS = ("สถานะเห็ด", "อุณหภูมิ", "ความชื้น", "อุณหภูมิย้อนหลัง", "ความชื้นย้อนหลัง", "คาดการณ์เก็บเกี่ยว", "ช่วยเหลือ")
+HANDLER_SECONDS = histogram("webhook_handler_seconds", "Time to build and queue a reply, per command", ("command",))
+MONGO_QUERY_SECONDS = histogram("webhook_mongo_query_seconds", "MongoDB query time on cache misses", ("query",))
+EVENTS_SHED = counter("webhook_events_shed_total", "LINE events dropped because the event backlog was full")
+
+def response_cache_lookups():
+    stats = response_cache.stats()
+    return {result: stats[result] for result in ("hits", "misses", "coalesced", "shared_waits")}
+
+gauge("response_cache_lookups_total", "Response cache lookups by result", ("result",), fn=response_cache_lookups,
+      kind="counter")
+gauge("response_cache_invalidations_total", "Response cache generation bumps", kind="counter",
+      fn=lambda: response_cache.invalidations)
+gauge("line_sender_queue_depth", "Replies waiting to be sent to LINE", fn=line_sender.pending)
+if METRICS_DIR:
+    REGISTRY.start_snapshots(METRICS_DIR)
+log = EventLog("webhook")
+
+# ประมวลผล event ในหนึ่งการส่งพร้อมกันหลาย thread และไม่ให้ request ต้องรอ Mongo/LINE
+event_pool = ThreadPoolExecutor(max_workers=int(os.environ.get("WEBHOOK_EVENT_THREADS", 8)),
+                                thread_name_prefix="line-event")
+# ThreadPoolExecutor มีคิวไม่จำกัด จำกัดจำนวน event ที่รอ/กำลังทำไว้ ถ้าเต็มให้ทิ้ง event ใหม่
+# (ถ้าคิวลึกขนาดนี้ reply token ก็จะหมดอายุก่อนได้ตอบอยู่ดี)
+event_slots = threading.BoundedSemaphore(int(os.environ.get("WEBHOOK_MAX_PENDING_EVENTS", 200)))
+
+# จำนวนวันย้อนหลังตั้งต้น ผู้ใช้พิมพ์ตัวเลขต่อท้ายคำสั่งได้ เช่น "อุณหภูมิย้อนหลัง 7"
+HISTORY_DAYS = 3
+MAX_HISTORY_DAYS = 365
 
 QUICK_REPLY_ITEMS = [
     {"type": "action", "action": {"type": "message", "label": "สถานะเห็ด", "text": "สถานะเห็ด"}},
     {"type": "action", "action": {"type": "message", "label": "อุณหภูมิ", "text": "อุณหภูมิ"}},
     {"type": "action", "action": {"type": "message", "label": "ความชื้น", "text": "ความชื้น"}},
+    {"type": "action", "action": {"type": "message", "label": "คาดการณ์เก็บเกี่ยว", "text": "คาดการณ์เก็บเกี่ยว"}},
     {"type": "action", "action": {"type": "message", "label": "ช่วยเหลือ", "text": "ช่วยเหลือ"}},
 ]
 
 def send_line_reply(reply_token, text):
-    url = "https://api.line.me/v2/bot/message/reply"
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {LINE_ACCESS_TOKEN}"
-    }
-    data = {
-        "replyToken": reply_token,
-        "messages": [{
-            "type": "text",
-            "text": text,
-            "quickReply": {"items": QUICK_REPLY_ITEMS}
-        }]
-    }
-    requests.post(url, json=data, headers=headers)
+    # ไม่รอ LINE ตอบ ส่งผ่านคิวเบื้องหลังเพื่อให้ webhook ตอบ 200 ได้ทันที
+    messages = [{
+        "type": "text",
+        "text": text,
+        "quickReply": {"items": QUICK_REPLY_ITEMS}
+    }]
+    return line_sender.reply_async(reply_token, messages)
+
+def verify_signature(body, signature):
+    # X-Line-Signature = base64(HMAC-SHA256(channel secret, body)) เทียบแบบ constant-time
+    if not signature:
+        return False
+    digest = hmac.new(LINE_CHANNEL_SECRET.encode(), body, hashlib.sha256).digest()
+    return hmac.compare_digest(base64.b64encode(digest), signature.encode())
 
 @app.route("/webhook", methods=["POST"])
 def webhook():
-    data = request.get_json()
-    for event in data.get("events", []):
-        if event.get("type") == "message":
-            user_text = event["message"]["text"].strip().lower()
-            reply_token = event["replyToken"]
-
-            if user_text == "สถานะเห็ด":
-                handle_status(reply_token)
-            elif user_text in ["อุณหภูมิ", "ความชื้น"]:
-                handle_latest_env(reply_token, user_text)
-            elif user_text in ["อุณหภูมิย้อนหลัง", "ความชื้นย้อนหลัง"]:
-                handle_env_history(reply_token, user_text)
-            elif user_text == "ช่วยเหลือ":
-                send_line_reply(reply_token, "☎️ ติดต่อสอบถามได้ที่: 0948741544")
-            else:
-                send_line_reply(reply_token, (
-                    "คำสั่งที่สามารถใช้ได้:\n"
-                    "- สถานะเห็ด\n"
-                    "- อุณหภูมิ\n"
-                    "- ความชื้น\n"
-                    "- อุณหภูมิย้อนหลัง\n"
-                    "- ความชื้นย้อนหลัง\n"
-                    "- ช่วยเหลือ"
-                ))
+    # ตรวจลายเซ็นก่อนแปลง JSON เพื่อปัด request ปลอมทิ้งให้เร็วที่สุด
+    body = request.get_data()
+    if not verify_signature(body, request.headers.get("X-Line-Signature")):
+        return "Invalid signature", 403
+    try:
+        data = json.loads(body)
+    except ValueError:
+        return "Bad request", 400
+    events = data.get("events", []) if isinstance(data, dict) else None
+    if not isinstance(events, list):
+        return "Bad request", 400
+
+    for event in events:
+        if not event_slots.acquire(blocking=False):
+            EVENTS_SHED.inc()
+            log.warning("events_shed", "event รอประมวลผลเต็ม - ทิ้ง event นี้")
+            continue
+        try:
+            event_pool.submit(run_event, event)
+        except Exception:
+            # ส่งเข้า pool ไม่ได้ (เช่น pool ถูกปิดแล้ว) run_event จะไม่ได้คืนช่อง ต้องคืนเองตรงนี้
+            event_slots.release()
+            raise
     return "OK", 200
 
-def handle_status(reply_token):
-    timestamps = collection.distinct("timestamp")
-    if len(timestamps) < 2:
-        send_line_reply(reply_token, "❌ ไม่มีข้อมูลเห็ดเพียงพอ")
-        return
-
-    timestamps_dt = sorted([parse(ts).astimezone(timezone.utc) for ts in timestamps], reverse=True)
-    target_ts = timestamps_dt[1]
-    start_time = target_ts - timedelta(milliseconds=100)
-    end_time = target_ts + timedelta(milliseconds=100)
-
-    latest_docs = list(collection.find({
-        "timestamp": {"$gte": start_time.isoformat(), "$lte": end_time.isoformat()}
-    }))
-
-    if not latest_docs:
-        send_line_reply(reply_token, "❌ ไม่พบข้อมูลเห็ดในช่วงเวลาที่กำหนด")
-        return
+def run_event(event):
+    try:
+        handle_event(event)
+    finally:
+        event_slots.release()
+
+@app.route("/stats", methods=["GET"])
+def stats():
+    return {"response_cache": response_cache.stats(), "line_api": line_client.latency.stats()}
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    return Response(REGISTRY.render(METRICS_DIR), mimetype="text/plain; version=0.0.4")
+
+@app.route("/debug/profile", methods=["GET"])
+def debug_profile():
+    # เปิดใช้เมื่อตั้ง PROFILER_ENABLED=1 เท่านั้น profile เฉพาะ worker ที่รับ request นี้
+    status, body = profile_response(request.args)
+    return Response(body, status=status, mimetype="text/plain")
+
+def handle_event(event):
+    try:
+        if not isinstance(event, dict) or event.get("type") != "message" or event["message"].get("type") != "text":
+            return
+        user_text = event["message"]["text"].strip().lower()
+        reply_token = event["replyToken"]
+        command = user_text.split()[0] if user_text else ""
+
+        with HANDLER_SECONDS.labels(command if command in COMMANDS else "other").time():
+            dispatch(reply_token, user_text, command)
+    except Exception as e:
+        log.error("handler_error", "Error handling event: {error}", error=e)
+
+def dispatch(reply_token, user_text, command):
+    if user_text == "สถานะเห็ด":
+        handle_status(reply_token)
+    elif user_text in ["อุณหภูมิ", "ความชื้น"]:
+        handle_latest_env(reply_token, user_text)
+    elif command in ["อุณหภูมิย้อนหลัง", "ความชื้นย้อนหลัง"]:
+        handle_env_history(reply_token, user_text)
+    elif command == "คาดการณ์เก็บเกี่ยว":
+        handle_harvest_forecast(reply_token, user_text)
+    elif user_text == "ช่วยเหลือ":
+        send_line_reply(reply_token, "☎️ ติดต่อสอบถามได้ที่: 0948741544")
+    else:
+        send_line_reply(reply_token, (
+            "คำสั่งที่สามารถใช้ได้:\n"
+            "- สถานะเห็ด\n"
+            "- อุณหภูมิ\n"
+            "- ความชื้น\n"
+            "- อุณหภูมิย้อนหลัง [จำนวนวัน]\n"
+            "- ความชื้นย้อนหลัง [จำนวนวัน]\n"
+            "- คาดการณ์เก็บเกี่ยว [ชั้นวาง]\n"
+            "- ช่วยเหลือ"
+        ))
 
-    mature_count = sum(1 for doc in latest_docs if doc.get("maturity_status", "").lower() == "mature")
-    immature_count = len(latest_docs) - mature_count
+def handle_status(reply_token):
+    send_line_reply(reply_token, response_cache.get_or_compute("status", status_text))
+
+def status_text():
+    # หลายกล้อง/ชั้นวาง: ใช้สรุปล่าสุดของแต่ละชั้นวาง แล้วตอบรวมพร้อมแยกรายชั้นวาง
+    with MONGO_QUERY_SECONDS.labels("latest_batch").time():
+        summaries = batch_store.latest_per_scope()
+    if not summaries:
+        return "❌ ไม่มีข้อมูลเห็ดเพียงพอ"
+    if len(summaries) == 1:
+        return shelf_status_text(summaries[0])
+
+    mature_total = sum(s["mature_count"] for s in summaries)
+    immature_total = sum(s["immature_count"] for s in summaries)
+    parts = [f"🍄 รวม {len(summaries)} ชั้นวาง: พร้อมเก็บ {mature_total} ดอก, ยังไม่พร้อม {immature_total} ดอก"]
+    for summary in summaries:
+        parts.append(f"📍 {summary['location']} ({summary['camera_id']})\n{shelf_status_text(summary)}")
+    return "\n\n".join(parts)
+
+def shelf_status_text(summary):
+    target_ts = as_utc(summary["timestamp"])
+    mature_count = summary["mature_count"]
+    immature_count = summary["immature_count"]
     total = mature_count + immature_count
 
     if total == 0:
@@ -99,140 +226,111 @@ def handle_status(reply_token):
             f"⏳ ยังไม่พร้อม: {immature_count} ดอก\n"
             f"⏰ เวลา: {target_ts.strftime('%Y-%m-%d %H:%M:%S')}"
         )
-    send_line_reply(reply_token, reply_text)
+    return reply_text
 
 def handle_latest_env(reply_token, user_text):
-    latest_doc = collection.find_one(sort=[("timestamp", -1)])
-    if not latest_doc:
-        send_line_reply(reply_token, "❌ ไม่มีข้อมูลล่าสุด")
-        return
-
-    ts_str = latest_doc["timestamp"]
-    ts = parse(ts_str).astimezone(timezone.utc)
-    docs = list(collection.find({"timestamp": ts_str}))
-    if not docs:
-        send_line_reply(reply_token, "❌ ไม่มีข้อมูลล่าสุด")
-        return
-
-    avg_temp = sum(float(doc.get("temperature_c", 0)) for doc in docs) / len(docs)
-    avg_humidity = sum(float(doc.get("humidity_percent", 0)) for doc in docs) / len(docs)
-
-    if user_text == "อุณหภูมิ":
-        reply_text = f"🌡️ อุณหภูมิเฉลี่ย ({ts.strftime('%Y-%m-%d %H:%M:%S')}): {avg_temp:.2f}°C"
-    else:
-        reply_text = f"💦 ความชื้นเฉลี่ย ({ts.strftime('%Y-%m-%d %H:%M:%S')}): {avg_humidity:.2f}%"
-
-    send_line_reply(reply_token, reply_text)
+    send_line_reply(reply_token, response_cache.get_or_compute(f"env:{user_text}", lambda: latest_env_text(user_text)))
+
+def latest_env_text(user_text):
+    with MONGO_QUERY_SECONDS.labels("latest_batch").time():
+        summaries = batch_store.latest_per_scope()
+    if not summaries:
+        return "❌ ไม่มีข้อมูลล่าสุด"
+
+    lines = []
+    for summary in summaries:
+        ts = as_utc(summary["timestamp"])
+        if user_text == "อุณหภูมิ":
+            reply_text = f"🌡️ อุณหภูมิเฉลี่ย ({ts.strftime('%Y-%m-%d %H:%M:%S')}): {float(summary['temperature_c']):.2f}°C"
+        else:
+            reply_text = f"💦 ความชื้นเฉลี่ย ({ts.strftime('%Y-%m-%d %H:%M:%S')}): {float(summary['humidity_percent']):.2f}%"
+        # มีชั้นวางเดียวตอบรูปแบบเดิม
+        lines.append(reply_text if len(summaries) == 1 else f"📍 {summary['location']} - {reply_text}")
+    return "\n".join(lines)
+
+def parse_history_days(user_text):
+    parts = user_text.split()
+    if len(parts) > 1 and parts[1].isdigit():
+        return min(max(int(parts[1]), 1), MAX_HISTORY_DAYS)
+    return HISTORY_DAYS
 
 def handle_env_history(reply_token, user_text):
-    now = datetime.now(timezone.utc)
-    three_days_ago = now - timedelta(days=3)
+    command = user_text.split()[0]
+    days = parse_history_days(user_text)
+    send_line_reply(reply_token, response_cache.get_or_compute(f"history:{command}:{days}",
+                                                               lambda: env_history_text(command, days)))
 
-    docs = list(collection.find({
-        "timestamp": {"$gte": three_days_ago.isoformat(), "$lte": now.isoformat()}
-    }))
-    if not docs:
-        send_line_reply(reply_token, f"❌ ไม่มีข้อมูล{user_text}ย้อนหลัง 3 วัน")
-        return
+def env_history_text(command, days):
+    now = datetime.now(timezone.utc)
+    start = now - timedelta(days=days)
 
-    if user_text == "อุณหภูมิย้อนหลัง":
-        values = [float(doc.get("temperature_c", 0)) for doc in docs]
+    if command == "อุณหภูมิย้อนหลัง":
+        metric = "temperature_c"
         label = "อุณหภูมิ (°C)"
     else:
-        values = [float(doc.get("humidity_percent", 0)) for doc in docs]
+        metric = "humidity_percent"
         label = "ความชื้น (%)"
 
-    avg_val = sum(values) / len(values)
-    max_val = max(values)
-    min_val = min(values)
+    with MONGO_QUERY_SECONDS.labels("rollup_summary").time():
+        stats = rollup_engine.summarize(metric, start, now)
+    if not stats:
+        return f"❌ ไม่มีข้อมูล{command}ย้อนหลัง {days} วัน"
+
+    avg_val = stats["avg"]
+    max_val = stats["max"]
+    min_val = stats["min"]
 
     reply_text = (
-        f"📊 {label}ย้อนหลัง 3 วัน\n"
+        f"📊 {label}ย้อนหลัง {days} วัน\n"
         f"เฉลี่ย: {avg_val:.2f}\n"
         f"สูงสุด: {max_val:.2f}\n"
         f"ต่ำสุด: {min_val:.2f}"
     )
-    send_line_reply(reply_token, reply_text)
-
-TEMP_HIGH_THRESHOLD = 35.0
-TEMP_LOW_THRESHOLD = 15.0
-HUMIDITY_HIGH_THRESHOLD = 80.0
-HUMIDITY_LOW_THRESHOLD = 50.0
-ALERT_INTERVAL = 600
-
-last_alert_time = datetime.min.replace(tzinfo=timezone.utc)
-alerted_status = {
-    "temp_high": False,
-    "temp_low": False,
-    "humidity_high": False,
-    "humidity_low": False
-}
+    return reply_text
+
+def handle_harvest_forecast(reply_token, user_text):
+    # ตอบจากค่าที่ฟิตไว้ในหน่วยความจำ ไม่ต้องอ่าน MongoDB ตอนรับคำสั่ง
+    if not growth_cache.ready.is_set():
+        send_line_reply(reply_token, "⏳ กำลังโหลดข้อมูลการเติบโต กรุณาลองใหม่อีกครั้ง")
+        return
+
+    parts = user_text.split()
+    location = parts[1] if len(parts) > 1 else None
+    summary = growth_cache.summary(location=location)
+    if summary["total"] == 0:
+        send_line_reply(reply_token, "❌ ไม่มีข้อมูลการเติบโตของเห็ด" + (f"ที่ {location}" if location else ""))
+        return
+
+    lines = [f"🍄 คาดการณ์เก็บเกี่ยว{' ' + location if location else ''} ({summary['total']} ดอก)",
+             f"✅ พร้อมเก็บแล้ว: {summary['ready']} ดอก"]
+    for horizon, count in zip(HORIZONS_H, summary["within"]):
+        lines.append(f"⏳ ภายใน {horizon} ชม.: {count} ดอก")
+    lines.append(f"📅 มากกว่า {HORIZONS_H[-1]} ชม.: {summary['later']} ดอก")
+    if summary["unknown"]:
+        lines.append(f"❔ ข้อมูลยังไม่พอ: {summary['unknown']} ดอก")
+    if summary["next_eta"] is not None:
+        lines.append(f"⏰ ดอกถัดไปพร้อมประมาณ: {format_eta(summary['next_eta'])} (เวลาไทย)")
+    send_line_reply(reply_token, "\n".join(lines))
+
+# กฎแจ้งเตือนตั้งต้นอยู่ใน alerts.py ตั้ง ALERT_RULES_FILE เพื่อกำหนดกฎต่อกล้อง/ชั้นวางเอง
+ALERT_RULES_FILE = os.environ.get("ALERT_RULES_FILE")
 
 def send_line_broadcast(text):
-    url = "https://api.line.me/v2/bot/message/broadcast"
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {LINE_ACCESS_TOKEN}"
-    }
-    payload = {
-        "messages": [{"type": "text", "text": text}]
-    }
-    requests.post(url, headers=headers, json=payload)
+    # เรียกจาก thread ตรวจสภาพแวดล้อมอยู่แล้ว จึงส่งแบบรอผล (มี retry ในตัว)
+    return line_client.broadcast([{"type": "text", "text": text}])
 
 def check_environment():
-    global last_alert_time, alerted_status
-    while True:
-        try:
-            doc = collection.find_one(sort=[("timestamp", -1)])
-            if not doc:
-                time.sleep(ALERT_INTERVAL)
-                continue
-
-            ts = parse(doc["timestamp"]).astimezone(timezone.utc)
-            if (ts - last_alert_time).total_seconds() < ALERT_INTERVAL:
-                time.sleep(ALERT_INTERVAL)
-                continue
-
-            temp = float(doc.get("temperature_c", 0))
-            humidity = float(doc.get("humidity_percent", 0))
-            alerts = []
-
-            if temp > TEMP_HIGH_THRESHOLD and not alerted_status["temp_high"]:
-                alerts.append(f"🔥 อุณหภูมิสูงเกิน {TEMP_HIGH_THRESHOLD}°C\n🌡️ ตอนนี้: {temp:.1f}°C")
-                alerted_status["temp_high"] = True
-            elif temp <= TEMP_HIGH_THRESHOLD:
-                alerted_status["temp_high"] = False
-
-            if temp < TEMP_LOW_THRESHOLD and not alerted_status["temp_low"]:
-                alerts.append(f"❄️ อุณหภูมิต่ำเกิน {TEMP_LOW_THRESHOLD}°C\n🌡️ ตอนนี้: {temp:.1f}°C")
-                alerted_status["temp_low"] = True
-            elif temp >= TEMP_LOW_THRESHOLD:
-                alerted_status["temp_low"] = False
-
-            if humidity > HUMIDITY_HIGH_THRESHOLD and not alerted_status["humidity_high"]:
-                alerts.append(f"💧 ความชื้นสูงเกิน {HUMIDITY_HIGH_THRESHOLD}%\n💦 ตอนนี้: {humidity:.1f}%")
-                alerted_status["humidity_high"] = True
-            elif humidity <= HUMIDITY_HIGH_THRESHOLD:
-                alerted_status["humidity_high"] = False
-
-            if humidity < HUMIDITY_LOW_THRESHOLD and not alerted_status["humidity_low"]:
-                alerts.append(f"⚠️ ความชื้นต่ำเกิน {HUMIDITY_LOW_THRESHOLD}%\n💦 ตอนนี้: {humidity:.1f}%")
-                alerted_status["humidity_low"] = True
-            elif humidity >= HUMIDITY_LOW_THRESHOLD:
-                alerted_status["humidity_low"] = False
-
-            if alerts:
-                msg = "⚠️ แจ้งเตือนสภาพแวดล้อมไม่เหมาะสม\n\n" + "\n\n".join(alerts) + f"\n\n⏰ เวลา: {ts.strftime('%Y-%m-%d %H:%M:%S')}"
-                send_line_broadcast(msg)
-                last_alert_time = ts
-
-        except Exception as e:
-            print("❌ Error:", e)
-
-        time.sleep(ALERT_INTERVAL)
-
-# Start monitoring thread
-threading.Thread(target=check_environment, daemon=True).start()
+    # แจ้งเตือนทันทีที่มีสรุปรอบใหม่เข้ามา (change stream หรือ poll ถ้าใช้ไม่ได้)
+    engine = AlertEngine(load_rules(ALERT_RULES_FILE), send_line_broadcast)
+    watch_inserts(batch_store.collection, engine.evaluate)
+
+def start_monitor():
+    # ต้องมี monitor แค่ตัวเดียวต่อระบบ: ตอนรันบน gunicorn ให้รัน monitor.py แยกอีก process
+    thread = threading.Thread(target=check_environment, name="env-monitor", daemon=True)
+    thread.start()
+    return thread
 
 if __name__ == "__main__":
-    app.run(debug=True, port=5050)
+    # โหมดพัฒนา: process เดียว รวม monitor ไว้ในตัว
+    start_monitor()
+    app.run(debug=True, port=5050, use_reloader=False)